@@ -0,0 +1,154 @@
+from time import perf_counter
+from typing import Optional
+import asyncio
+import fcntl
+import heapq
+import itertools
+import os
+
+import metrics
+
+# Concurrent sessions per team address across all workers, 0 disables admission control
+ADMISSION_LIMIT = int(os.getenv("BAMBI_ADMISSION_LIMIT", "0"))
+ADMISSION_DIR = os.getenv("BAMBI_ADMISSION_DIR", "/tmp/bambi-admission")
+# Slots freed by other workers are only noticed by polling
+ADMISSION_POLL = float(os.getenv("BAMBI_ADMISSION_POLL", "0.02"))
+
+FLAG = 0
+OTHER = 1
+
+
+def _lock(fd: int, mode: int) -> bool:
+    try:
+        fcntl.flock(fd, mode | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+class Target():
+    """Slot lock files of one address and this worker's queue waiting for them."""
+
+    __slots__ = ("free", "flag_wait", "flag_check", "flag_waiters", "flag_marked", "queue")
+
+    def __init__(self, path: str, limit: int) -> None:
+        self.free = [os.open(f"{path}.{i}", os.O_RDWR | os.O_CREAT, 0o600) for i in range(limit)]
+        # Held shared while a flag task of this worker waits, other workers' noise
+        # and havoc tasks probe it exclusively before taking a slot
+        self.flag_wait = os.open(f"{path}.flag", os.O_RDWR | os.O_CREAT, 0o600)
+        self.flag_check = os.open(f"{path}.flag", os.O_RDWR | os.O_CREAT, 0o600)
+        self.flag_waiters = 0
+        self.flag_marked = False
+        self.queue: list[list] = []
+
+
+class Admission():
+    """Cap concurrent sessions per team address, shared by all gunicorn workers.
+
+    A slot is an flock on one of `limit` files per address, so slots held by
+    a worker that dies are released by the kernel. Within a worker waiters
+    are served by priority, then arrival. Across workers free slots go to
+    whoever polls first, except that putflag/getflag waiting anywhere keeps
+    the other methods out.
+    """
+
+    def __init__(self, limit: int = ADMISSION_LIMIT, directory: str = ADMISSION_DIR) -> None:
+        self.limit = limit
+        self.directory = directory
+        self.targets: dict[str, Target] = {}
+        self.seq = itertools.count()
+        self.admitted = 0
+        self.queued = 0
+        self.expired = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "targets": len(self.targets),
+            "held": sum(self.limit - len(t.free) for t in self.targets.values()),
+            "waiting": sum(len(t.queue) for t in self.targets.values()),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "expired": self.expired,
+        }
+
+    def target(self, address: str) -> Target:
+        target = self.targets.get(address)
+        if target is None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, address.replace("/", "_"))
+            target = self.targets[address] = Target(path, self.limit)
+        return target
+
+    def take(self, target: Target, priority: int) -> Optional[int]:
+        if priority != FLAG:
+            if not _lock(target.flag_check, fcntl.LOCK_EX):
+                return None
+            fcntl.flock(target.flag_check, fcntl.LOCK_UN)
+
+        for fd in target.free:
+            if _lock(fd, fcntl.LOCK_EX):
+                target.free.remove(fd)
+                return fd
+        return None
+
+    def mark(self, target: Target) -> None:
+        if target.flag_waiters and not target.flag_marked:
+            target.flag_marked = _lock(target.flag_wait, fcntl.LOCK_SH)
+        elif not target.flag_waiters and target.flag_marked:
+            fcntl.flock(target.flag_wait, fcntl.LOCK_UN)
+            target.flag_marked = False
+
+    def wake(self, target: Target) -> None:
+        if target.queue and not target.queue[0][2].done():
+            target.queue[0][2].set_result(None)
+
+    async def acquire(self, address: str, priority: int, deadline: float) -> int:
+        """Wait for a slot of `address` until the loop time `deadline`, returns the slot to release."""
+        target = self.target(address)
+        start = perf_counter()
+        fd = None if target.queue else self.take(target, priority)
+        if fd is not None:
+            self.admitted += 1
+            metrics.current().step("admission", start)
+            return fd
+
+        loop = asyncio.get_running_loop()
+        waiter = [priority, next(self.seq), loop.create_future()]
+        heapq.heappush(target.queue, waiter)
+        if priority == FLAG:
+            target.flag_waiters += 1
+        self.queued += 1
+        try:
+            while True:
+                self.mark(target)
+                if target.queue[0] is waiter and (fd := self.take(target, priority)) is not None:
+                    break
+                timeout = min(ADMISSION_POLL, deadline - loop.time())
+                if timeout <= 0:
+                    self.expired += 1
+                    raise TimeoutError
+                await asyncio.wait({waiter[2]}, timeout=timeout)
+                if waiter[2].done():
+                    waiter[2] = loop.create_future()
+        finally:
+            target.queue.remove(waiter)
+            heapq.heapify(target.queue)
+            if priority == FLAG:
+                target.flag_waiters -= 1
+            self.mark(target)
+            self.wake(target)
+            metrics.current().step("admission", start)
+
+        self.admitted += 1
+        return fd
+
+    def release(self, address: str, fd: int) -> None:
+        target = self.targets[address]
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        target.free.append(fd)
+        self.wake(target)
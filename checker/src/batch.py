@@ -0,0 +1,60 @@
+from typing import AsyncIterator, Awaitable, Callable
+import asyncio
+import json
+import os
+
+from enochecker_core import CheckerResultMessage, CheckerTaskMessage, CheckerTaskResult
+# enochecker gives up on a task this long before its timeout
+from enochecker3.enochecker import TIMEOUT_BUFFER
+
+# Tasks of all batch requests running at once in one worker
+BATCH_CONCURRENCY = int(os.getenv("BAMBI_BATCH_CONCURRENCY", "64"))
+
+LIMIT = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+Handler = Callable[[CheckerTaskMessage], Awaitable[CheckerResultMessage]]
+
+
+async def run_task(handler: Handler, task: CheckerTaskMessage, received: float) -> CheckerResultMessage:
+    """Run one task through the single-task handler once a batch slot is free.
+
+    Time spent waiting for the slot comes off the task's timeout, so it
+    finishes when it would have had it been sent on its own.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = received + task.timeout / 1000 - TIMEOUT_BUFFER
+    try:
+        async with asyncio.timeout_at(deadline):
+            await LIMIT.acquire()
+    except TimeoutError:
+        return CheckerResultMessage(result=CheckerTaskResult.INTERNAL_ERROR, message="Batch queue timed out")
+
+    try:
+        waited = loop.time() - received
+        if waited > 0.001:
+            task = task.model_copy(update={"timeout": int(task.timeout - waited * 1000)})
+        return await handler(task)
+    finally:
+        LIMIT.release()
+
+
+async def run_batch(handler: Handler, tasks: list[CheckerTaskMessage]) -> AsyncIterator[bytes]:
+    """Run all tasks concurrently, yielding one NDJSON result line per task as it finishes."""
+    received = asyncio.get_running_loop().time()
+
+    async def indexed(index: int, task: CheckerTaskMessage):
+        try:
+            return index, await run_task(handler, task, received)
+        except Exception as e:
+            return index, CheckerResultMessage(result=CheckerTaskResult.INTERNAL_ERROR, message=str(e))
+
+    pending = [asyncio.create_task(indexed(i, task)) for i, task in enumerate(tasks)]
+    try:
+        for done in asyncio.as_completed(pending):
+            index, result = await done
+            line = {"index": index, "taskId": tasks[index].task_id, **result.model_dump(by_alias=True)}
+            yield json.dumps(line).encode() + b"\n"
+    finally:
+        # The engine went away mid-stream
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,259 @@
+"""Checker throughput benchmark.
+
+Drives every registered putflag/getflag/putnoise/getnoise/havoc/exploit
+variant against the local stand-in (or a real deployment with --address)
+at a fixed concurrency and reports tasks/sec and latency percentiles per
+method. ChainDB lives in memory unless --mongo is given.
+
+    python bench.py --chains 200 --concurrency 32 --latency 0.02
+"""
+from typing import Any, Optional
+import argparse
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+import time
+
+from enochecker_core import CheckerMethod
+from enochecker3 import (
+    ExploitCheckerTaskMessage,
+    GetflagCheckerTaskMessage,
+    GetnoiseCheckerTaskMessage,
+    HavocCheckerTaskMessage,
+    InternalErrorException,
+    MumbleException,
+    OfflineException,
+    PutflagCheckerTaskMessage,
+    PutnoiseCheckerTaskMessage,
+)
+
+import checker
+from standin import StandinService
+
+FLAG_REGEX = "ENO[A-Za-z0-9+/=]{48}"
+
+TASK_MESSAGES = {
+    CheckerMethod.PUTFLAG: PutflagCheckerTaskMessage,
+    CheckerMethod.GETFLAG: GetflagCheckerTaskMessage,
+    CheckerMethod.PUTNOISE: PutnoiseCheckerTaskMessage,
+    CheckerMethod.GETNOISE: GetnoiseCheckerTaskMessage,
+    CheckerMethod.HAVOC: HavocCheckerTaskMessage,
+    CheckerMethod.EXPLOIT: ExploitCheckerTaskMessage,
+}
+
+_task_ids = itertools.count(1)
+
+
+class MemoryCollection():
+    """Just enough of an AsyncCollection for ChainDB without a Mongo server."""
+
+    def __init__(self) -> None:
+        self.docs: dict[tuple[str, str], dict] = {}
+
+    async def find_one(self, query: dict) -> Optional[dict]:
+        return self.docs.get((query["task_chain_id"], query["key"]))
+
+    async def replace_one(self, query: dict, doc: dict, upsert: bool = False) -> None:
+        self.docs[(query["task_chain_id"], query["key"])] = doc
+
+    async def find(self, query: dict):
+        """Documents whose task_chain_id matches {"$in": [...]} or {"$regex": ...}."""
+        match = query["task_chain_id"]
+        if "$in" in match:
+            chain_ids = set(match["$in"])
+            matches = lambda chain_id: chain_id in chain_ids
+        else:
+            matches = re.compile(match["$regex"]).match
+        for (chain_id, _), doc in list(self.docs.items()):
+            if matches(chain_id):
+                yield doc
+
+
+def gen_flag() -> str:
+    return "ENO" + base64.b64encode(os.urandom(36)).decode()
+
+
+def make_task(method: CheckerMethod, variant: int, chain_id: str, address: str,
+              timeout: int = 15000, round_length: int = 60000, round_id: int = 1, **extra: Any):
+    return TASK_MESSAGES[method](
+        task_id=next(_task_ids),
+        address=address,
+        team_id=1,
+        team_name="bench",
+        current_round_id=round_id,
+        related_round_id=round_id,
+        variant_id=variant,
+        timeout=timeout,
+        round_length=round_length,
+        task_chain_id=chain_id,
+        **extra,
+    )
+
+
+async def run_task(task) -> tuple[str, Any, float]:
+    """Run one task like the checker app would; returns (result, value, seconds)."""
+    start = time.perf_counter()
+    try:
+        value = await checker.checker._call_method(task)
+        result = "OK"
+    except MumbleException:
+        value, result = None, "MUMBLE"
+    except OfflineException:
+        value, result = None, "OFFLINE"
+    except InternalErrorException:
+        value, result = None, "INTERNAL_ERROR"
+    except Exception:
+        value, result = None, "INTERNAL_ERROR"
+    return result, value, time.perf_counter() - start
+
+
+def percentile(samples: list[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+class Stats():
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = {}
+        self.results: dict[str, dict[str, int]] = {}
+
+    def record(self, label: str, result: str, seconds: float) -> None:
+        self.latencies.setdefault(label, []).append(seconds)
+        counts = self.results.setdefault(label, {})
+        counts[result] = counts.get(result, 0) + 1
+
+    def summary(self, elapsed: float) -> dict:
+        methods = {}
+        for label in sorted(self.latencies):
+            samples = self.latencies[label]
+            methods[label] = {
+                "tasks": len(samples),
+                "results": self.results[label],
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+            }
+        total = sum(len(s) for s in self.latencies.values())
+        return {
+            "elapsed_s": elapsed,
+            "tasks": total,
+            "tasks_per_s": total / elapsed if elapsed else 0.0,
+            "methods": methods,
+        }
+
+
+def print_summary(summary: dict) -> None:
+    print(f"{'method':<12} {'tasks':>6} {'ok':>6} {'fail':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for label, m in summary["methods"].items():
+        ok = m["results"].get("OK", 0)
+        print(f"{label:<12} {m['tasks']:>6} {ok:>6} {m['tasks'] - ok:>6} "
+              f"{m['p50_ms']:>9.1f} {m['p95_ms']:>9.1f} {m['p99_ms']:>9.1f}")
+    print(f"{summary['tasks']} tasks in {summary['elapsed_s']:.2f}s: {summary['tasks_per_s']:.1f} tasks/s")
+
+
+class Benchmark():
+    def __init__(self, address: str, concurrency: int, methods: set[str]) -> None:
+        self.address = address
+        self.limit = asyncio.Semaphore(concurrency)
+        self.methods = methods
+        self.stats = Stats()
+
+    async def task(self, method: CheckerMethod, variant: int, chain_id: str, **extra: Any) -> tuple[str, Any]:
+        task = make_task(method, variant, chain_id, self.address, **extra)
+        async with self.limit:
+            result, value, seconds = await run_task(task)
+        self.stats.record(f"{method.value}{variant}", result, seconds)
+        return result, value
+
+    async def flag_chain(self, n: int, variant: int) -> None:
+        flag = gen_flag()
+        chain_id = f"flag_s0_r1_t1_i{n}_v{variant}"
+        result, attack_info = await self.task(CheckerMethod.PUTFLAG, variant, chain_id, flag=flag)
+        if result != "OK":
+            return
+        if "getflag" in self.methods:
+            await self.task(CheckerMethod.GETFLAG, variant, chain_id, flag=flag)
+        if "exploit" in self.methods:
+            for exploit_variant in checker.checker._method_variants[CheckerMethod.EXPLOIT]:
+                result, found = await self.task(
+                    CheckerMethod.EXPLOIT, exploit_variant, f"exploit_{chain_id}",
+                    flag_regex=FLAG_REGEX, flag_hash=hashlib.sha256(flag.encode()).hexdigest(),
+                    attack_info=attack_info,
+                )
+                if result == "OK" and (not found or flag.encode() not in (found if isinstance(found, bytes) else found.encode())):
+                    self.stats.record(f"exploit{exploit_variant}", "MISSED", 0.0)
+
+    async def noise_chain(self, n: int, variant: int) -> None:
+        chain_id = f"noise_s0_r1_t1_i{n}_v{variant}"
+        result, _ = await self.task(CheckerMethod.PUTNOISE, variant, chain_id)
+        if result == "OK" and "getnoise" in self.methods:
+            await self.task(CheckerMethod.GETNOISE, variant, chain_id)
+
+    async def havoc(self, n: int, variant: int) -> None:
+        await self.task(CheckerMethod.HAVOC, variant, f"havoc_s0_r1_t1_i{n}_v{variant}")
+
+    async def run(self, chains: int) -> dict:
+        variants = checker.checker._method_variants
+        jobs = []
+        for n in range(chains):
+            if "putflag" in self.methods:
+                jobs += [self.flag_chain(n, v) for v in variants[CheckerMethod.PUTFLAG]]
+            if "putnoise" in self.methods:
+                jobs += [self.noise_chain(n, v) for v in variants[CheckerMethod.PUTNOISE]]
+            if "havoc" in self.methods:
+                jobs += [self.havoc(n, v) for v in variants[CheckerMethod.HAVOC]]
+
+        start = time.perf_counter()
+        await asyncio.gather(*jobs)
+        return self.stats.summary(time.perf_counter() - start)
+
+
+async def run_benchmark(args) -> dict:
+    # Start like a preloaded gunicorn worker, so the first tasks don't build the noise corpus
+    checker.preload()
+    if args.mongo:
+        await checker.checker._init()
+    else:
+        checker.checker._chain_collection = MemoryCollection()
+
+    if args.address is not None:
+        return await Benchmark(args.address, args.concurrency, set(args.methods)).run(args.chains)
+
+    async with StandinService(args.standin_host, checker.SERVICE_PORT, latency=args.latency,
+                              jitter=args.jitter, fork_delay=args.fork_delay):
+        return await Benchmark(args.standin_host, args.concurrency, set(args.methods)).run(args.chains)
+
+
+def main():
+    all_methods = ["putflag", "getflag", "putnoise", "getnoise", "havoc", "exploit"]
+    parser = argparse.ArgumentParser(description="Benchmark the bambi-notes checker")
+    parser.add_argument("--chains", type=int, default=50, help="task chains per variant")
+    parser.add_argument("--concurrency", type=int, default=16, help="max tasks in flight")
+    parser.add_argument("--methods", nargs="+", choices=all_methods, default=all_methods)
+    parser.add_argument("--address", default=None, help="benchmark a real service instead of the stand-in")
+    parser.add_argument("--standin-host", default="127.0.0.1")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--fork-delay", type=float, default=0.0)
+    parser.add_argument("--mongo", action="store_true", help="use the Mongo configured via MONGO_* instead of memory")
+    parser.add_argument("--json", default=None, help="also write the summary to this file")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+    summary = asyncio.run(run_benchmark(args))
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Startup benchmark for preloaded gunicorn workers.
+
+Imports the checker in a fresh interpreter per startup mode, forks workers
+the way gunicorn does and reports how long a worker takes until it can
+serve a task and how much of its memory is still shared with the master
+after it has run a few garbage collections.
+
+    lazy     nothing is built before fork, every worker builds on first use
+    preload  checker.preload() runs in the master before fork
+    freeze   as preload, with the GC disabled while loading and frozen before fork
+
+    python bench_startup.py --workers 4
+"""
+from time import perf_counter
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+
+MODES = ("lazy", "preload", "freeze")
+
+
+def memory() -> dict:
+    """Rss, Pss and Private_Dirty of this process in MiB."""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("Rss", "Pss", "Private_Dirty"):
+                fields[name.lower()] = int(value.split()[0]) / 1024
+    return fields
+
+
+def worker(out: int) -> None:
+    start = perf_counter()
+    import checker
+    checker.app()
+    checker.gen_rando_bs()
+    ready = perf_counter() - start
+
+    # A worker's life: lots of short-lived objects and collections walking the heap
+    for _ in range(20):
+        junk = [{"i": i} for i in range(10000)]
+        del junk
+        gc.collect()
+
+    os.write(out, json.dumps({"ready": ready, **memory()}).encode())
+    os._exit(0)
+
+
+def master(mode: str, workers: int) -> dict:
+    if mode == "freeze":
+        gc.disable()
+
+    start = perf_counter()
+    import checker
+    imported = perf_counter() - start
+
+    start = perf_counter()
+    if mode != "lazy":
+        checker.preload()
+    if mode == "freeze":
+        gc.freeze()
+        gc.enable()
+    preloaded = perf_counter() - start
+
+    pipes = []
+    for _ in range(workers):
+        read, write = os.pipe()
+        if os.fork() == 0:
+            os.close(read)
+            worker(write)
+        os.close(write)
+        pipes.append(read)
+
+    results = []
+    for read in pipes:
+        chunks = []
+        while chunk := os.read(read, 4096):
+            chunks.append(chunk)
+        os.close(read)
+        results.append(json.loads(b"".join(chunks)))
+    while True:
+        try:
+            os.wait()
+        except ChildProcessError:
+            break
+
+    return {
+        "mode": mode,
+        "import_s": imported,
+        "preload_s": preloaded,
+        "master": memory(),
+        "workers": results,
+    }
+
+
+def print_summary(runs: list[dict]) -> None:
+    print(f"{'mode':<8} {'import s':>9} {'preload s':>10} {'ready ms':>9} {'rss MiB':>8} {'pss MiB':>8} {'private MiB':>12}")
+    for run in runs:
+        workers = run["workers"]
+        n = len(workers)
+        print(f"{run['mode']:<8} {run['import_s']:>9.2f} {run['preload_s']:>10.2f} "
+              f"{sum(w['ready'] for w in workers) / n * 1000:>9.1f} "
+              f"{sum(w['rss'] for w in workers) / n:>8.1f} "
+              f"{sum(w['pss'] for w in workers) / n:>8.1f} "
+              f"{sum(w['private_dirty'] for w in workers) / n:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark checker import and worker startup")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(master(args.child, args.workers)))
+        return
+
+    runs = []
+    for mode in args.modes:
+        # Every mode gets a fresh interpreter so nothing is imported yet
+        out = subprocess.run([sys.executable, __file__, "--child", mode, "--workers", str(args.workers)],
+                             check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(out.splitlines()[-1]))
+
+    print_summary(runs)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(runs, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
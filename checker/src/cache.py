@@ -0,0 +1,240 @@
+from collections import OrderedDict
+from copy import deepcopy
+from time import perf_counter
+from typing import Any, Callable, Optional
+import asyncio
+import os
+import re
+import time
+
+from enochecker3 import ChainDB
+
+import metrics
+
+CACHE_SIZE = int(os.getenv("BAMBI_CACHE_SIZE", "10000"))
+# How many rounds an entry stays cached, should cover the flag lifetime
+CACHE_ROUNDS = int(os.getenv("BAMBI_CACHE_ROUNDS", "10"))
+# Cache misses this long after the first one share one query, 0 sends each on its own
+FETCH_WINDOW = float(os.getenv("BAMBI_FETCH_WINDOW", "0"))
+FETCH_MAX = int(os.getenv("BAMBI_FETCH_MAX", "500"))
+# Load all chains of a finished round the first time one of them misses
+FETCH_ROUNDS = os.getenv("BAMBI_FETCH_ROUNDS", "0") == "1"
+
+# Chain ids are <prefix>_s<service>_r<round>_t<team>_i<index>
+ROUND_PREFIX = re.compile(r"^(.*_r\d+_)t\d+_")
+ROUNDS_KEPT = 64
+
+_MISSING = object()
+
+
+class ChainCache():
+    """Bounded LRU of ChainDB values keyed by (task_chain_id, key) with a per-entry TTL."""
+
+    def __init__(self, size: int = CACHE_SIZE) -> None:
+        self.size = size
+        self.entries: OrderedDict[tuple[str, str], tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": self.size,
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def get(self, chain_id: str, key: str) -> Any:
+        entry = self.entries.get((chain_id, key))
+        if entry is None:
+            self.misses += 1
+            return _MISSING
+
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[(chain_id, key)]
+            self.expirations += 1
+            self.misses += 1
+            return _MISSING
+
+        self.entries.move_to_end((chain_id, key))
+        self.hits += 1
+        return deepcopy(value)
+
+    def put(self, chain_id: str, key: str, value: Any, ttl: float) -> None:
+        if self.size <= 0:
+            return
+        self.entries[(chain_id, key)] = (time.monotonic() + ttl, deepcopy(value))
+        self.entries.move_to_end((chain_id, key))
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+
+class ChainFetcher():
+    """Answer ChainDB cache misses with shared bulk queries.
+
+    Misses within `window` of each other become one `$in` query on their
+    chain ids, and with `rounds` the first miss on a finished round loads
+    every chain of that round by its id prefix. Every document a query
+    returns goes into the cache, so the other keys of those chains hit too.
+    """
+
+    def __init__(self, cache: ChainCache, window: float = FETCH_WINDOW, limit: int = FETCH_MAX,
+                 rounds: bool = FETCH_ROUNDS) -> None:
+        self.cache = cache
+        self.window = window
+        self.limit = limit
+        self.rounds = rounds
+        self.pending: dict[int, tuple[Any, dict[str, list[asyncio.Future]], float]] = {}
+        self.loaded: OrderedDict[str, asyncio.Task] = OrderedDict()
+        self.tasks: set[asyncio.Task] = set()
+        self.lookups = 0
+        self.queries = 0
+        self.documents = 0
+        self.prefetches = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 or self.rounds
+
+    def stats(self) -> dict:
+        return {
+            "window": self.window,
+            "lookups": self.lookups,
+            "queries": self.queries,
+            "documents": self.documents,
+            "prefetches": self.prefetches,
+        }
+
+    async def get(self, collection, chain_id: str, key: str, ttl: float, settled: bool) -> Any:
+        """Value of `key` in `chain_id`, raises KeyError like ChainDB.get.
+
+        `settled` says the chain's round is over, so its state is complete
+        and worth loading for the whole round.
+        """
+        self.lookups += 1
+        if self.rounds and settled and (m := ROUND_PREFIX.match(chain_id)) is not None:
+            await self.load_round(collection, m.group(1), ttl)
+            value = self.cache.get(chain_id, key)
+            if value is not _MISSING:
+                return value
+
+        loop = asyncio.get_running_loop()
+        batch = self.pending.get(id(collection))
+        if batch is None:
+            batch = self.pending[id(collection)] = (collection, {}, ttl)
+            loop.call_later(self.window, self.dispatch, batch)
+        fut = loop.create_future()
+        batch[1].setdefault(chain_id, []).append(fut)
+        if len(batch[1]) >= self.limit:
+            self.dispatch(batch)
+
+        values = await fut
+        if key not in values:
+            raise KeyError(f"Key {key} not found")
+        return deepcopy(values[key])
+
+    def dispatch(self, batch) -> None:
+        collection, chains, ttl = batch
+        if self.pending.get(id(collection)) is not batch:
+            return
+        del self.pending[id(collection)]
+        task = asyncio.create_task(self.run(collection, chains, ttl))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, collection, chains: dict[str, list[asyncio.Future]], ttl: float) -> None:
+        try:
+            found = await self.query(collection, {"task_chain_id": {"$in": list(chains)}}, ttl)
+        except Exception as e:
+            for futs in chains.values():
+                for fut in futs:
+                    if not fut.done():
+                        fut.set_exception(e)
+            return
+
+        for chain_id, futs in chains.items():
+            values = found.get(chain_id, {})
+            for fut in futs:
+                if not fut.done():
+                    fut.set_result(values)
+
+    async def load_round(self, collection, prefix: str, ttl: float) -> None:
+        task = self.loaded.get(prefix)
+        if task is None:
+            query = {"task_chain_id": {"$regex": "^" + re.escape(prefix)}}
+            task = self.loaded[prefix] = asyncio.create_task(self.query(collection, query, ttl))
+            self.prefetches += 1
+            while len(self.loaded) > ROUNDS_KEPT:
+                self.loaded.popitem(last=False)
+        try:
+            # Shared by every task of the round, one of them being cancelled must not cancel it
+            await asyncio.shield(task)
+        except Exception:
+            # Misses fall back to the batched lookup, the next one retries the round
+            if self.loaded.get(prefix) is task:
+                del self.loaded[prefix]
+
+    async def query(self, collection, query: dict, ttl: float) -> dict[str, dict[str, Any]]:
+        start = perf_counter()
+        self.queries += 1
+        found: dict[str, dict[str, Any]] = {}
+        try:
+            async for doc in collection.find(query):
+                found.setdefault(doc["task_chain_id"], {})[doc["key"]] = doc["value"]
+                self.cache.put(doc["task_chain_id"], doc["key"], doc["value"], ttl)
+                self.documents += 1
+        finally:
+            metrics.current().step("db_query", start)
+        return found
+
+
+class CachedChainDB(ChainDB):
+    """ChainDB that writes through to Mongo and answers reads from a ChainCache."""
+
+    def __init__(self, db: ChainDB, cache: ChainCache, ttl: float,
+                 fetcher: Optional[ChainFetcher] = None, settled: bool = False,
+                 on_read: Optional[Callable[[str, str, Any], None]] = None) -> None:
+        super().__init__(db.collection, db.task_chain_id)
+        self.cache = cache
+        self.ttl = ttl
+        self.fetcher = fetcher
+        self.settled = settled
+        self.on_read = on_read
+
+    async def get(self, key: str) -> Any:
+        value = await self._get(key)
+        if self.on_read is not None:
+            self.on_read(self.task_chain_id, key, value)
+        return value
+
+    async def _get(self, key: str) -> Any:
+        start = perf_counter()
+        value = self.cache.get(self.task_chain_id, key)
+        if value is not _MISSING:
+            metrics.current().step("db_get_cached", start)
+            return value
+
+        try:
+            if self.fetcher is not None and self.fetcher.enabled:
+                return await self.fetcher.get(self.collection, self.task_chain_id, key, self.ttl, self.settled)
+            value = await super().get(key)
+        finally:
+            metrics.current().step("db_get", start)
+        self.cache.put(self.task_chain_id, key, value, self.ttl)
+        return value
+
+    async def set(self, key: str, val: Any) -> None:
+        start = perf_counter()
+        try:
+            await super().set(key, val)
+        finally:
+            metrics.current().step("db_set", start)
+        self.cache.put(self.task_chain_id, key, val, self.ttl)
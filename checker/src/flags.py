@@ -0,0 +1,57 @@
+from typing import Optional
+import asyncio
+import hashlib
+import os
+import re
+
+# Bytes of already scanned input kept so flags split across chunks still match
+FLAG_OVERLAP = int(os.getenv("BAMBI_FLAG_OVERLAP", "512"))
+
+
+class FlagStream():
+    """Incremental FlagSearcher over the raw bytes received in a session.
+
+    Matches the task's flag regex against each chunk plus the tail of the
+    previous ones. With a flag hash only the matching flag is collected,
+    like FlagSearcher does. Without one, a match running up to the end of
+    the received bytes may still grow, so it is only collected once more
+    bytes follow it or finish() says none will.
+    """
+
+    __slots__ = ("regex", "flag_hash", "tail", "found", "event")
+
+    def __init__(self, flag_regex: str, flag_hash: str = "", event: Optional[asyncio.Event] = None) -> None:
+        self.regex = re.compile(flag_regex.encode())
+        self.flag_hash = flag_hash
+        self.tail = b""
+        self.found: list[bytes] = []
+        self.event = event
+
+    def feed(self, chunk: bytes) -> None:
+        data = self.tail + chunk
+        seen = len(self.tail)
+        for match in self.regex.finditer(data):
+            # Handled before, when it was still part of an earlier chunk; without a hash
+            # a match ending right at the end of that chunk was held back and is due now
+            if match.end() < seen or (match.end() == seen and self.flag_hash):
+                continue
+            if match.end() == len(data) and not self.flag_hash:
+                break
+            self.collect(match.group())
+        self.tail = data[-FLAG_OVERLAP:]
+
+    def finish(self) -> None:
+        """Collect a match held back at the end of the input, no more bytes are coming."""
+        if self.flag_hash:
+            return
+        for match in self.regex.finditer(self.tail):
+            if match.end() == len(self.tail):
+                self.collect(match.group())
+
+    def collect(self, flag: bytes) -> None:
+        if self.flag_hash and hashlib.sha256(flag).hexdigest() != self.flag_hash:
+            return
+        if flag not in self.found:
+            self.found.append(flag)
+            if self.event is not None:
+                self.event.set()
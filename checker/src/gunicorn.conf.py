@@ -1,3 +1,4 @@
+import gc
 import multiprocessing
 
 worker_class = "uvicorn.workers.UvicornWorker"
@@ -5,4 +6,17 @@ workers = min(4, multiprocessing.cpu_count())
 bind = "0.0.0.0:8000"
 timeout = 90
 keepalive = 3600
-preload_app = True
\ No newline at end of file
+preload_app = True
+
+
+def when_ready(server):
+    # Keep the master's heap free of collection holes while it preloads, then freeze
+    # what it built so the workers' collections never write to those shared pages.
+    # Workers forked later inherit the re-enabled collector.
+    import checker
+    gc.disable()
+    try:
+        checker.preload()
+        gc.freeze()
+    finally:
+        gc.enable()
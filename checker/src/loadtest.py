@@ -0,0 +1,189 @@
+"""Service capacity load test built on havoc1.
+
+Keeps N havoc1 sessions (register, then a mix of create/save/load/list/
+delete) running against the local stand-in or a real deployment for a
+fixed duration and reports connection accept latency, per-command latency
+and error rates. Useful for sizing the service container and the xinetd
+instance limits before a game.
+
+    python loadtest.py --sessions 50 --duration 60 --ramp 10 --address 10.1.1.1
+"""
+from collections import Counter
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from enochecker_core import CheckerMethod
+
+import checker
+import metrics
+from bench import make_task, percentile
+from standin import StandinService
+
+# Steps until the service has accepted the connection and printed its banner
+ACCEPT_STEPS = ("connect", "banner")
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        op, _, weight = part.partition("=")
+        if op not in checker.HAVOC_MIX:
+            raise argparse.ArgumentTypeError(f"unknown command {op!r}, expected one of {', '.join(checker.HAVOC_MIX)}")
+        mix[op] = float(weight or 1)
+    return mix
+
+
+class LoadTest():
+    def __init__(self, address: str, sessions: int, duration: float, ramp: float, timeout: int) -> None:
+        self.address = address
+        self.sessions = sessions
+        self.duration = duration
+        self.ramp = ramp
+        self.timeout = timeout
+        self.steps: dict[str, list[float]] = {}
+        self.step_errors: Counter = Counter()
+        self.results: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.latencies: list[float] = []
+        self.active = 0
+        self.peak = 0
+
+    def record_steps(self, task_metrics: metrics.TaskMetrics, outcome: str, duration: float) -> None:
+        for name, seconds in task_metrics.steps:
+            self.steps.setdefault(name, []).append(seconds)
+        if outcome != "OK":
+            # The step that was running when the session failed records last
+            failed_at = task_metrics.steps[-1][0] if task_metrics.steps else "connect"
+            self.step_errors[failed_at] += 1
+
+    async def session(self, n: int) -> None:
+        task = make_task(CheckerMethod.HAVOC, 1, f"havoc_load_{n}", self.address, timeout=self.timeout)
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        start = time.perf_counter()
+        try:
+            await checker.checker._call_method(task)
+            result = "OK"
+        except Exception as e:
+            result = metrics.outcome_of(e)
+            self.errors[f"{result}: {getattr(e, 'message', None) or e!r}"] += 1
+        finally:
+            self.active -= 1
+        self.results[result] += 1
+        self.latencies.append(time.perf_counter() - start)
+
+    async def worker(self, i: int, stop: float) -> None:
+        await asyncio.sleep(self.ramp * i / self.sessions)
+        n = i
+        while time.monotonic() < stop:
+            await self.session(n)
+            n += self.sessions
+
+    async def run(self) -> dict:
+        listener = metrics.REGISTRY.listen(self.record_steps)
+        start = time.monotonic()
+        try:
+            await asyncio.gather(*(self.worker(i, start + self.duration) for i in range(self.sessions)))
+        finally:
+            metrics.REGISTRY.listeners.remove(listener)
+        return self.summary(time.monotonic() - start)
+
+    def summary(self, elapsed: float) -> dict:
+        def latency(samples):
+            return {
+                "count": len(samples),
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+                "max_ms": max(samples, default=0.0) * 1000,
+            }
+
+        sessions = sum(self.results.values())
+        commands = sum(len(s) for name, s in self.steps.items() if name not in ACCEPT_STEPS)
+        accept = [c + b for c, b in zip(self.steps.get("connect", []), self.steps.get("banner", []))]
+        return {
+            "address": self.address,
+            "sessions": self.sessions,
+            "peak_active": self.peak,
+            "elapsed_s": elapsed,
+            "completed": sessions,
+            "sessions_per_s": sessions / elapsed if elapsed else 0.0,
+            "commands_per_s": commands / elapsed if elapsed else 0.0,
+            "results": dict(self.results),
+            "error_rate": 1 - self.results["OK"] / sessions if sessions else 0.0,
+            "errors": dict(self.errors.most_common()),
+            "session": latency(self.latencies),
+            "accept": latency(accept),
+            "steps": {name: {**latency(samples), "failed": self.step_errors[name]}
+                      for name, samples in sorted(self.steps.items())},
+        }
+
+
+def print_summary(summary: dict) -> None:
+    print(f"{summary['completed']} sessions against {summary['address']} with {summary['sessions']} concurrent "
+          f"(peak {summary['peak_active']}) in {summary['elapsed_s']:.1f}s: "
+          f"{summary['sessions_per_s']:.1f} sessions/s, {summary['commands_per_s']:.1f} commands/s")
+    results = ", ".join(f"{result} {count}" for result, count in sorted(summary["results"].items()))
+    print(f"results: {results}, error rate {summary['error_rate'] * 100:.2f}%")
+
+    print(f"\n{'step':<12} {'count':>7} {'failed':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    rows = [("session", {**summary["session"], "failed": summary["completed"] - summary["results"].get("OK", 0)}),
+            ("accept", {**summary["accept"], "failed": sum(summary["steps"].get(s, {}).get("failed", 0) for s in ACCEPT_STEPS)}),
+            *summary["steps"].items()]
+    for name, s in rows:
+        print(f"{name:<12} {s['count']:>7} {s['failed']:>7} {s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f} "
+              f"{s['p99_ms']:>9.1f} {s['max_ms']:>9.1f}")
+
+    if summary["errors"]:
+        print("\nerrors:")
+        for message, count in summary["errors"].items():
+            print(f"{count:>7}  {message}")
+
+
+async def run_loadtest(args) -> dict:
+    checker.preload()
+    checker.HAVOC_OPS = args.ops
+    if args.mix is not None:
+        checker.HAVOC_MIX = args.mix
+    # Every command gets its own round trip, so its latency is its own
+    checker.PIPELINE_ENABLED = False
+
+    if args.address is not None:
+        return await LoadTest(args.address, args.sessions, args.duration, args.ramp, args.timeout).run()
+
+    async with StandinService(args.standin_host, checker.SERVICE_PORT, latency=args.latency,
+                              jitter=args.jitter, fork_delay=args.fork_delay):
+        return await LoadTest(args.standin_host, args.sessions, args.duration, args.ramp, args.timeout).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a bambi-notes service with concurrent havoc1 sessions")
+    parser.add_argument("--sessions", type=int, default=20, help="concurrent sessions")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to keep starting sessions")
+    parser.add_argument("--ramp", type=float, default=0, help="seconds until all sessions are running")
+    parser.add_argument("--ops", type=int, default=checker.HAVOC_OPS, help="commands per session")
+    parser.add_argument("--mix", type=parse_mix, default=None,
+                        help="command weights, e.g. create=4,list=3,save=2,load=2,delete=1")
+    parser.add_argument("--timeout", type=int, default=15000, help="task timeout in ms")
+    parser.add_argument("--address", default=None, help="load a real service instead of the stand-in")
+    parser.add_argument("--standin-host", default="127.0.0.1")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--fork-delay", type=float, default=0.0)
+    parser.add_argument("--json", default=None, help="also write the summary to this file")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+    summary = asyncio.run(run_loadtest(args))
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
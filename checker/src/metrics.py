@@ -0,0 +1,199 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Optional
+import asyncio
+import functools
+import os
+
+from enochecker_core import CheckerMethod
+from enochecker3 import MumbleException, OfflineException, InternalErrorException
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram():
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class TaskMetrics():
+    """Step timings and byte counts of one checker task, committed once its outcome is known."""
+
+    __slots__ = ("method", "variant", "steps", "bytes_in", "bytes_out")
+
+    def __init__(self, method: str = "", variant: int = -1) -> None:
+        self.method = method
+        self.variant = variant
+        self.steps: list = []  # (name, seconds) pairs
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def step(self, name: str, start: float) -> None:
+        self.steps.append((name, perf_counter() - start))
+
+    def open_step(self, name: str) -> list:
+        """A step whose seconds are added to the returned [name, seconds] as they are spent."""
+        step = [name, 0.0]
+        self.steps.append(step)
+        return step
+
+
+class Registry():
+    def __init__(self) -> None:
+        self.steps: dict[tuple[str, str, int, str], Histogram] = {}
+        self.bytes: dict[tuple[str, int, str], list[int]] = {}
+        self.collectors = []
+        self.listeners = []
+
+    def commit(self, metrics: TaskMetrics, outcome: str, duration: float) -> None:
+        for f in self.listeners:
+            f(metrics, outcome, duration)
+
+        for name, seconds in metrics.steps:
+            key = (name, metrics.method, metrics.variant, outcome)
+            hist = self.steps.get(key)
+            if hist is None:
+                hist = self.steps[key] = Histogram()
+            hist.observe(seconds)
+
+        key = ("task", metrics.method, metrics.variant, outcome)
+        hist = self.steps.get(key)
+        if hist is None:
+            hist = self.steps[key] = Histogram()
+        hist.observe(duration)
+
+        counts = self.bytes.setdefault(key[1:], [0, 0])
+        counts[0] += metrics.bytes_in
+        counts[1] += metrics.bytes_out
+
+    def collector(self, f):
+        """Register a function returning {metric_name: value} to be rendered as gauges."""
+        self.collectors.append(f)
+        return f
+
+    def listen(self, f):
+        """Register a function called with (metrics, outcome, duration) for every committed task."""
+        self.listeners.append(f)
+        return f
+
+    def render(self) -> str:
+        pid = os.getpid()
+        lines = [
+            "# HELP bambi_step_seconds Latency of checker protocol steps",
+            "# TYPE bambi_step_seconds histogram",
+        ]
+        for (name, method, variant, outcome), hist in sorted(self.steps.items()):
+            labels = f'worker="{pid}",step="{name}",method="{method}",variant="{variant}",outcome="{outcome}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, hist.counts):
+                cumulative += count
+                lines.append(f'bambi_step_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'bambi_step_seconds_bucket{{{labels},le="+Inf"}} {hist.count}')
+            lines.append(f"bambi_step_seconds_sum{{{labels}}} {hist.sum}")
+            lines.append(f"bambi_step_seconds_count{{{labels}}} {hist.count}")
+
+        lines += [
+            "# HELP bambi_bytes_total Bytes exchanged with the service",
+            "# TYPE bambi_bytes_total counter",
+        ]
+        for (method, variant, outcome), (received, sent) in sorted(self.bytes.items()):
+            labels = f'worker="{pid}",method="{method}",variant="{variant}",outcome="{outcome}"'
+            lines.append(f'bambi_bytes_total{{{labels},direction="received"}} {received}')
+            lines.append(f'bambi_bytes_total{{{labels},direction="sent"}} {sent}')
+
+        for f in self.collectors:
+            for name, value in f().items():
+                lines.append(f'{name}{{worker="{pid}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+_current: ContextVar[Optional[TaskMetrics]] = ContextVar("bambi_task_metrics", default=None)
+
+
+def current() -> TaskMetrics:
+    """Metrics of the running checker task, or a throwaway outside of one."""
+    metrics = _current.get()
+    return metrics if metrics is not None else TaskMetrics()
+
+
+def outcome_of(e: BaseException) -> str:
+    # Mirrors how enochecker turns exceptions into task results
+    if isinstance(e, MumbleException):
+        return "MUMBLE"
+    if isinstance(e, OfflineException):
+        return "OFFLINE"
+    if isinstance(e, InternalErrorException):
+        return "INTERNAL_ERROR"
+    if isinstance(e, (EOFError, ConnectionError, TimeoutError, asyncio.TimeoutError, asyncio.CancelledError)):
+        return "MUMBLE"
+    return "INTERNAL_ERROR"
+
+
+@contextmanager
+def track(method: str, variant: int):
+    """Collect the steps of the enclosed work and commit them under method/variant with its outcome."""
+    metrics = TaskMetrics(method, variant)
+    token = _current.set(metrics)
+    outcome = "OK"
+    start = perf_counter()
+    try:
+        yield metrics
+    except BaseException as e:
+        outcome = outcome_of(e)
+        raise
+    finally:
+        _current.reset(token)
+        REGISTRY.commit(metrics, outcome, perf_counter() - start)
+
+
+def instrument(f):
+    """Record a checker function's steps, labelled by method, variant and outcome."""
+    @functools.wraps(f)
+    async def wrapper(task, *args, **kwargs):
+        # Task messages keep enum values as plain strings once validated
+        with track(CheckerMethod(task.method).value, task.variant_id):
+            return await f(task, *args, **kwargs)
+    return wrapper
+
+
+def timed(name: str):
+    """Record an async method's duration as the protocol step `name`.
+
+    While the client it is called on queues its I/O (send_queue is set), the
+    method returns before the service answers. The step is then left open
+    as the client's `step`; each queued check adds its wait to it when the
+    client flushes, and the method's own time outside flushes is added here.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        async def wrapper(client, *args, **kwargs):
+            start = perf_counter()
+            if getattr(client, "send_queue", None) is None:
+                try:
+                    return await f(client, *args, **kwargs)
+                finally:
+                    current().step(name, start)
+
+            step = current().open_step(name)
+            outer, client.step = client.step, step
+            flushed = client.flush_seconds
+            try:
+                return await f(client, *args, **kwargs)
+            finally:
+                client.step = outer
+                step[1] += perf_counter() - start - (client.flush_seconds - flushed)
+        return wrapper
+    return decorator
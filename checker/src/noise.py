@@ -0,0 +1,89 @@
+from array import array
+import os
+import random
+import time
+
+NOISE_CORPUS_SIZE = int(os.getenv("BAMBI_NOISE_CORPUS_SIZE", "4096"))
+NOISE_ROTATE_INTERVAL = float(os.getenv("BAMBI_NOISE_ROTATE_INTERVAL", "300"))
+# Phrases generated per pick while a rotation is under way
+NOISE_ROTATE_STEP = int(os.getenv("BAMBI_NOISE_ROTATE_STEP", "32"))
+NOISE_MAX_LEN = 0x38
+# bs() and catch_phrase() only need the company provider, loading all of them per locale takes seconds
+NOISE_PROVIDERS = ["faker.providers.company"]
+
+
+class NoiseCorpus():
+    """Faker phrases generated up front and packed into one buffer.
+
+    Picks are a random offset lookup. Once the corpus is older than
+    rotate_interval every pick also generates rotate_step phrases of its
+    replacement, which is swapped in when complete, so the text keeps
+    changing without a long Faker run holding up the event loop.
+    """
+
+    def __init__(self, size: int = NOISE_CORPUS_SIZE, max_len: int = NOISE_MAX_LEN,
+                 rotate_interval: float = NOISE_ROTATE_INTERVAL, rotate_step: int = NOISE_ROTATE_STEP) -> None:
+        self.size = size
+        self.max_len = max_len
+        self.rotate_interval = rotate_interval
+        self.rotate_step = rotate_step
+        self.faker = None
+        self.corpus = (b"", array("I", [0]))
+        self.next: list[bytes] = []
+        self.built = 0.0
+        self.rotations = 0
+
+    def phrase(self) -> bytes:
+        if self.faker is None:
+            import faker
+            self.faker = faker.Faker(faker.config.AVAILABLE_LOCALES, providers=NOISE_PROVIDERS)
+        if random.getrandbits(1):
+            rando_str = self.faker.bs()
+        else:
+            rando_str = self.faker.catch_phrase()
+        return rando_str.encode()[:self.max_len]
+
+    def _swap(self, phrases: list[bytes]) -> None:
+        offsets = array("I", [0])
+        total = 0
+        for phrase in phrases:
+            total += len(phrase)
+            offsets.append(total)
+        self.corpus = (b"".join(phrases), offsets)
+        self.built = time.monotonic()
+
+    def build(self) -> None:
+        self._swap([self.phrase() for _ in range(self.size)])
+
+    def _rotate(self) -> None:
+        missing = self.size - len(self.next)
+        self.next.extend(self.phrase() for _ in range(min(self.rotate_step, missing)))
+        if len(self.next) >= self.size:
+            self._swap(self.next)
+            self.next = []
+            self.rotations += 1
+
+    def maybe_rotate(self) -> None:
+        if time.monotonic() - self.built >= self.rotate_interval:
+            self._rotate()
+
+    def _corpus(self) -> tuple[bytes, array]:
+        if self.built == 0.0:
+            self.build()
+        else:
+            self.maybe_rotate()
+        return self.corpus
+
+    def pick(self, max_len: int = 0x30) -> bytes:
+        data, offsets = self._corpus()
+        idx = random.randrange(len(offsets) - 1)
+        start = offsets[idx]
+        return data[start:min(offsets[idx + 1], start + max_len)]
+
+    def batch(self, n: int, max_len: int = 0x30) -> list[bytes]:
+        data, offsets = self._corpus()
+        notes = []
+        for idx in random.choices(range(len(offsets) - 1), k=n):
+            start = offsets[idx]
+            notes.append(data[start:min(offsets[idx + 1], start + max_len)])
+        return notes
@@ -0,0 +1,162 @@
+from asyncio import StreamReader, StreamWriter
+from collections import deque
+from typing import NamedTuple, Optional
+import asyncio
+import os
+import time
+
+from protocol import ProtocolParser, BANNER, READ_CHUNK
+
+POOL_SIZE = int(os.getenv("BAMBI_POOL_SIZE", "0"))
+POOL_IDLE_TIMEOUT = float(os.getenv("BAMBI_POOL_IDLE_TIMEOUT", "30"))
+POOL_CONNECT_TIMEOUT = float(os.getenv("BAMBI_POOL_CONNECT_TIMEOUT", "5"))
+# After a failed warm-up an address is not dialed again for this long, doubling per failure
+POOL_BACKOFF = float(os.getenv("BAMBI_POOL_BACKOFF", "5"))
+POOL_BACKOFF_MAX = float(os.getenv("BAMBI_POOL_BACKOFF_MAX", "60"))
+
+
+class WarmConnection(NamedTuple):
+    reader: StreamReader
+    writer: StreamWriter
+    parser: ProtocolParser
+    opened: float
+
+
+class ConnectionPool():
+    """Keeps a few connections per team that already sit at the first menu prompt.
+
+    The banner is consumed and the unauthenticated menu is checked while
+    warming up. The menu stays in the parser buffer, so a client picks up
+    exactly where a fresh connection would be after the banner, but
+    without any network wait.
+
+    An address whose warm-up failed is left alone until its backoff has
+    passed, so a team that is down is not dialed again on every task.
+    """
+
+    def __init__(self, port: int, size: int = POOL_SIZE, idle_timeout: float = POOL_IDLE_TIMEOUT) -> None:
+        self.port = port
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.idle: dict[str, deque[WarmConnection]] = {}
+        self.opening: dict[str, int] = {}
+        # address -> (consecutive failures, monotonic time before which it is not dialed)
+        self.backoff: dict[str, tuple[int, float]] = {}
+        self.tasks: set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.unhealthy = 0
+        self.failed = 0
+        self.skipped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "idle_timeout": self.idle_timeout,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "unhealthy": self.unhealthy,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "backing_off": sum(until > time.monotonic() for _, until in self.backoff.values()),
+            "idle": sum(len(conns) for conns in self.idle.values()),
+        }
+
+    def acquire(self, address: str) -> Optional[WarmConnection]:
+        conns = self.idle.get(address)
+        conn = None
+        now = time.monotonic()
+        while conns:
+            candidate = conns.popleft()
+            if now - candidate.opened > self.idle_timeout:
+                self.expired += 1
+                candidate.writer.close()
+            elif not self.healthy(candidate):
+                self.unhealthy += 1
+                candidate.writer.close()
+            else:
+                conn = candidate
+                break
+
+        if conn is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        self.refill(address)
+        return conn
+
+    def healthy(self, conn: WarmConnection) -> bool:
+        return (
+            not conn.writer.is_closing()
+            and not conn.reader.at_eof()
+            and conn.parser.pending().endswith(b"> ")
+        )
+
+    def refill(self, address: str) -> None:
+        failures = self.backoff.get(address)
+        if failures is not None and failures[1] > time.monotonic():
+            self.skipped += 1
+            return
+        missing = self.size - len(self.idle.get(address, ())) - self.opening.get(address, 0)
+        for _ in range(missing):
+            self.opening[address] = self.opening.get(address, 0) + 1
+            task = asyncio.create_task(self._warm(address))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _warm(self, address: str) -> None:
+        try:
+            conn = await asyncio.wait_for(self._open(address), POOL_CONNECT_TIMEOUT)
+        except Exception:
+            self.failed += 1
+            count = self.backoff.get(address, (0, 0.0))[0] + 1
+            delay = min(POOL_BACKOFF * 2 ** (count - 1), POOL_BACKOFF_MAX)
+            self.backoff[address] = (count, time.monotonic() + delay)
+            return
+        finally:
+            self.opening[address] -= 1
+
+        self.backoff.pop(address, None)
+        self.idle.setdefault(address, deque()).append(conn)
+        loop = asyncio.get_running_loop()
+        loop.call_later(self.idle_timeout, self.expire, address)
+
+    async def _open(self, address: str) -> WarmConnection:
+        reader, writer = await asyncio.open_connection(address, self.port)
+        parser = ProtocolParser()
+        try:
+            while parser.buffer.find(b"> ", parser.pos) < 0:
+                chunk = await reader.read(READ_CHUNK)
+                if not chunk:
+                    raise EOFError("Connection closed while warming up")
+                parser.feed(chunk)
+
+            if parser.take_until(BANNER) is None:
+                raise ValueError("Missing banner")
+            menu_start = parser.pos
+            parser.expect_menu(None)
+            for _ in parser.events():
+                pass
+            if not parser.idle or parser.pending() != b"> ":
+                raise ValueError("Unexpected menu")
+            parser.pos = menu_start
+        except BaseException:
+            writer.close()
+            raise
+
+        return WarmConnection(reader, writer, parser, time.monotonic())
+
+    def expire(self, address: str) -> None:
+        conns = self.idle.get(address)
+        now = time.monotonic()
+        while conns and now - conns[0].opened >= self.idle_timeout:
+            conns.popleft().writer.close()
+            self.expired += 1
+        if not conns:
+            self.idle.pop(address, None)
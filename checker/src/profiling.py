@@ -0,0 +1,370 @@
+"""Sampling profiles of slow checker tasks.
+
+While profiling is on, a thread in each worker samples the event loop every
+BAMBI_PROFILE_INTERVAL seconds. A sample of a task that runs on the loop
+counts as CPU time under what its innermost frames are doing (protocol
+parsing, Faker, logging, ...), a sample of a suspended task as waiting for
+what it awaits (a socket read, connect, admission, the ChainDB, ...). Tasks
+slower than the threshold keep their profile, written as JSON to a directory
+holding at most BAMBI_PROFILE_KEEP of them.
+
+PUT /profiles on the checker switches profiling at runtime. The setting is
+written to the profile directory, so every worker picks it up within a second.
+"""
+from collections import Counter
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Optional
+import asyncio
+import functools
+import gc
+import json
+import os
+import queue
+import re
+import sys
+import tempfile
+import threading
+import time
+
+from enochecker_core import CheckerMethod
+
+import metrics
+
+PROFILE_DIR = os.getenv("BAMBI_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "bambi-profiles"))
+PROFILE_ENABLED = os.getenv("BAMBI_PROFILE", "0") == "1"
+# Tasks taking longer than this many seconds keep their profile
+PROFILE_THRESHOLD = float(os.getenv("BAMBI_PROFILE_THRESHOLD", "1"))
+# Comma separated methods to profile (getnoise1, putnoise1, exploit0, ...), empty for all
+PROFILE_METHODS = [m.strip() for m in os.getenv("BAMBI_PROFILE_METHODS", "").split(",") if m.strip()]
+PROFILE_INTERVAL = float(os.getenv("BAMBI_PROFILE_INTERVAL", "0.01"))
+PROFILE_KEEP = int(os.getenv("BAMBI_PROFILE_KEEP", "100"))
+# Distinct CPU stacks kept per profile
+PROFILE_STACKS = 50
+
+CONTROL = "control.json"
+PROFILE_NAME = re.compile(r"^[\w.-]+\.json$")
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+# Where a running task's CPU goes, by the innermost frame that matches
+CPU_CATEGORIES = (
+    ("faker", ("/faker/", "/noise.py")),
+    ("logging", ("/logging/", "/transcript.py")),
+    ("parse", ("/protocol.py", "/flags.py")),
+    ("db", ("/cache.py", "/checkpoint.py", "/motor/", "/pymongo/", "/bson/")),
+    ("framework", ("/enochecker3/", "/pydantic", "/fastapi/", "/starlette/", "/uvicorn/")),
+    ("loop", ("/asyncio/", "/selectors.py")),
+)
+# What a suspended task waits for, by the innermost frame that matches
+WAIT_FRAMES = {
+    ("checker.py", "_fill"): "read",
+    ("checker.py", "_flush"): "write",
+    ("checker.py", "connect"): "connect",
+    ("checker.py", "admit"): "admission",
+}
+WAIT_FILES = (
+    ("db", ("/cache.py", "/checkpoint.py", "/motor/", "/pymongo/")),
+    ("coalesce", ("/coalesce.py",)),
+)
+# A task with several sessions (exploit0) waits for the first of these any of them waits for
+WAIT_ORDER = ("read", "write", "connect", "db", "admission", "coalesce", "other")
+
+
+@functools.lru_cache(maxsize=None)
+def _cpu_category(filename: str) -> Optional[str]:
+    for category, parts in CPU_CATEGORIES:
+        if any(part in filename for part in parts):
+            return category
+    return "checker" if filename.startswith(SRC) else None
+
+
+@functools.lru_cache(maxsize=None)
+def _wait_category(filename: str, name: str) -> Optional[str]:
+    wait = WAIT_FRAMES.get((os.path.basename(filename), name))
+    if wait is not None:
+        return wait
+    for category, parts in WAIT_FILES:
+        if any(part in filename for part in parts):
+            return category
+    return None
+
+
+def _cpu_sample(frame) -> tuple[str, str]:
+    """Category and collapsed stack of the frame the loop is running, up to the loop's own frames."""
+    category, names = None, []
+    while frame is not None and len(names) < 64:
+        code = frame.f_code
+        if code.co_name == "_run" and code.co_filename.endswith("events.py"):
+            break
+        if category is None:
+            category = _cpu_category(code.co_filename)
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return category or "other", ";".join(reversed(names))
+
+
+def _task_frames(task: asyncio.Task) -> list:
+    frames, coro = [], task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            # `async for` awaits an asend object wrapping the generator (client.events())
+            if type(coro).__name__ != "async_generator_asend":
+                break
+            coro = next((o for o in gc.get_referents(coro) if hasattr(o, "ag_frame")), None)
+            continue
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "ag_await", None)
+    return frames
+
+
+def _waiting(task: asyncio.Task) -> str:
+    for frame in reversed(_task_frames(task)):
+        wait = _wait_category(frame.f_code.co_filename, frame.f_code.co_name)
+        if wait is not None:
+            return wait
+    return "other"
+
+
+class TaskProfile():
+    __slots__ = ("label", "task", "started", "tasks", "samples", "stacks", "loop_busy")
+
+    def __init__(self, label: str, task: dict) -> None:
+        self.label = label
+        self.task = task
+        self.started = time.time()
+        # The checker function's asyncio task and those it started sessions in
+        self.tasks: set[asyncio.Task] = set()
+        self.samples: Counter = Counter()
+        self.stacks: Counter = Counter()
+        self.loop_busy = 0
+
+
+class Profiler():
+    def __init__(self, directory: str = PROFILE_DIR) -> None:
+        self.directory = directory
+        self.config = {"enabled": PROFILE_ENABLED, "threshold": PROFILE_THRESHOLD,
+                       "methods": PROFILE_METHODS, "interval": PROFILE_INTERVAL}
+        self.control_mtime = None
+        self.checked = 0.0
+        self.running: set[TaskProfile] = set()
+        self.writes: queue.SimpleQueue = queue.SimpleQueue()
+        self.thread: Optional[threading.Thread] = None
+        self.loop = None
+        self.thread_id = None
+        self.profiled = 0
+        self.kept = 0
+        self.samples = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.config["enabled"]
+
+    def stats(self) -> dict:
+        return {"enabled": int(self.enabled), "running": len(self.running), "profiled": self.profiled,
+                "kept": self.kept, "samples": self.samples}
+
+    def refresh(self) -> None:
+        """Pick up a setting another worker stored, checking at most once a second."""
+        now = time.monotonic()
+        if now - self.checked < 1:
+            return
+        self.checked = now
+        path = os.path.join(self.directory, CONTROL)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if mtime == self.control_mtime:
+                return
+            with open(path) as f:
+                config = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.control_mtime = mtime
+        self.config = {**self.config, **config}
+
+    def configure(self, update: dict) -> dict:
+        config = dict(self.config)
+        for key, value in update.items():
+            if key == "enabled" and isinstance(value, bool):
+                config[key] = value
+            elif key in ("threshold", "interval") and isinstance(value, (int, float)) and value >= 0:
+                config[key] = max(float(value), 0.001) if key == "interval" else float(value)
+            elif key == "methods" and isinstance(value, list) and all(isinstance(m, str) for m in value):
+                config[key] = value
+            else:
+                raise ValueError(f"Invalid profiling setting {key}={value!r}")
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, CONTROL)
+        with open(path + f".{os.getpid()}", "w") as f:
+            json.dump(config, f)
+        os.replace(path + f".{os.getpid()}", path)
+        self.control_mtime = os.stat(path).st_mtime_ns
+        self.config = config
+        return config
+
+    def begin(self, task) -> Optional[TaskProfile]:
+        label = f"{CheckerMethod(task.method).value}{task.variant_id}"
+        if self.config["methods"] and label not in self.config["methods"]:
+            return None
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        # Started in the worker on first use; not alive after a fork
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, name="bambi-profiler", daemon=True)
+            self.thread.start()
+
+        profile = TaskProfile(label, task.model_dump(mode="json", by_alias=True))
+        profile.tasks.add(asyncio.current_task())
+        self.running.add(profile)
+        return profile
+
+    def end(self, profile: TaskProfile, outcome: str, seconds: float, steps: list) -> None:
+        self.profiled += 1
+        if seconds >= self.config["threshold"]:
+            self.kept += 1
+            # Queued before it stops running, so the thread writes it before it can exit
+            self.writes.put(self.report(profile, outcome, seconds, steps))
+        self.running.discard(profile)
+
+    def report(self, profile: TaskProfile, outcome: str, seconds: float, steps: list) -> dict:
+        samples = sum(profile.samples.values())
+        # Samples come less regularly than the interval while the loop holds the GIL, so
+        # the task's duration is split by their shares
+        share = seconds / samples if samples else 0.0
+        return {
+            "label": profile.label,
+            "task": profile.task,
+            "pid": os.getpid(),
+            "started": profile.started,
+            "seconds": seconds,
+            "outcome": outcome,
+            "samples": samples,
+            "breakdown": {category: n * share for category, n in profile.samples.most_common()},
+            "loop_busy": profile.loop_busy * share,
+            "steps": steps,
+            "stacks": dict(profile.stacks.most_common(PROFILE_STACKS)),
+        }
+
+    def run(self) -> None:
+        while True:
+            time.sleep(self.config["interval"])
+            if not self.enabled and not self.running:
+                self.write_pending()
+                return
+            self.sample()
+            self.write_pending()
+
+    def sample(self) -> None:
+        profiles = list(self.running)
+        if not profiles:
+            return
+        frame = sys._current_frames().get(self.thread_id)
+        current = asyncio.current_task(self.loop)
+        cpu = None
+        self.samples += 1
+        for profile in profiles:
+            tasks = list(profile.tasks)
+            if current is not None and current in tasks:
+                if cpu is None:
+                    cpu = _cpu_sample(frame)
+                profile.samples["cpu:" + cpu[0]] += 1
+                profile.stacks[cpu[1]] += 1
+            else:
+                waits = [_waiting(task) for task in tasks if not task.done()]
+                profile.samples["wait:" + min(waits, key=WAIT_ORDER.index, default="other")] += 1
+                profile.loop_busy += current is not None
+
+    def write_pending(self) -> None:
+        while True:
+            try:
+                report = self.writes.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                self.write(report)
+            except OSError:
+                pass
+
+    def write(self, report: dict) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(report["started"]))
+        name = f"{stamp}-{report['label']}-{int(report['seconds'] * 1000)}ms-{report['task']['taskId']}-{report['pid']}.json"
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "w") as f:
+            json.dump(report, f)
+        os.replace(path + ".tmp", path)
+
+        files = self.files()
+        for entry in files[:max(len(files) - PROFILE_KEEP, 0)]:
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                # Pruned by another worker
+                pass
+
+    def files(self) -> list:
+        """Stored profiles, oldest first."""
+        try:
+            entries = [entry for entry in os.scandir(self.directory)
+                       if entry.name != CONTROL and PROFILE_NAME.match(entry.name)]
+        except FileNotFoundError:
+            return []
+        stats = []
+        for entry in entries:
+            try:
+                stats.append((entry.stat().st_mtime, entry))
+            except FileNotFoundError:
+                pass
+        return [entry for _, entry in sorted(stats, key=lambda s: s[0])]
+
+    def listing(self) -> dict:
+        return {"config": self.config, "profiles": [entry.name for entry in reversed(self.files())]}
+
+    def read(self, name: str) -> dict:
+        if name == CONTROL or not PROFILE_NAME.match(name):
+            raise KeyError(name)
+        try:
+            with open(os.path.join(self.directory, name)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            raise KeyError(name)
+
+
+PROFILER = Profiler()
+_current: ContextVar[Optional[TaskProfile]] = ContextVar("bambi_task_profile", default=None)
+
+
+def attach() -> None:
+    """Count the running asyncio task towards the profiled checker task that started it."""
+    profile = _current.get()
+    if profile is not None:
+        profile.tasks.add(asyncio.current_task())
+
+
+def collapsed(report: dict) -> str:
+    """CPU stacks of a profile in the collapsed format flamegraph.pl reads."""
+    return "".join(f"{stack} {count}\n" for stack, count in report["stacks"].items())
+
+
+def profiled(f):
+    """Sample a checker function while profiling is enabled and keep the profile of a slow task."""
+    @functools.wraps(f)
+    async def wrapper(task, *args, **kwargs):
+        PROFILER.refresh()
+        profile = PROFILER.begin(task) if PROFILER.enabled else None
+        if profile is None:
+            return await f(task, *args, **kwargs)
+
+        token = _current.set(profile)
+        outcome = "OK"
+        start = perf_counter()
+        try:
+            return await f(task, *args, **kwargs)
+        except BaseException as e:
+            outcome = metrics.outcome_of(e)
+            raise
+        finally:
+            _current.reset(token)
+            PROFILER.end(profile, outcome, perf_counter() - start, metrics.current().steps)
+    return wrapper
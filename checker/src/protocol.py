@@ -0,0 +1,221 @@
+from typing import Iterable, NamedTuple, Optional
+
+from enochecker3 import MumbleException
+
+READ_CHUNK = 1 << 16
+MAX_BUFFERED = 1 << 24
+COMPACT_AT = 1 << 16
+
+BANNER = b"Welcome to Bambi-Notes!\n"
+
+UNAUTHENTICATED_MENU = (
+    b"   1. Register\n",
+    b"   2. Login\n",
+)
+
+AUTHENTICATED_MENU = (
+    b"   1. Create\n",
+    b"   2. Print\n",
+    b"   3. List Saved\n",
+    b"   4. Delete\n",
+    b"   5. Load\n",
+    b"   6. Save\n",
+)
+
+CURRENTLY_LOADED = b"Currently Loaded:\n"
+SAVED_NOTES = b"Saved Notes:\n"
+END_OF_NOTES = b"===== [End of Notes] =====\n"
+
+NOTE_COUNT = 10
+
+
+class Menu(NamedTuple):
+    title: bytes
+
+class NoteEntry(NamedTuple):
+    idx: int
+    text: bytes
+
+class SavedEntry(NamedTuple):
+    filename: bytes
+
+class EndOfNotes(NamedTuple):
+    pass
+
+
+class NoteList():
+    """A note listing: the ten note slots and the set of saved filenames."""
+
+    __slots__ = ("slots", "saved")
+
+    def __init__(self, saved: Iterable[bytes] = ()) -> None:
+        self.slots: list[Optional[bytes]] = [None] * NOTE_COUNT
+        self.saved: set[bytes] = set(saved)
+
+    def __getitem__(self, idx: int) -> Optional[bytes]:
+        return self.slots[idx]
+
+    def __setitem__(self, idx: int, text: bytes) -> None:
+        self.slots[idx] = text
+
+    def __delitem__(self, idx: int) -> None:
+        self.slots[idx] = None
+
+    def __contains__(self, idx: int) -> bool:
+        return self.slots[idx] is not None
+
+    def get(self, idx: int, default: Optional[bytes] = None) -> Optional[bytes]:
+        text = self.slots[idx]
+        return default if text is None else text
+
+    def missing(self, actual: "NoteList") -> tuple[list[int], set[bytes]]:
+        """Slots and saved files of this list that `actual` lacks or holds differently."""
+        slots = [idx for idx, text in enumerate(self.slots) if text is not None and actual.slots[idx] != text]
+        return slots, self.saved - actual.saved
+
+    def __repr__(self) -> str:
+        notes = {idx: text for idx, text in enumerate(self.slots) if text is not None}
+        return f"NoteList({notes}, saved={len(self.saved)})"
+
+
+IDLE = 0
+MENU_HEADER = 1
+MENU_ITEMS = 2
+LISTING_HEADER = 3
+LISTING_SECTION = 4
+LISTING_NOTES = 5
+LISTING_SAVED = 6
+
+
+class ProtocolParser():
+    """Incremental parser over everything received on one service connection.
+
+    Raw chunks are appended to a single buffer; prompts are taken with
+    take_until/take_exactly, and menus and note listings are scanned in
+    place by a small state machine that emits typed events. Malformed menu
+    items, note entries and saved files fail the parse; only lines between
+    a listing's header and its first section are skipped.
+    """
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.pos = 0
+        self.state = IDLE
+        self.header = b""
+        self.items = ()
+        self.item_idx = 0
+        self.error = ""
+
+    @property
+    def idle(self) -> bool:
+        return self.state == IDLE
+
+    def feed(self, data: bytes) -> None:
+        if self.pos == len(self.buffer):
+            self.buffer.clear()
+            self.pos = 0
+        elif self.pos >= COMPACT_AT:
+            del self.buffer[:self.pos]
+            self.pos = 0
+
+        self.buffer += data
+        if len(self.buffer) - self.pos > MAX_BUFFERED:
+            raise MumbleException("Service sent too much data!")
+
+    def pending(self) -> bytes:
+        return self._slice(self.pos, len(self.buffer))
+
+    def _slice(self, start: int, end: int) -> bytes:
+        with memoryview(self.buffer) as view:
+            return bytes(view[start:end])
+
+    def take_until(self, separator: bytes) -> Optional[bytes]:
+        idx = self.buffer.find(separator, self.pos)
+        if idx < 0:
+            return None
+        end = idx + len(separator)
+        result = self._slice(self.pos, end)
+        self.pos = end
+        return result
+
+    def take_exactly(self, n: int) -> Optional[bytes]:
+        if len(self.buffer) - self.pos < n:
+            return None
+        result = self._slice(self.pos, self.pos + n)
+        self.pos += n
+        return result
+
+    def expect_menu(self, username: Optional[str]) -> None:
+        if username is None:
+            self.header = b"===== [Unauthenticated] =====\n"
+            self.items = UNAUTHENTICATED_MENU
+            self.error = "Failed to fetch unauthenticated Menu!"
+        else:
+            self.header = f"===== [{username}] =====\n".encode()
+            self.items = AUTHENTICATED_MENU
+            self.error = "Failed to fetch authenticated Menu!"
+        self.state = MENU_HEADER
+
+    def expect_listing(self, username: str) -> None:
+        self.header = f"\n\n===== [{username}'s Notes] =====\n".encode()
+        self.error = "Failed to list Notes!"
+        self.state = LISTING_HEADER
+
+    def _is_line(self, start: int, end: int, line: bytes) -> bool:
+        return end - start == len(line) and self.buffer.startswith(line, start)
+
+    def events(self):
+        """Yield every event that is complete in the buffer so far."""
+        buffer = self.buffer
+        while self.state != IDLE:
+            if self.state in (MENU_HEADER, LISTING_HEADER):
+                idx = buffer.find(self.header, self.pos)
+                if idx < 0:
+                    return
+                self.pos = idx + len(self.header)
+                self.item_idx = 0
+                self.state = MENU_ITEMS if self.state == MENU_HEADER else LISTING_SECTION
+                continue
+
+            start = self.pos
+            end = buffer.find(b"\n", start)
+            if end < 0:
+                return
+            end += 1
+            self.pos = end
+
+            if self.state == MENU_ITEMS:
+                if not self._is_line(start, end, self.items[self.item_idx]):
+                    self._fail()
+                self.item_idx += 1
+                if self.item_idx == len(self.items):
+                    self.state = IDLE
+                    yield Menu(self.header[7:-8])
+                continue
+
+            if self._is_line(start, end, END_OF_NOTES):
+                self.state = IDLE
+                yield EndOfNotes()
+            elif self.state == LISTING_SECTION and self._is_line(start, end, CURRENTLY_LOADED):
+                self.state = LISTING_NOTES
+            elif self.state != LISTING_SAVED and self._is_line(start, end, SAVED_NOTES):
+                self.state = LISTING_SAVED
+            elif self.state == LISTING_NOTES and buffer.startswith(b"    ", start):
+                sep = buffer.find(b" | ", start + 4, end - 1)
+                if sep < 0:
+                    self._fail()
+                try:
+                    idx = int(buffer[start + 4:sep])
+                except ValueError:
+                    self._fail()
+                yield NoteEntry(idx, self._slice(sep + 3, end - 1))
+            elif self.state == LISTING_SAVED and buffer.startswith(b" | ", start):
+                yield SavedEntry(self._slice(start + 3, end - 1))
+            elif self.state != LISTING_SECTION:
+                # Loaded notes need the "    " prefix and saved files the " | " one
+                self._fail()
+            # Before the first section heading, other output is skipped
+
+    def _fail(self):
+        self.state = IDLE
+        raise MumbleException(self.error)
@@ -0,0 +1,103 @@
+from time import perf_counter
+from typing import Any
+import base64
+import functools
+import gzip
+import json
+import os
+import time
+
+import metrics
+
+# Directory for task logs, one file per worker, empty disables recording
+RECORD_DIR = os.getenv("BAMBI_RECORD_DIR", "")
+# Seconds between flushes of the compressed log
+RECORD_FLUSH = float(os.getenv("BAMBI_RECORD_FLUSH", "1"))
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, bytes):
+        return {"$bytes": base64.b64encode(value).decode()}
+    raise TypeError(f"Cannot record {type(value).__name__}")
+
+
+def _object_hook(obj: dict) -> Any:
+    if len(obj) == 1 and "$bytes" in obj:
+        return base64.b64decode(obj["$bytes"])
+    return obj
+
+
+def dumps(record: dict) -> str:
+    return json.dumps(record, default=_default, separators=(",", ":"))
+
+
+def loads(line: str) -> dict:
+    return json.loads(line, object_hook=_object_hook)
+
+
+class Recorder():
+    """Append the tasks a worker runs and the ChainDB values they read to a gzip'd NDJSON log.
+
+    Three kinds of lines, all with the wall clock time `t`:
+    {"task": <task message>} when a checker function starts,
+    {"state": [chain_id, key, value]} for every ChainDB read, and
+    {"done": task_id, "result", "value", "seconds"} once it finished.
+    """
+
+    def __init__(self, directory: str = RECORD_DIR) -> None:
+        self.directory = directory
+        self.file = None
+        self.pid = None
+        self.flushed = 0.0
+        self.records = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def stats(self) -> dict:
+        return {"records": self.records}
+
+    def write(self, record: dict) -> None:
+        # Opened on first use, in the worker rather than the preloading master
+        if self.pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            name = f"tasks-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.ndjson.gz"
+            self.file = gzip.open(os.path.join(self.directory, name), "at")
+            self.pid = os.getpid()
+
+        record["t"] = time.time()
+        self.file.write(dumps(record) + "\n")
+        self.records += 1
+        now = time.monotonic()
+        if now - self.flushed >= RECORD_FLUSH:
+            self.file.flush()
+            self.flushed = now
+
+    def state(self, chain_id: str, key: str, value: Any) -> None:
+        self.write({"state": [chain_id, key, value]})
+
+
+RECORDER = Recorder()
+
+
+def recorded(f):
+    """Log a checker function's task, result and duration while recording is enabled."""
+    @functools.wraps(f)
+    async def wrapper(task, *args, **kwargs):
+        if not RECORDER.enabled:
+            return await f(task, *args, **kwargs)
+
+        RECORDER.write({"task": task.model_dump(mode="json", by_alias=True)})
+        result, value = "OK", None
+        start = perf_counter()
+        try:
+            value = await f(task, *args, **kwargs)
+            return value
+        except BaseException as e:
+            result = metrics.outcome_of(e)
+            raise
+        finally:
+            RECORDER.write({"done": task.task_id, "result": result, "value": value,
+                            "seconds": perf_counter() - start})
+    return wrapper
@@ -0,0 +1,287 @@
+"""Replay task logs recorded with BAMBI_RECORD_DIR.
+
+Feeds the recorded tasks to the checker again at their recorded pace, or
+--speed times faster, against one stand-in per recorded team address (or
+a real deployment with --address) and reports throughput, scheduling lag
+and latency percentiles per method next to the recorded ones.
+
+Chain state is rebuilt by the replay itself: puts in the log run again,
+and gets whose put happened before the recording started are seeded with
+a put for the same chain and flag first. Exploit tasks get the username
+of the replayed putflag. With --state recorded the ChainDB values read
+during the recording are loaded instead and nothing is seeded, which is
+only useful against the service the log was recorded from.
+
+    python replay.py /srv/bambi-record --speed 4 --concurrency 64 --json new.json
+    python replay.py /srv/bambi-record --speed 4 --baseline new.json
+"""
+from glob import glob
+from ipaddress import ip_address
+from typing import Any, Optional
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+
+from enochecker_core import CheckerMethod
+
+import bench
+import checker
+import record
+from standin import StandinService
+
+PUTS = {CheckerMethod.GETFLAG: CheckerMethod.PUTFLAG, CheckerMethod.GETNOISE: CheckerMethod.PUTNOISE}
+
+
+def read_log(paths: list[str]) -> list[dict]:
+    files = []
+    for path in paths:
+        files += sorted(glob(os.path.join(path, "*.ndjson.gz"))) if os.path.isdir(path) else [path]
+
+    records = []
+    for path in files:
+        with gzip.open(path, "rt") as f:
+            try:
+                for line in f:
+                    records.append(record.loads(line))
+            except (EOFError, json.JSONDecodeError):
+                # Written by a worker that is still running or was killed
+                pass
+    records.sort(key=lambda r: r["t"])
+    return records
+
+
+class Recording():
+    def __init__(self, records: list[dict]) -> None:
+        self.tasks = [r for r in records if "task" in r]
+        self.done = {r["done"]: r for r in records if "done" in r}
+        self.state: dict[tuple[str, str], Any] = {}
+        for r in records:
+            if "state" in r:
+                chain_id, key, value = r["state"]
+                self.state.setdefault((chain_id, key), value)
+
+    @property
+    def span(self) -> float:
+        return self.tasks[-1]["t"] - self.tasks[0]["t"] if self.tasks else 0.0
+
+    def summary(self) -> dict:
+        stats = bench.Stats()
+        for r in self.tasks:
+            done = self.done.get(r["task"]["taskId"])
+            if done is not None:
+                stats.record(label(r["task"]), done["result"], done["seconds"])
+        return stats.summary(self.span)
+
+
+def label(message: dict) -> str:
+    return f"{message['method']}{message['variantId']}"
+
+
+class Replay():
+    def __init__(self, recording: Recording, addresses: dict[str, str], speed: float, concurrency: int) -> None:
+        self.recording = recording
+        self.addresses = addresses
+        self.speed = speed
+        self.limit = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+        self.stats = bench.Stats()
+        self.lag: list[float] = []
+        self.seeded = 0
+        # Username a recorded putflag returned -> the one its replay returned
+        self.usernames: dict[str, asyncio.Future] = {}
+        # Chains with a put in the log, set once it ran again; their gets wait for it
+        self.puts: dict[str, asyncio.Event] = {}
+
+    def message(self, message: dict, **update: Any):
+        message = {**message, "address": self.addresses[message["address"]], **update}
+        return bench.TASK_MESSAGES[CheckerMethod(message["method"])].model_validate(message)
+
+    def expect_username(self, original: Optional[str]) -> Optional[asyncio.Future]:
+        if not isinstance(original, str):
+            return None
+        fut = self.usernames.get(original)
+        if fut is None:
+            fut = self.usernames[original] = asyncio.get_running_loop().create_future()
+        return fut
+
+    async def seed(self) -> None:
+        """Run a put for every chain that is read before anything in the log wrote it."""
+        put, seeds = set(), []
+        for r in self.recording.tasks:
+            message = r["task"]
+            method = CheckerMethod(message["method"])
+            chain_id = message["taskChainId"]
+            if method in PUTS.values():
+                put.add(chain_id)
+            elif method in PUTS and chain_id not in put:
+                put.add(chain_id)
+                seeds.append(message)
+
+        async def run(message: dict) -> None:
+            method = PUTS[CheckerMethod(message["method"])]
+            task = self.message(message, method=method.value, taskId=-message["taskId"])
+            result, value, _ = await bench.run_task(task)
+            self.seeded += result == "OK"
+            flag_info = self.recording.state.get((message["taskChainId"], "flag_info"))
+            if method == CheckerMethod.PUTFLAG and flag_info is not None:
+                fut = self.expect_username(flag_info[0])
+                if not fut.done():
+                    fut.set_result(value if result == "OK" else None)
+
+        limit = self.limit or asyncio.Semaphore(64)
+        async def limited(message):
+            async with limit:
+                await run(message)
+        await asyncio.gather(*(limited(message) for message in seeds))
+
+    async def run_task(self, message: dict, due: float) -> None:
+        loop = asyncio.get_running_loop()
+        method = CheckerMethod(message["method"])
+        update = {}
+        if method == CheckerMethod.EXPLOIT and message["attackInfo"] in self.usernames:
+            username = await self.usernames[message["attackInfo"]]
+            if username is not None:
+                update["attackInfo"] = username
+        # At higher speeds a get can come due before its put finished, which the engine never does
+        if method in PUTS and message["taskChainId"] in self.puts:
+            await self.puts[message["taskChainId"]].wait()
+        username = None
+        if method == CheckerMethod.PUTFLAG:
+            done = self.recording.done.get(message["taskId"])
+            username = self.expect_username(done and done["value"])
+
+        if self.limit is not None:
+            await self.limit.acquire()
+        try:
+            self.lag.append(loop.time() - due)
+            result, value, seconds = await bench.run_task(self.message(message, **update))
+        finally:
+            if self.limit is not None:
+                self.limit.release()
+        self.stats.record(label(message), result, seconds)
+        if username is not None and not username.done():
+            username.set_result(value if result == "OK" else None)
+        if method in PUTS.values():
+            self.puts[message["taskChainId"]].set()
+
+    async def run(self) -> dict:
+        loop = asyncio.get_running_loop()
+        tasks = self.recording.tasks
+        for r in tasks:
+            method = CheckerMethod(r["task"]["method"])
+            if method in PUTS.values():
+                self.puts.setdefault(r["task"]["taskChainId"], asyncio.Event())
+            if method == CheckerMethod.PUTFLAG:
+                done = self.recording.done.get(r["task"]["taskId"])
+                self.expect_username(done and done["value"])
+
+        first = tasks[0]["t"] if tasks else 0.0
+        start = loop.time()
+        running = set()
+        for r in tasks:
+            due = start + (r["t"] - first) / self.speed
+            if due > loop.time():
+                await asyncio.sleep(due - loop.time())
+            running.add(asyncio.create_task(self.run_task(r["task"], due)))
+        await asyncio.gather(*running)
+
+        # A putflag that never ran again leaves its exploits with the recorded username
+        for fut in self.usernames.values():
+            if not fut.done():
+                fut.set_result(None)
+
+        summary = self.stats.summary(loop.time() - start)
+        summary["lag_p50_ms"] = bench.percentile(self.lag, 50) * 1000
+        summary["lag_p99_ms"] = bench.percentile(self.lag, 99) * 1000
+        summary["seeded"] = self.seeded
+        return summary
+
+
+def print_summary(replayed: dict, recorded: dict, speed: float, baseline: Optional[dict]) -> None:
+    print(f"{'method':<12} {'tasks':>6} {'rec ok':>7} {'ok':>6} {'rec p50':>8} {'p50':>8} "
+          f"{'rec p95':>8} {'p95':>8} {'rec p99':>8} {'p99':>8}" + (f" {'Δp99 ms':>9}" if baseline else ""))
+    for name, m in replayed["methods"].items():
+        rec = recorded["methods"].get(name, {"results": {}, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0})
+        line = (f"{name:<12} {m['tasks']:>6} {rec['results'].get('OK', 0):>7} {m['results'].get('OK', 0):>6} "
+                f"{rec['p50_ms']:>8.1f} {m['p50_ms']:>8.1f} {rec['p95_ms']:>8.1f} {m['p95_ms']:>8.1f} "
+                f"{rec['p99_ms']:>8.1f} {m['p99_ms']:>8.1f}")
+        if baseline and name in baseline["methods"]:
+            line += f" {m['p99_ms'] - baseline['methods'][name]['p99_ms']:>+9.1f}"
+        print(line)
+
+    print(f"{replayed['tasks']} tasks recorded over {recorded['elapsed_s']:.1f}s replayed at {speed:g}x in "
+          f"{replayed['elapsed_s']:.1f}s: {replayed['tasks_per_s']:.1f} tasks/s, "
+          f"start lag p50 {replayed['lag_p50_ms']:.1f}ms p99 {replayed['lag_p99_ms']:.1f}ms, "
+          f"{replayed['seeded']} chains seeded")
+    if baseline:
+        print(f"baseline: {baseline['tasks_per_s']:.1f} tasks/s, start lag p99 {baseline['lag_p99_ms']:.1f}ms")
+
+
+async def run_replay(args, recording: Recording) -> dict:
+    checker.preload()
+    collection = checker.checker._chain_collection = bench.MemoryCollection()
+    if args.state == "recorded":
+        for (chain_id, key), value in recording.state.items():
+            collection.docs[(chain_id, key)] = {"task_chain_id": chain_id, "key": key, "value": value}
+
+    recorded = sorted({r["task"]["address"] for r in recording.tasks})
+    if args.address is not None:
+        addresses = {address: args.address for address in recorded}
+    else:
+        base = ip_address(args.standin_base)
+        addresses = {address: str(base + i + 1) for i, address in enumerate(recorded)}
+
+    replay = Replay(recording, addresses, args.speed, args.concurrency)
+    if args.address is not None:
+        return await replay.run()
+
+    standins = [StandinService(host, checker.SERVICE_PORT, latency=args.latency, jitter=args.jitter,
+                               fork_delay=args.fork_delay) for host in addresses.values()]
+    for standin in standins:
+        await standin.__aenter__()
+    try:
+        if args.state == "replay":
+            await replay.seed()
+        return await replay.run()
+    finally:
+        for standin in standins:
+            await standin.__aexit__(None, None, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded checker tasks")
+    parser.add_argument("logs", nargs="+", help="task logs or directories of them")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay this many times faster than recorded")
+    parser.add_argument("--concurrency", type=int, default=0, help="max tasks in flight, 0 for no limit")
+    parser.add_argument("--state", choices=("replay", "recorded"), default="replay",
+                        help="rebuild chain state by replaying puts, or load the recorded reads")
+    parser.add_argument("--address", default=None, help="replay against a real service instead of stand-ins")
+    parser.add_argument("--standin-base", default="127.1.0.0", help="team addresses map to the hosts after this one")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--fork-delay", type=float, default=0.0)
+    parser.add_argument("--baseline", default=None, help="summary JSON of an earlier replay to compare with")
+    parser.add_argument("--json", default=None, help="also write the summary to this file")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+    # Don't record the replay itself
+    record.RECORDER.directory = ""
+
+    recording = Recording(read_log(args.logs))
+    replayed = asyncio.run(run_replay(args, recording))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_summary(replayed, recording.summary(), args.speed, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(replayed, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""Front router for running the checker on several nodes.
+
+Forwards every task to one checker node, picked by consistent hashing on
+the task's address, so a team's connection pool, cache, coalescing and
+admission slots all live on one node. The nodes share the Mongo backend.
+Adding or removing a node only moves the teams whose ring points it takes
+over or gives up, about 1/N of them. At runtime the node list can only be
+changed to nodes from BAMBI_ROUTER_ALLOWED_NODES, which defaults to the
+nodes the router started with.
+
+    BAMBI_ROUTER_NODES=http://checker-1:8000,http://checker-2:8000 uvicorn router:app --port 8000
+"""
+from bisect import bisect
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import httpx
+
+ROUTER_NODES = [node.strip().rstrip("/") for node in os.getenv("BAMBI_ROUTER_NODES", "").split(",") if node.strip()]
+# Ring points per node, more spread the teams more evenly
+ROUTER_VNODES = int(os.getenv("BAMBI_ROUTER_VNODES", "128"))
+# A node that refused a connection is skipped this long, its teams go to the next node on the ring
+ROUTER_RETRY = float(os.getenv("BAMBI_ROUTER_RETRY", "10"))
+ROUTER_CONNECT_TIMEOUT = float(os.getenv("BAMBI_ROUTER_CONNECT_TIMEOUT", "2"))
+# Nodes PUT /nodes may switch to, anything else could be sent the teams' flags
+ROUTER_ALLOWED_NODES = [node.strip().rstrip("/") for node in os.getenv("BAMBI_ROUTER_ALLOWED_NODES", "").split(",")
+                        if node.strip()] or ROUTER_NODES
+# A node that has not answered this long after the task's own timeout counts as hung
+ROUTER_TIMEOUT_MARGIN = float(os.getenv("BAMBI_ROUTER_TIMEOUT_MARGIN", "5"))
+# For tasks that do not state a timeout, in ms like the task message
+ROUTER_DEFAULT_TASK_TIMEOUT = 30000
+
+
+def read_timeout(tasks: list[dict]) -> httpx.Timeout:
+    """Bound each read by the longest task timeout, a batch streams a result at least that often."""
+    budgets = [task.get("timeout") for task in tasks]
+    budget = max((t for t in budgets if isinstance(t, (int, float)) and t > 0), default=ROUTER_DEFAULT_TASK_TIMEOUT)
+    return httpx.Timeout(budget / 1000 + ROUTER_TIMEOUT_MARGIN, connect=ROUTER_CONNECT_TIMEOUT)
+
+
+class HashRing():
+    """Consistent hash ring with virtual nodes."""
+
+    def __init__(self, nodes: list[str] = (), vnodes: int = ROUTER_VNODES) -> None:
+        self.vnodes = vnodes
+        self.nodes: list[str] = []
+        self.points: list[int] = []
+        self.owners: list[str] = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def add(self, node: str) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.vnodes):
+            point = self.hash(f"{node}#{i}")
+            idx = bisect(self.points, point)
+            self.points.insert(idx, point)
+            self.owners.insert(idx, node)
+
+    def remove(self, node: str) -> None:
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        kept = [(point, owner) for point, owner in zip(self.points, self.owners) if owner != node]
+        self.points = [point for point, _ in kept]
+        self.owners = [owner for _, owner in kept]
+
+    def lookup(self, key: str, skip: set[str] = frozenset()) -> Optional[str]:
+        """Node owning `key`, or the next one along the ring that is not in `skip`."""
+        if not self.points:
+            return None
+        start = bisect(self.points, self.hash(key))
+        for i in range(len(self.points)):
+            owner = self.owners[(start + i) % len(self.points)]
+            if owner not in skip:
+                return owner
+        return None
+
+    def shares(self) -> dict[str, float]:
+        """Fraction of the key space each node owns."""
+        shares = dict.fromkeys(self.nodes, 0.0)
+        for i, owner in enumerate(self.owners):
+            # A point owns the arc from its predecessor up to itself
+            previous = self.points[i - 1] if i else self.points[-1] - (1 << 64)
+            shares[owner] += (self.points[i] - previous) / (1 << 64)
+        return shares
+
+
+class Router():
+    def __init__(self, nodes: list[str] = ROUTER_NODES, vnodes: int = ROUTER_VNODES,
+                 allowed: list[str] = ROUTER_ALLOWED_NODES) -> None:
+        self.ring = HashRing(nodes, vnodes)
+        self.allowed = set(allowed)
+        self.down: dict[str, float] = {}
+        self.client: Optional[httpx.AsyncClient] = None
+        self.forwarded: Counter = Counter()
+        self.failovers = 0
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "nodes": self.ring.nodes,
+            "down": [node for node, until in self.down.items() if until > now],
+            "shares": self.ring.shares(),
+            "forwarded": dict(self.forwarded),
+            "failovers": self.failovers,
+        }
+
+    def set_nodes(self, nodes: list[str]) -> None:
+        nodes = [node.rstrip("/") for node in nodes]
+        unknown = [node for node in nodes if node not in self.allowed]
+        if unknown:
+            raise ValueError(f"Nodes not in BAMBI_ROUTER_ALLOWED_NODES: {', '.join(unknown)}")
+        for node in list(self.ring.nodes):
+            if node not in nodes:
+                self.ring.remove(node)
+                self.down.pop(node, None)
+        for node in nodes:
+            self.ring.add(node)
+
+    def route(self, address: str, skip: set[str] = frozenset()) -> Optional[str]:
+        now = time.monotonic()
+        down = {node for node, until in self.down.items() if until > now}
+        # With every node down, try the owner again rather than dropping the task
+        return self.ring.lookup(address, skip | down) or self.ring.lookup(address, skip)
+
+    def failed(self, node: str) -> None:
+        self.down[node] = time.monotonic() + ROUTER_RETRY
+        self.failovers += 1
+
+    async def forward(self, address: str, path: str, body: bytes, timeout: httpx.Timeout) -> httpx.Response:
+        tried = set()
+        while (node := self.route(address, tried)) is not None:
+            try:
+                response = await self.client.post(node + path, content=body, timeout=timeout,
+                                                   headers={"content-type": "application/json"})
+            except httpx.ConnectError:
+                # Nothing reached the node, so the task can safely go elsewhere
+                self.failed(node)
+                tried.add(node)
+                continue
+            self.forwarded[node] += 1
+            return response
+        raise httpx.ConnectError(f"No checker node reachable for {address}")
+
+    async def batch(self, tasks: list[dict]) -> AsyncIterator[bytes]:
+        """Split a batch by node, forward the parts and stream the results back with their original index."""
+        lines: asyncio.Queue = asyncio.Queue()
+
+        async def send(node: Optional[str], indices: list[int], tried: set[str]) -> None:
+            answered = set()
+            try:
+                if node is None:
+                    raise httpx.ConnectError("No checker node reachable")
+                part = [tasks[i] for i in indices]
+                async with self.client.stream("POST", node + "/batch", json=part, timeout=read_timeout(part)) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        result = json.loads(line)
+                        result["index"] = indices[result["index"]]
+                        answered.add(result["index"])
+                        await lines.put(json.dumps(result).encode() + b"\n")
+                self.forwarded[node] += len(indices)
+            except httpx.ConnectError:
+                if node is not None:
+                    self.failed(node)
+                    return await split(indices, tried | {node})
+                await fail(indices, answered, "No checker node reachable")
+            except httpx.HTTPError as e:
+                await fail(indices, answered, f"Checker node failed: {e}")
+
+        async def fail(indices: list[int], answered: set[int], message: str) -> None:
+            for i in indices:
+                if i not in answered:
+                    result = {"index": i, "taskId": tasks[i].get("taskId"), "result": "INTERNAL_ERROR",
+                              "message": message, "attackInfo": None, "flag": None}
+                    await lines.put(json.dumps(result).encode() + b"\n")
+
+        async def split(indices: list[int], tried: set[str]) -> None:
+            groups: dict[Optional[str], list[int]] = {}
+            for i in indices:
+                groups.setdefault(self.route(tasks[i]["address"], tried), []).append(i)
+            await asyncio.gather(*(send(node, group, tried) for node, group in groups.items()))
+
+        async def run() -> None:
+            try:
+                await split(list(range(len(tasks))), set())
+            finally:
+                await lines.put(None)
+
+        runner = asyncio.create_task(run())
+        try:
+            while (line := await lines.get()) is not None:
+                yield line
+        finally:
+            runner.cancel()
+
+
+ROUTER = Router()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=1000)
+    async with httpx.AsyncClient(timeout=read_timeout([]), limits=limits) as client:
+        ROUTER.client = client
+        yield
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.post("/")
+async def task(request: Request) -> Response:
+    body = await request.body()
+    try:
+        message = json.loads(body)
+        address = message["address"]
+    except (ValueError, KeyError, TypeError):
+        return JSONResponse({"detail": "Task message without an address"}, status_code=422)
+    try:
+        response = await ROUTER.forward(address, "/", body, read_timeout([message]))
+    except httpx.HTTPError as e:
+        return JSONResponse({"detail": str(e)}, status_code=502)
+    return Response(response.content, status_code=response.status_code, media_type="application/json")
+
+
+@app.post("/batch")
+async def batch(request: Request) -> Response:
+    try:
+        tasks = json.loads(await request.body())
+        if not isinstance(tasks, list) or not all(isinstance(task["address"], str) for task in tasks):
+            raise TypeError
+    except (ValueError, KeyError, TypeError):
+        return JSONResponse({"detail": "Expected a list of task messages with an address"}, status_code=422)
+    return StreamingResponse(ROUTER.batch(tasks), media_type="application/x-ndjson")
+
+
+@app.get("/service")
+async def service() -> Response:
+    # Every node serves the same checker, any reachable one can answer
+    for node in ROUTER.ring.nodes:
+        try:
+            response = await ROUTER.client.get(node + "/service")
+        except httpx.HTTPError:
+            continue
+        return Response(response.content, status_code=response.status_code, media_type="application/json")
+    return JSONResponse({"detail": "No checker node reachable"}, status_code=502)
+
+
+@app.get("/nodes")
+def nodes() -> dict:
+    return ROUTER.stats()
+
+
+@app.put("/nodes")
+def set_nodes(nodes: list[str]) -> dict:
+    """Replace the node list, only teams on the ring arcs that changed hands move."""
+    try:
+        ROUTER.set_nodes(nodes)
+    except ValueError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    return ROUTER.stats()
@@ -0,0 +1,196 @@
+"""Local multi-process setup for the sharded checker.
+
+Starts stand-ins for --teams teams, --nodes checker nodes (one process
+each) and the router in front of them, then drives flag, noise and havoc
+chains for every team through the router over HTTP and reports tasks/sec,
+latency percentiles and how the tasks spread over the nodes. Given several
+node counts it runs once per count, so scaling shows up side by side.
+
+Nodes keep their ChainDB in memory unless --mongo is given. That only
+works because the router keeps every team on one node; with Mongo the
+nodes share state like in a deployment.
+
+    python shard_local.py --nodes 1 2 4 --teams 40 --chains 5
+"""
+from ipaddress import ip_address
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+SERVICE_PORT = 9204
+BASE_PORT = 8100
+ROUTER_PORT = 8099
+
+
+def serve_node(port: int, mongo: bool) -> None:
+    import uvicorn
+    import bench
+    import checker
+
+    checker.preload()
+    if not mongo:
+        checker.checker._chain_collection = bench.MemoryCollection()
+    # The lifespan only connects to Mongo (and sets up telemetry)
+    uvicorn.run(checker.app(), host="127.0.0.1", port=port, lifespan="on" if mongo else "off", log_level="warning")
+
+
+def spawn(*args: str, env: dict = None) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *args], env={**os.environ, **(env or {})},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_ready(client: httpx.AsyncClient, url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{url} did not come up")
+        await asyncio.sleep(0.2)
+
+
+async def wait_listening(host: str, port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{host}:{port} did not come up")
+            await asyncio.sleep(0.2)
+
+
+class Driver():
+    def __init__(self, client: httpx.AsyncClient, concurrency: int) -> None:
+        import bench
+        self.bench = bench
+        self.client = client
+        self.limit = asyncio.Semaphore(concurrency)
+        self.stats = bench.Stats()
+
+    async def task(self, method, variant: int, chain_id: str, address: str, **extra):
+        task = self.bench.make_task(method, variant, chain_id, address, **extra)
+        async with self.limit:
+            start = time.perf_counter()
+            try:
+                response = await self.client.post(f"http://127.0.0.1:{ROUTER_PORT}/",
+                                                  json=task.model_dump(mode="json", by_alias=True))
+                result = response.json() if response.status_code == 200 else {"result": f"HTTP {response.status_code}"}
+            except httpx.HTTPError as e:
+                result = {"result": type(e).__name__}
+            seconds = time.perf_counter() - start
+        self.stats.record(f"{method.value}{variant}", result["result"], seconds)
+        return result
+
+    async def team(self, address: str, chains: int) -> None:
+        from enochecker_core import CheckerMethod
+        for n in range(chains):
+            chain = f"s0_r1_t{address}_i{n}"
+            flag = self.bench.gen_flag()
+            result = await self.task(CheckerMethod.PUTFLAG, 0, f"flag_{chain}", address, flag=flag)
+            if result["result"] == "OK":
+                await asyncio.gather(
+                    self.task(CheckerMethod.GETFLAG, 0, f"flag_{chain}", address, flag=flag),
+                    self.task(CheckerMethod.EXPLOIT, 0, f"exploit_{chain}", address, flag_regex=self.bench.FLAG_REGEX,
+                              flag_hash=hashlib.sha256(flag.encode()).hexdigest(), attack_info=result["attackInfo"]),
+                )
+            for variant in (0, 1):
+                if (await self.task(CheckerMethod.PUTNOISE, variant, f"noise_{chain}_v{variant}", address))["result"] == "OK":
+                    await self.task(CheckerMethod.GETNOISE, variant, f"noise_{chain}_v{variant}", address)
+            await asyncio.gather(*(self.task(CheckerMethod.HAVOC, v, f"havoc_{chain}_v{v}", address) for v in range(3)))
+
+
+async def run(args, nodes: int, addresses: list[str]) -> dict:
+    urls = [f"http://127.0.0.1:{BASE_PORT + i}" for i in range(nodes)]
+    procs = [spawn(__file__, "--node", str(BASE_PORT + i), *(["--mongo"] if args.mongo else [])) for i in range(nodes)]
+    procs.append(spawn("-m", "uvicorn", "router:app", "--port", str(ROUTER_PORT), "--log-level", "warning",
+                       env={"BAMBI_ROUTER_NODES": ",".join(urls)}))
+    try:
+        limits = httpx.Limits(max_connections=None)
+        async with httpx.AsyncClient(timeout=httpx.Timeout(None), limits=limits) as client:
+            await wait_listening(addresses[-1], SERVICE_PORT)
+            for url in urls + [f"http://127.0.0.1:{ROUTER_PORT}"]:
+                await wait_ready(client, url + "/service")
+
+            driver = Driver(client, args.concurrency)
+            start = time.perf_counter()
+            await asyncio.gather(*(driver.team(address, args.chains) for address in addresses))
+            summary = driver.stats.summary(time.perf_counter() - start)
+            ring = (await client.get(f"http://127.0.0.1:{ROUTER_PORT}/nodes")).json()
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+
+    summary["nodes"] = nodes
+    summary["forwarded"] = ring["forwarded"]
+    summary["shares"] = ring["shares"]
+    return summary
+
+
+def print_summary(runs: list[dict]) -> None:
+    import bench
+    for summary in runs:
+        print(f"== {summary['nodes']} node(s)")
+        bench.print_summary(summary)
+        for node, count in sorted(summary["forwarded"].items()):
+            print(f"   {node}: {count} tasks, {summary['shares'][node] * 100:.1f}% of the ring")
+    if len(runs) > 1:
+        base = runs[0]["tasks_per_s"]
+        print("nodes  tasks/s  speedup")
+        for summary in runs:
+            print(f"{summary['nodes']:>5} {summary['tasks_per_s']:>8.1f} {summary['tasks_per_s'] / base:>8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run and load a local sharded checker")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--teams", type=int, default=20)
+    parser.add_argument("--chains", type=int, default=3, help="rounds of tasks per team")
+    parser.add_argument("--concurrency", type=int, default=64, help="max tasks in flight")
+    parser.add_argument("--standin-base", default="127.2.0.0", help="teams get the hosts after this one")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--mongo", action="store_true", help="nodes use the Mongo configured via MONGO_*")
+    parser.add_argument("--json", default=None, help="also write the summaries to this file")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--node", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.node:
+        serve_node(args.node, args.mongo)
+        return
+
+    logging.getLogger().setLevel(args.log_level)
+    logging.getLogger("httpx").setLevel(args.log_level)
+
+    base = ip_address(args.standin_base)
+    addresses = [str(base + i + 1) for i in range(args.teams)]
+    standin = spawn("standin.py", "--latency", str(args.latency), "--host", *addresses)
+    try:
+        runs = [asyncio.run(run(args, nodes, addresses)) for nodes in args.nodes]
+    finally:
+        standin.terminate()
+        standin.wait()
+
+    print_summary(runs)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(runs, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+"""Protocol-compatible stand-in for meta/bambi-notes.c.
+
+Every connection behaves like a freshly forked bambi-notes process behind
+xinetd: same prompts, same fgets length limits and strtol parsing, the
+same file layout under a data directory, and the slot 0 overflow that the
+exploit relies on. Latency, jitter and a per-connection fork delay can be
+injected to approximate a remote team.
+
+    python standin.py --port 9204 --latency 0.02 --jitter 0.005
+"""
+from asyncio import StreamReader, StreamWriter
+from typing import Optional
+import argparse
+import asyncio
+import contextlib
+import errno
+import os
+import random
+import re
+import shutil
+import tempfile
+
+NOTE_SIZE = 0x60
+NOTE_COUNT = 10
+DEFAULT_NOTE = b"Well, it's a note-taking service. What did you expect?"
+# The default note is calloc(sizeof(DEFAULT_NOTE)): its chunk ends at 0x38,
+# and the user struct (username first) starts 0x40 bytes behind slot 0
+BASE_NOTE_SIZE = 0x38
+BASE_NOTE_OVERFLOW = 0x40
+STORAGE_DIR = "/service/data/"
+# sizeof(STORAGE_DIR) + sizeof(username) + 0x20 in load_note/save_note
+PATH_BUF_SIZE = 20 + 40 + 0x20
+ALARM = 120
+
+UNAUTHENTICATED_MENU = (
+    b"===== [Unauthenticated] =====\n"
+    b"   1. Register\n"
+    b"   2. Login\n"
+    b"> "
+)
+
+AUTHENTICATED_MENU = (
+    b"   1. Create\n"
+    b"   2. Print\n"
+    b"   3. List Saved\n"
+    b"   4. Delete\n"
+    b"   5. Load\n"
+    b"   6. Save\n"
+    b"> "
+)
+
+_SPACE = re.compile(rb"[ \t\n\v\f\r]*([+-]?)")
+_HEX = re.compile(rb"0[xX]([0-9a-fA-F]+)")
+_OCT = re.compile(rb"0[0-7]*")
+_DEC = re.compile(rb"[0-9]+")
+
+
+def strtol(buf: bytes) -> Optional[int]:
+    """strtol(buf, &endp, 0), None when no digits were converted."""
+    m = _SPACE.match(buf)
+    sign = -1 if m.group(1) == b"-" else 1
+    rest = buf[m.end():]
+    if (digits := _HEX.match(rest)) is not None:
+        value = int(digits.group(1), 16)
+    elif (digits := _OCT.match(rest)) is not None:
+        value = int(digits.group(), 8)
+    elif (digits := _DEC.match(rest)) is not None:
+        value = int(digits.group(), 10)
+    else:
+        return None
+    return max(-(1 << 63), min((1 << 63) - 1, sign * value))
+
+
+def sanitize(data: bytes) -> bytes:
+    """sanitize_string() NUL-terminates at the first '.', '/' or newline."""
+    return re.split(rb"[./\n]", data, maxsplit=1)[0].split(b"\0", 1)[0]
+
+
+def cstr(data: bytes) -> bytes:
+    return data.split(b"\0", 1)[0]
+
+
+class ServiceExit(Exception):
+    pass
+
+
+class Session():
+    def __init__(self, service: "StandinService", reader: StreamReader, writer: StreamWriter) -> None:
+        self.service = service
+        self.reader = reader
+        self.writer = writer
+        self.inbuf = bytearray()
+        self.eof = False
+        self.out = bytearray()
+        self.username: Optional[bytes] = None
+        self.notes: list[Optional[bytes]] = [DEFAULT_NOTE] + [None] * (NOTE_COUNT - 1)
+        self.base_note = True
+        self.heap_corrupted = False
+
+    def printf(self, data: bytes) -> None:
+        self.out += data
+
+    def perror(self, msg: str, err: int) -> None:
+        self.out += f"{msg}: {os.strerror(err)}\n".encode()
+
+    async def flush(self) -> None:
+        if not self.out:
+            return
+        await self.service.delay()
+        self.writer.write(bytes(self.out))
+        self.out.clear()
+        await self.writer.drain()
+
+    async def fgets(self, size: int) -> Optional[bytes]:
+        limit = size - 1
+        while True:
+            idx = self.inbuf.find(b"\n", 0, limit)
+            if idx >= 0:
+                end = idx + 1
+                break
+            if len(self.inbuf) >= limit:
+                end = limit
+                break
+            if self.eof:
+                if not self.inbuf:
+                    return None
+                end = len(self.inbuf)
+                break
+            await self.flush()
+            chunk = await self.reader.read(4096)
+            if not chunk:
+                self.eof = True
+            self.inbuf += chunk
+
+        line = bytes(self.inbuf[:end])
+        del self.inbuf[:end]
+        return line
+
+    async def getlong(self) -> int:
+        buf = await self.fgets(40)
+        if buf is None:
+            return -1
+        value = strtol(buf)
+        return -1 if value is None else value
+
+    def user_dir(self, username: bytes) -> str:
+        return os.path.join(self.service.data_dir, username.decode("latin-1"))
+
+    def user_path(self, filename: bytes) -> str:
+        return os.path.join(self.user_dir(self.username), filename.decode("latin-1"))
+
+    def display_path(self, filename: bytes) -> bytes:
+        return STORAGE_DIR.encode() + self.username + b"/" + filename
+
+    async def register(self) -> Optional[bytes]:
+        self.printf(b"Username:\n> ")
+        username = await self.fgets(40)
+        if username is None:
+            self.perror("Failed to read username", 0)
+            raise ServiceExit()
+        username = sanitize(username)
+
+        if os.path.exists(os.path.join(self.user_dir(username), "passwd")):
+            self.printf(b"Username already taken!\n")
+            return None
+
+        self.printf(b"Password:\n> ")
+        password = await self.fgets(40) or b""
+
+        try:
+            os.mkdir(self.user_dir(username), 0o775)
+        except OSError as e:
+            self.perror("Failed to create user directory!", e.errno)
+            raise ServiceExit()
+
+        with open(os.path.join(self.user_dir(username), "passwd"), "wb") as f:
+            f.write(sanitize(password))
+
+        self.printf(b"Registration successful!\n")
+        return username
+
+    async def login(self) -> Optional[bytes]:
+        self.printf(b"Username:\n> ")
+        username = await self.fgets(40)
+        if username is None:
+            self.perror("Failed to read username", 0)
+            raise ServiceExit()
+        username = sanitize(username)
+
+        passwd = os.path.join(self.user_dir(username), "passwd")
+        if not os.access(passwd, os.R_OK):
+            self.printf(b"User " + username + b" does not exist!\n")
+            return None
+
+        with open(passwd, "rb") as f:
+            stored = cstr(f.read(39))
+
+        self.printf(b"Password:\n> ")
+        password = sanitize(await self.fgets(40) or b"")
+        if stored != password:
+            self.printf(b"Wrong password!\n")
+            return None
+
+        self.printf(b"Login successful!\n")
+        return username
+
+    def valid_idx(self, idx: int) -> bool:
+        return 0 <= idx < NOTE_COUNT
+
+    async def create_note(self) -> None:
+        self.printf(b"Which slot to save the note into?\n> ")
+        idx = await self.getlong()
+        if not self.valid_idx(idx):
+            self.printf(b"Nice Try!\n")
+            return
+        if self.notes[idx] is not None:
+            self.printf(b"Already Occupied!\n")
+            return
+
+        self.notes[idx] = b""
+        self.printf(f"Note [{idx}]\n> ".encode())
+        note = await self.fgets(NOTE_SIZE)
+        if note is None:
+            raise ServiceExit()
+        if note.endswith(b"\n"):
+            note = note[:-1]
+        self.notes[idx] = cstr(note)
+        self.printf(b"Note Created!\n")
+
+    def list_notes(self) -> None:
+        self.printf(b"\n\n===== [" + self.username + b"'s Notes] =====\n")
+        header = False
+        for idx, note in enumerate(self.notes):
+            if note is None:
+                continue
+            if not header:
+                self.printf(b"Currently Loaded:\n")
+                header = True
+            self.printf(f"    {idx} | ".encode() + note + b"\n")
+
+        try:
+            names = os.listdir(self.user_dir(self.username))
+        except OSError as e:
+            self.perror("Failed to open user directory", e.errno)
+            raise ServiceExit()
+
+        self.printf(b"Saved Notes:\n")
+        for name in [".", "..", *names]:
+            if name == "passwd":
+                continue
+            self.printf(b" | " + name.encode("latin-1") + b"\n")
+        self.printf(b"===== [End of Notes] =====\n")
+
+    async def delete_note(self) -> None:
+        self.printf(b"<Idx> of Note to delete?\n> ")
+        idx = await self.getlong()
+        if not self.valid_idx(idx):
+            self.printf(b"Invalid Idx!\n")
+        elif self.notes[idx] is None:
+            self.printf(f"Note {idx} doesn't exist!\n".encode())
+        else:
+            if idx == 0 and self.heap_corrupted:
+                self.printf(b"free(): invalid size\n")
+                raise ServiceExit()
+            self.notes[idx] = None
+            if idx == 0:
+                self.base_note = False
+            self.printf(b"Note deleted!\n")
+
+    async def read_filename(self) -> Optional[bytes]:
+        limit = PATH_BUF_SIZE - len(STORAGE_DIR) - len(self.username) - 1
+        filename = await self.fgets(limit)
+        if filename is None:
+            return None
+        return sanitize(filename)
+
+    async def load_note(self) -> None:
+        self.printf(b"Which note to load?\nFilename > ")
+        filename = await self.read_filename()
+        if filename is None:
+            self.perror("Failed to get filename!", 0)
+            return
+
+        self.printf(b"Which slot should it be stored in?\n> ")
+        idx = await self.getlong()
+        if not self.valid_idx(idx):
+            self.printf(b"Invalid Idx!\n")
+            return
+        if self.notes[idx] is None:
+            self.notes[idx] = b""
+
+        path = self.user_path(filename)
+        try:
+            with open(path, "rb") as f:
+                data = f.read(NOTE_SIZE)
+        except IsADirectoryError:
+            self.perror("Note read failed", errno.EISDIR)
+            raise ServiceExit()
+        except OSError:
+            self.printf(b"Failed to open " + self.display_path(filename) + b"\n")
+            return
+
+        if idx == 0 and self.base_note and len(data) > BASE_NOTE_SIZE:
+            # read() runs past the default note into the next chunk header
+            self.heap_corrupted = True
+            if len(data) > BASE_NOTE_OVERFLOW:
+                self.username = cstr(data[BASE_NOTE_OVERFLOW:])
+        self.notes[idx] = cstr(data)
+        self.printf(b"Note " + self.display_path(filename) + f" was loaded into Slot {idx}.\n".encode())
+
+    async def save_note(self) -> None:
+        self.printf(b"Which note to save?\n> ")
+        idx = await self.getlong()
+        if not self.valid_idx(idx):
+            self.printf(b"Invalid Idx!\n")
+            return
+        if self.notes[idx] is None:
+            self.printf(f"Note {idx} does not exist!\n".encode())
+            return
+
+        self.printf(b"Which file to save into?\nFilename > ")
+        filename = await self.read_filename()
+        if filename is None:
+            self.perror("Failed to get filename!", 0)
+            filename = b""
+
+        try:
+            fd = os.open(self.user_path(filename), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except OSError as e:
+            self.perror("Failed to open file!", e.errno)
+            raise ServiceExit()
+        try:
+            os.write(fd, self.notes[idx])
+        finally:
+            os.close(fd)
+        self.printf(b"Note saved!\n")
+
+    async def run(self) -> None:
+        self.printf(b"Welcome to Bambi-Notes!\n")
+
+        while self.username is None:
+            self.printf(UNAUTHENTICATED_MENU)
+            option = await self.getlong()
+            if option in (0, -1):
+                return
+            elif option == 1:
+                self.username = await self.register()
+            elif option == 2:
+                self.username = await self.login()
+            elif option == 1337:
+                self.printf(b"Nice Try!\nYeah this isn't going to do anything\n")
+
+        while True:
+            self.printf(b"===== [" + self.username + b"] =====\n" + AUTHENTICATED_MENU)
+            option = await self.getlong()
+            if option in (0, -1):
+                return
+            elif option == 1:
+                await self.create_note()
+            elif option == 3:
+                self.list_notes()
+            elif option == 4:
+                await self.delete_note()
+            elif option == 5:
+                await self.load_note()
+            elif option == 6:
+                await self.save_note()
+
+
+class StandinService():
+    def __init__(self, host: str = "127.0.0.1", port: int = 9204, data_dir: Optional[str] = None,
+                 latency: float = 0.0, jitter: float = 0.0, fork_delay: float = 0.0) -> None:
+        self.host = host
+        self.port = port
+        self.owns_data_dir = data_dir is None
+        self.data_dir = data_dir or tempfile.mkdtemp(prefix="bambi-notes-")
+        self.latency = latency
+        self.jitter = jitter
+        self.fork_delay = fork_delay
+        self.server: Optional[asyncio.Server] = None
+        self.connections = 0
+
+    async def delay(self) -> None:
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def handle(self, reader: StreamReader, writer: StreamWriter) -> None:
+        self.connections += 1
+        session = Session(self, reader, writer)
+        try:
+            if self.fork_delay > 0:
+                await asyncio.sleep(self.fork_delay)
+            await asyncio.wait_for(session.run(), ALARM)
+        except (ServiceExit, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            try:
+                await session.flush()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    async def start(self) -> "StandinService":
+        self.server = await asyncio.start_server(self.handle, self.host, self.port, backlog=1024)
+        return self
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.owns_data_dir:
+            shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    async def __aenter__(self) -> "StandinService":
+        return await self.start()
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Protocol-compatible bambi-notes stand-in")
+    parser.add_argument("--host", nargs="+", default=["127.0.0.1"], help="one service per host, as per team")
+    parser.add_argument("--port", type=int, default=9204)
+    parser.add_argument("--data-dir", default=None, help="defaults to a fresh temp dir")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds of uniform jitter")
+    parser.add_argument("--fork-delay", type=float, default=0.0, help="seconds before the banner")
+    args = parser.parse_args()
+
+    async def serve():
+        async with contextlib.AsyncExitStack() as stack:
+            for host in args.host:
+                service = await stack.enter_async_context(StandinService(
+                    host, args.port, args.data_dir, args.latency, args.jitter, args.fork_delay))
+                print(f"Serving bambi-notes on {host}:{args.port}, data in {service.data_dir}")
+            await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+from collections import deque
+from time import monotonic
+import os
+
+TRANSCRIPT_ENTRIES = int(os.getenv("BAMBI_TRANSCRIPT_ENTRIES", "256"))
+TRANSCRIPT_BYTES = int(os.getenv("BAMBI_TRANSCRIPT_BYTES", str(1 << 20)))
+# Comma separated team addresses whose sessions are always rendered, "*" for all
+TRACED = {addr.strip() for addr in os.getenv("BAMBI_TRACE", "").split(",") if addr.strip()}
+
+RECEIVED = ">>>"
+SENT = "<<<"
+
+
+def traced(address: str) -> bool:
+    return "*" in TRACED or address in TRACED
+
+
+class Transcript():
+    """Ring buffer of the raw bytes exchanged in one session.
+
+    Recording only appends a reference to the chunk; nothing is formatted
+    until render() is called for a failed or traced session.
+    """
+
+    __slots__ = ("entries", "size", "dropped", "start")
+
+    def __init__(self) -> None:
+        self.entries: deque[tuple[float, str, bytes]] = deque()
+        self.size = 0
+        self.dropped = 0
+        self.start = monotonic()
+
+    def record(self, direction: str, data: bytes) -> None:
+        self.entries.append((monotonic(), direction, data))
+        self.size += len(data)
+        while len(self.entries) > TRANSCRIPT_ENTRIES or (self.size > TRANSCRIPT_BYTES and len(self.entries) > 1):
+            self.size -= len(self.entries.popleft()[2])
+            self.dropped += 1
+
+    def render(self) -> str:
+        lines = []
+        if self.dropped:
+            lines.append(f"... {self.dropped} earlier chunks dropped")
+        for timestamp, direction, data in self.entries:
+            lines.append(f"+{timestamp - self.start:.3f}s {direction} {data!r}")
+        return "\n".join(lines)
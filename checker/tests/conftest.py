@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The checker modules import each other by plain name, as they do when run from src
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
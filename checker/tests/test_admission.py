@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from admission import Admission, FLAG, OTHER
+
+
+@pytest.fixture
+def admission(tmp_path):
+    return Admission(limit=1, directory=str(tmp_path))
+
+
+def test_slots_are_limited(admission):
+    async def main():
+        loop = asyncio.get_running_loop()
+        slot = await admission.acquire("10.1.1.1", OTHER, loop.time() + 1)
+        with pytest.raises(TimeoutError):
+            await admission.acquire("10.1.1.1", OTHER, loop.time() + 0.05)
+        # Other teams have their own slots
+        other = await admission.acquire("10.1.2.1", OTHER, loop.time() + 0.05)
+        admission.release("10.1.2.1", other)
+        admission.release("10.1.1.1", slot)
+        slot = await admission.acquire("10.1.1.1", OTHER, loop.time() + 0.05)
+        admission.release("10.1.1.1", slot)
+
+    asyncio.run(main())
+    assert admission.stats()["expired"] == 1
+    assert admission.stats()["held"] == 0
+
+
+def test_slots_are_shared_across_instances(admission, tmp_path):
+    # Another worker, same lock files
+    other = Admission(limit=1, directory=str(tmp_path))
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        slot = await admission.acquire("10.1.1.1", OTHER, loop.time() + 1)
+        with pytest.raises(TimeoutError):
+            await other.acquire("10.1.1.1", OTHER, loop.time() + 0.05)
+        admission.release("10.1.1.1", slot)
+        other.release("10.1.1.1", await other.acquire("10.1.1.1", OTHER, loop.time() + 0.1))
+
+    asyncio.run(main())
+
+
+def test_flag_tasks_go_first(admission):
+    order = []
+
+    async def waiter(priority, name):
+        loop = asyncio.get_running_loop()
+        slot = await admission.acquire("10.1.1.1", priority, loop.time() + 1)
+        order.append(name)
+        admission.release("10.1.1.1", slot)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        slot = await admission.acquire("10.1.1.1", OTHER, loop.time() + 1)
+        waiters = [asyncio.create_task(waiter(OTHER, "noise")), asyncio.create_task(waiter(FLAG, "flag"))]
+        await asyncio.sleep(0.05)
+        admission.release("10.1.1.1", slot)
+        await asyncio.gather(*waiters)
+
+    asyncio.run(main())
+    assert order == ["flag", "noise"]
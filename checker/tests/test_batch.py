@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+from enochecker_core import CheckerMethod, CheckerResultMessage, CheckerTaskResult
+
+import batch
+from batch import run_batch
+from bench import make_task
+
+HOST = "127.0.0.1"
+
+
+def havoc(timeout: int = 15000):
+    return make_task(CheckerMethod.HAVOC, 0, "batch", HOST, timeout=timeout)
+
+
+def collect(handler, tasks) -> list[dict]:
+    async def main():
+        return [json.loads(line) async for line in run_batch(handler, tasks)]
+    return asyncio.run(main())
+
+
+def test_results_stream_as_tasks_finish(monkeypatch):
+    monkeypatch.setattr(batch, "LIMIT", asyncio.Semaphore(8))
+    delays = [0.1, 0.0, 0.05]
+
+    async def handler(task):
+        await asyncio.sleep(delays[task.task_id - tasks[0].task_id])
+        if task.task_id == tasks[2].task_id:
+            raise RuntimeError("handler crashed")
+        return CheckerResultMessage(result=CheckerTaskResult.OK, message="")
+
+    tasks = [havoc() for _ in delays]
+    lines = collect(handler, tasks)
+    assert [line["index"] for line in lines] == [1, 2, 0]
+    assert [line["taskId"] for line in lines] == [tasks[i].task_id for i in (1, 2, 0)]
+    assert lines[0]["result"] == CheckerTaskResult.OK.value
+    assert lines[1]["result"] == CheckerTaskResult.INTERNAL_ERROR.value
+    assert lines[1]["message"] == "handler crashed"
+
+
+def test_queued_tasks_keep_their_deadline(monkeypatch):
+    monkeypatch.setattr(batch, "LIMIT", asyncio.Semaphore(1))
+    timeouts = {}
+
+    async def handler(task):
+        timeouts[task.task_id] = task.timeout
+        await asyncio.sleep(0.2)
+        return CheckerResultMessage(result=CheckerTaskResult.OK, message="")
+
+    # The second task waits for the slot with its timeout running, the
+    # third gives up once only the enochecker buffer would be left
+    buffer = int(batch.TIMEOUT_BUFFER * 1000)
+    tasks = [havoc(), havoc(), havoc(buffer + 100)]
+    lines = {line["index"]: line for line in collect(handler, tasks)}
+
+    assert timeouts[tasks[0].task_id] == 15000
+    assert 14000 < timeouts[tasks[1].task_id] <= 14800
+    assert tasks[2].task_id not in timeouts
+    assert lines[2]["result"] == CheckerTaskResult.INTERNAL_ERROR.value
+    assert lines[2]["message"] == "Batch queue timed out"
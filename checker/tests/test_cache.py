@@ -0,0 +1,113 @@
+import asyncio
+import re
+
+import pytest
+from enochecker3 import ChainDB
+
+import cache
+from cache import ChainCache, ChainFetcher, CachedChainDB
+
+
+class Collection():
+    """In-memory stand-in for the chain state collection, counting round trips."""
+
+    def __init__(self) -> None:
+        self.docs: dict[tuple[str, str], dict] = {}
+        self.queries = []
+
+    async def find_one(self, query):
+        self.queries.append(query)
+        return self.docs.get((query["task_chain_id"], query["key"]))
+
+    async def replace_one(self, query, doc, upsert=False):
+        self.docs[(query["task_chain_id"], query["key"])] = doc
+
+    async def find(self, query):
+        self.queries.append(query)
+        match = query["task_chain_id"]
+        for (chain_id, _), doc in list(self.docs.items()):
+            if "$in" in match and chain_id in match["$in"] or "$regex" in match and re.match(match["$regex"], chain_id):
+                yield doc
+
+
+def test_cache_hit_returns_copy():
+    c = ChainCache(size=10)
+    value = {"notes": [1]}
+    c.put("chain", "key", value, ttl=60)
+    value["notes"].append(2)
+    got = c.get("chain", "key")
+    assert got == {"notes": [1]}
+    got["notes"].append(3)
+    assert c.get("chain", "key") == {"notes": [1]}
+    assert c.stats()["hits"] == 2
+
+
+def test_cache_ttl_and_lru(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    c = ChainCache(size=2)
+    c.put("a", "k", 1, ttl=10)
+    c.put("b", "k", 2, ttl=10)
+    c.get("a", "k")
+    c.put("c", "k", 3, ttl=10)
+    assert c.get("b", "k") is cache._MISSING
+    assert c.stats()["evictions"] == 1
+
+    now[0] += 11
+    assert c.get("a", "k") is cache._MISSING
+    assert c.stats()["expirations"] == 1
+
+
+def test_cached_chaindb_write_through():
+    async def main():
+        collection = Collection()
+        db = CachedChainDB(ChainDB(collection, "chain"), ChainCache(), ttl=60)
+        await db.set("flag_info", ["user", "pw"])
+        assert await db.get("flag_info") == ["user", "pw"]
+        assert collection.queries == []
+
+        fresh = CachedChainDB(ChainDB(collection, "chain"), ChainCache(), ttl=60)
+        assert await fresh.get("flag_info") == ["user", "pw"]
+        assert await fresh.get("flag_info") == ["user", "pw"]
+        assert len(collection.queries) == 1
+        with pytest.raises(KeyError):
+            await fresh.get("noise_info")
+
+    asyncio.run(main())
+
+
+def test_fetcher_batches_misses():
+    async def main():
+        collection = Collection()
+        for chain_id in ("c1", "c2", "c3"):
+            await collection.replace_one({"task_chain_id": chain_id, "key": "k"},
+                                         {"task_chain_id": chain_id, "key": "k", "value": chain_id})
+        fetcher = ChainFetcher(ChainCache(), window=0.01, limit=100, rounds=False)
+        values = await asyncio.gather(*(fetcher.get(collection, c, "k", 60, False) for c in ("c1", "c2", "c3")))
+        with pytest.raises(KeyError):
+            await fetcher.get(collection, "c1", "other", 60, False)
+        return collection, fetcher, values
+
+    collection, fetcher, values = asyncio.run(main())
+    assert values == ["c1", "c2", "c3"]
+    assert collection.queries[0] == {"task_chain_id": {"$in": ["c1", "c2", "c3"]}}
+    assert fetcher.stats()["queries"] == 2
+
+
+def test_fetcher_loads_finished_round():
+    async def main():
+        collection = Collection()
+        chains = [f"flag_s0_r5_t{team}_i0" for team in range(3)] + ["flag_s0_r6_t0_i0"]
+        for chain_id in chains:
+            await collection.replace_one({"task_chain_id": chain_id, "key": "k"},
+                                         {"task_chain_id": chain_id, "key": "k", "value": chain_id})
+        c = ChainCache()
+        fetcher = ChainFetcher(c, window=0, rounds=True)
+        assert await fetcher.get(collection, chains[0], "k", 60, True) == chains[0]
+        return collection, fetcher, c, chains
+
+    collection, fetcher, c, chains = asyncio.run(main())
+    assert fetcher.prefetches == 1
+    assert len(collection.queries) == 1
+    assert c.get(chains[2], "k") == chains[2]
+    assert c.get(chains[3], "k") is cache._MISSING
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+from enochecker_core import CheckerMethod
+
+import checker
+from bench import MemoryCollection, gen_flag, make_task, run_task
+from standin import StandinService
+
+HOST = "127.0.0.1"
+
+
+def with_service(session, **kwargs):
+    """Run `session(service)` against a fresh stand-in and in-memory chain state."""
+    async def main():
+        checker.checker._chain_collection = MemoryCollection()
+        async with StandinService(HOST, checker.SERVICE_PORT, **kwargs) as service:
+            return await session(service)
+    return asyncio.run(main())
+
+
+def test_putflag_retry_after_success():
+    async def session(service):
+        flag = gen_flag()
+        put = make_task(CheckerMethod.PUTFLAG, 0, "flag_retry_ok", HOST, flag=flag)
+        assert (await run_task(put))[0] == "OK"
+        # The engine may run a task again even though it went through
+        assert (await run_task(put))[0] == "OK"
+        get = make_task(CheckerMethod.GETFLAG, 0, "flag_retry_ok", HOST, flag=flag)
+        assert (await run_task(get))[0] == "OK"
+
+    with_service(session)
+
+
+@pytest.mark.parametrize("variant", [0, 1])
+def test_putnoise_retry_after_success(variant):
+    async def session(service):
+        chain = f"noise_retry_ok_v{variant}"
+        put = make_task(CheckerMethod.PUTNOISE, variant, chain, HOST)
+        assert (await run_task(put))[0] == "OK"
+        assert (await run_task(put))[0] == "OK"
+        get = make_task(CheckerMethod.GETNOISE, variant, chain, HOST)
+        assert (await run_task(get))[0] == "OK"
+
+    with_service(session)
+
+
+def test_step_uses_remaining_budget(monkeypatch):
+    async def session(service):
+        havoc = make_task(CheckerMethod.HAVOC, 2, "havoc_budget", HOST)
+        assert (await run_task(havoc))[0] == "OK"
+        monkeypatch.setattr(checker, "STEP_TIMEOUT", 0.05)
+        assert (await run_task(havoc))[0] in ("MUMBLE", "OFFLINE")
+
+    monkeypatch.setattr(checker, "STEP_TIMEOUT", None)
+    with_service(session, latency=0.2)
+
+
+def test_session_gives_up_at_deadline():
+    async def session(service):
+        # 0.5s of budget once the margin is taken off, against 0.2s per response
+        put = make_task(CheckerMethod.PUTFLAG, 0, "flag_deadline", HOST, flag=gen_flag(),
+                        timeout=int((checker.DEADLINE_MARGIN + 0.5) * 1000))
+        result, _, seconds = await run_task(put)
+        assert result in ("MUMBLE", "OFFLINE")
+        assert seconds < 1.5
+
+    with_service(session, latency=0.2)
+
+
+def test_admission_timeout_is_internal_error(monkeypatch, tmp_path):
+    from admission import Admission, OTHER
+
+    admission = Admission(limit=1, directory=str(tmp_path))
+    monkeypatch.setattr(checker, "ADMISSION", admission)
+
+    async def session(service):
+        loop = asyncio.get_running_loop()
+        slot = await admission.acquire(HOST, OTHER, loop.time() + 1)
+        havoc = make_task(CheckerMethod.HAVOC, 2, "havoc_admission", HOST,
+                          timeout=int((checker.DEADLINE_MARGIN + 0.2) * 1000))
+        # The queue is the checker's own limit, its backlog is not the team's fault
+        assert (await run_task(havoc))[0] == "INTERNAL_ERROR"
+        admission.release(HOST, slot)
+        assert (await run_task(havoc))[0] == "OK"
+
+    with_service(session)
+
+
+def test_pipelined_steps_include_service_time(monkeypatch):
+    import metrics
+
+    monkeypatch.setattr(checker, "PIPELINE_ENABLED", True)
+    monkeypatch.setattr(metrics, "REGISTRY", metrics.Registry())
+
+    async def session(service):
+        put = make_task(CheckerMethod.PUTFLAG, 0, "flag_pipelined", HOST, flag=gen_flag())
+        assert (await run_task(put))[0] == "OK"
+
+    with_service(session, latency=0.05)
+    steps = {name: hist.sum for (name, method, _, _), hist in metrics.REGISTRY.steps.items()
+             if method == "putflag"}
+    # Waiting for an answer at a flush counts towards the step that queued it, so
+    # the delayed responses show up in the protocol steps and not just in "flush"
+    assert sum(seconds for name, seconds in steps.items() if name != "flush") >= 0.05
+    assert steps["register"] >= 0.05
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from checkpoint import Checkpoint, PROGRESS_KEY
+
+
+class DB():
+    def __init__(self, values=None) -> None:
+        self.values = dict(values or {})
+        self.gets = []
+
+    async def get(self, key):
+        self.gets.append(key)
+        return self.values[key]
+
+    async def set(self, key, value):
+        self.values[key] = value
+
+
+class Client():
+    def __init__(self) -> None:
+        self.checks_issued = 0
+        self.checks_done = 0
+
+
+def test_completed_counts_confirmed_checks_only():
+    checkpoint = Checkpoint(DB())
+    client = Client()
+    client.checks_issued = 4
+    checkpoint.reached(client, "registered", "bob")
+    client.checks_issued = 9
+    checkpoint.reached(client, "saved", "file1")
+
+    assert checkpoint.completed(3) == {}
+    assert checkpoint.completed(4) == {"registered": ["bob"]}
+    assert checkpoint.completed(9) == {"registered": ["bob"], "saved": ["file1"]}
+
+
+def test_completed_keeps_earlier_steps():
+    checkpoint = Checkpoint(DB(), {"saved": ["file1"]})
+    client = Client()
+    client.checks_issued = 2
+    checkpoint.reached(client, "saved", "file1")
+    checkpoint.reached(client, "saved", "file2")
+    assert checkpoint.completed(2) == {"saved": ["file1", "file2"]}
+
+
+def test_load_first_attempt_skips_progress():
+    db = DB()
+    info, checkpoint = asyncio.run(Checkpoint.load(db, "flag_info"))
+    assert info is None
+    assert not checkpoint.resuming
+    assert db.gets == ["flag_info"]
+
+
+def test_load_retry():
+    db = DB({"flag_info": ["bob", "pw"], PROGRESS_KEY: {"registered": ["bob"]}})
+    info, checkpoint = asyncio.run(Checkpoint.load(db, "flag_info"))
+    assert info == ["bob", "pw"]
+    assert checkpoint.resuming
+    assert checkpoint.done("registered", "bob")
+    assert not checkpoint.done("saved", "file")
+
+    info, checkpoint = asyncio.run(Checkpoint.load(DB({"flag_info": ["bob", "pw"]}), "flag_info"))
+    assert checkpoint.resuming and checkpoint.steps == {}
+
+
+def test_track_stores_progress_on_failure():
+    db = DB()
+    checkpoint = Checkpoint(db)
+    client = Client()
+
+    async def session():
+        async with checkpoint.track(client):
+            client.checks_issued = 3
+            checkpoint.reached(client, "registered", "bob")
+            client.checks_issued = 5
+            checkpoint.reached(client, "saved", "file")
+            client.checks_done = 4
+            raise ConnectionError
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(session())
+    assert db.values[PROGRESS_KEY] == {"registered": ["bob"]}
+
+
+def test_track_writes_nothing_on_success():
+    db = DB()
+    checkpoint = Checkpoint(db)
+    client = Client()
+
+    async def session():
+        async with checkpoint.track(client):
+            checkpoint.reached(client, "registered", "bob")
+
+    asyncio.run(session())
+    assert db.values == {}
+
+
+class Listing():
+    def __init__(self, saved) -> None:
+        self.saved = {filename.encode() for filename in saved}
+        self.listed = 0
+
+    async def list_notes(self):
+        self.listed += 1
+        return self
+
+
+def test_find_saved_on_retry():
+    checkpoint = Checkpoint(DB(), {"saved": ["a"]}, resuming=True)
+    client = Listing(["a", "b"])
+    asyncio.run(checkpoint.find_saved(client, ["a", "b", "c"]))
+    assert checkpoint.done("saved", "b")
+    assert not checkpoint.done("saved", "c")
+    assert checkpoint.steps == {"saved": ["a", "b"]}
+
+
+def test_find_saved_lists_only_when_needed():
+    client = Listing(["a"])
+    asyncio.run(Checkpoint(DB()).find_saved(client, ["a"]))
+    asyncio.run(Checkpoint(DB(), {"saved": ["a"]}, resuming=True).find_saved(client, ["a"]))
+    assert client.listed == 0
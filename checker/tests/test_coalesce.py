@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from coalesce import Coalescer
+
+
+def test_jobs_within_window_share_a_batch():
+    batches = []
+
+    async def runner(batch):
+        batches.append([job for job, _ in batch])
+        for job, fut in batch:
+            fut.set_result(job * 2)
+
+    async def main():
+        coalescer = Coalescer(window=0.01, limit=9)
+        results = await asyncio.gather(*(coalescer.submit("team", i, runner) for i in range(3)))
+        return coalescer, results
+
+    coalescer, results = asyncio.run(main())
+    assert results == [0, 2, 4]
+    assert batches == [[0, 1, 2]]
+    assert coalescer.stats()["batches"] == 1
+
+
+def test_full_batch_runs_without_waiting():
+    batches = []
+
+    async def runner(batch):
+        batches.append(len(batch))
+        for _, fut in batch:
+            fut.set_result(True)
+
+    async def main():
+        coalescer = Coalescer(window=60, limit=2)
+        await asyncio.wait_for(asyncio.gather(*(coalescer.submit("team", i, runner) for i in range(4))), 1)
+
+    asyncio.run(main())
+    assert batches == [2, 2]
+
+
+def test_keys_do_not_mix():
+    batches = []
+
+    async def runner(batch):
+        batches.append(sorted(job for job, _ in batch))
+        for _, fut in batch:
+            fut.set_result(True)
+
+    async def main():
+        coalescer = Coalescer(window=0.01, limit=9)
+        await asyncio.gather(coalescer.submit("a", 1, runner), coalescer.submit("b", 2, runner),
+                             coalescer.submit("a", 3, runner))
+
+    asyncio.run(main())
+    assert sorted(batches) == [[1, 3], [2]]
+
+
+def test_runner_failure_and_fallback():
+    async def failing(batch):
+        raise ValueError("broken")
+
+    async def partial(batch):
+        batch[0][1].set_result("done")
+
+    async def main():
+        coalescer = Coalescer(window=0.01, limit=9)
+        with pytest.raises(ValueError):
+            await coalescer.submit("a", 1, failing)
+        results = await asyncio.gather(coalescer.submit("b", 1, partial), coalescer.submit("b", 2, partial))
+        return coalescer, results
+
+    coalescer, results = asyncio.run(main())
+    # The job the runner left alone runs standalone
+    assert results == ["done", None]
+    assert coalescer.fallbacks == 1
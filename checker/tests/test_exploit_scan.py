@@ -0,0 +1,51 @@
+import asyncio
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+import checker
+from checker import ExploitScan
+
+TASK = SimpleNamespace(flag_regex="ENO[A-Za-z0-9+/=]{48}", flag_hash="")
+
+
+class FakeClient():
+    """Loads files by recording them, or fails after `fail_after` seconds."""
+
+    def __init__(self, fail_after=None) -> None:
+        self.fail_after = fail_after
+        self.loaded = []
+
+    async def load_note(self, slot, filename):
+        if self.fail_after is not None:
+            await asyncio.sleep(self.fail_after)
+            raise ConnectionResetError("helper lost its connection")
+        await asyncio.sleep(0)
+        self.loaded.append(filename)
+
+    async def list_notes(self):
+        return SimpleNamespace(saved=[])
+
+
+@pytest.mark.parametrize("fail_after", [0, 0.05])
+def test_failed_helper_hands_files_back(monkeypatch, fail_after):
+    monkeypatch.setattr(checker, "EXPLOIT_CONNECTIONS", 2)
+
+    async def helper(self):
+        await self.scan(FakeClient(fail_after))
+
+    monkeypatch.setattr(ExploitScan, "helper", helper)
+
+    async def main():
+        scan = ExploitScan(TASK, logging.getLogger("test"))
+        filenames = [b"file%02d" % i for i in range(18)]
+        scan.add(filenames)
+        client = FakeClient()
+        # Whether the helper fails while the main connection is still busy or
+        # after it ran dry, the main connection lists its files
+        assert await scan.run(client) is None
+        return filenames, client.loaded
+
+    filenames, loaded = asyncio.run(main())
+    assert sorted(loaded) == [name.decode() for name in filenames]
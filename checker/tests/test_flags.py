@@ -0,0 +1,62 @@
+import asyncio
+import hashlib
+
+from flags import FlagStream, FLAG_OVERLAP
+
+REGEX = r"ENO[A-Za-z0-9+/=]{8,}"
+FLAG = b"ENOabcdefgh12345678"
+
+
+def test_flag_within_chunk():
+    stream = FlagStream(REGEX)
+    stream.feed(b"note: " + FLAG + b"\n> ")
+    assert stream.found == [FLAG]
+
+
+def test_flag_split_across_chunks():
+    stream = FlagStream(REGEX)
+    stream.feed(b"x" * 1000 + FLAG[:7])
+    assert stream.found == []
+    stream.feed(FLAG[7:] + b"\n")
+    assert stream.found == [FLAG]
+
+
+def test_match_at_chunk_end_is_held_back():
+    stream = FlagStream(REGEX)
+    stream.feed(b"note: " + FLAG[:12])
+    assert stream.found == []
+    stream.feed(FLAG[12:])
+    assert stream.found == []
+    stream.feed(b"\n")
+    assert stream.found == [FLAG]
+
+
+def test_finish_collects_held_back_match():
+    stream = FlagStream(REGEX)
+    stream.feed(FLAG)
+    stream.finish()
+    assert stream.found == [FLAG]
+
+
+def test_flag_seen_once():
+    stream = FlagStream(REGEX)
+    stream.feed(FLAG + b"\n")
+    stream.feed(b"more\n")
+    stream.feed(FLAG + b"\n")
+    assert stream.found == [FLAG]
+
+
+def test_flag_hash():
+    event = asyncio.Event()
+    other = b"ENOzzzzzzzzzzzz"
+    stream = FlagStream(REGEX, hashlib.sha256(FLAG).hexdigest(), event)
+    stream.feed(other + b"\n" + FLAG[:10])
+    assert stream.found == [] and not event.is_set()
+    stream.feed(FLAG[10:])
+    assert stream.found == [FLAG] and event.is_set()
+
+
+def test_tail_is_bounded():
+    stream = FlagStream(REGEX)
+    stream.feed(b"x" * (FLAG_OVERLAP * 3))
+    assert len(stream.tail) == FLAG_OVERLAP
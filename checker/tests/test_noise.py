@@ -0,0 +1,40 @@
+import itertools
+
+from noise import NoiseCorpus
+
+
+class CountingCorpus(NoiseCorpus):
+    """Numbered phrases instead of Faker, so old and new corpora can be told apart."""
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.counter = itertools.count()
+
+    def phrase(self) -> bytes:
+        return b"phrase%d" % next(self.counter)
+
+
+def test_picks_come_from_the_corpus():
+    corpus = CountingCorpus(size=8, rotate_interval=3600)
+    notes = corpus.batch(50, max_len=6)
+    assert corpus.pick() in {b"phrase%d" % i for i in range(8)}
+    assert all(note == b"phrase" for note in notes)
+    assert corpus.rotations == 0
+
+
+def test_rotation_is_spread_over_picks():
+    corpus = CountingCorpus(size=8, rotate_interval=0, rotate_step=3)
+    corpus.build()
+    old = corpus.corpus
+
+    # 3 + 3 phrases of the replacement, the old corpus is still served
+    corpus.pick()
+    corpus.pick()
+    assert corpus.corpus is old
+    assert len(corpus.next) == 6
+
+    # The last 2 complete it and it is swapped in
+    corpus.pick()
+    assert corpus.rotations == 1
+    assert corpus.next == []
+    assert set(corpus.batch(20)) <= {b"phrase%d" % i for i in range(8, 16)}
@@ -0,0 +1,71 @@
+import asyncio
+import socket
+import time
+
+import pool
+from pool import ConnectionPool
+from standin import StandinService
+
+HOST = "127.0.0.1"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+async def settle(conns: ConnectionPool) -> None:
+    while conns.tasks:
+        await asyncio.gather(*conns.tasks)
+
+
+def test_warm_connection_is_reused():
+    async def main():
+        port = free_port()
+        async with StandinService(HOST, port):
+            conns = ConnectionPool(port, size=1)
+            assert conns.acquire(HOST) is None
+            await settle(conns)
+            conn = conns.acquire(HOST)
+            assert conn is not None
+            assert conn.parser.pending().endswith(b"> ")
+            conn.writer.close()
+            await settle(conns)
+            for idle in conns.idle.get(HOST, ()):
+                idle.writer.close()
+            return conns.stats()
+
+    stats = asyncio.run(main())
+    assert (stats["hits"], stats["misses"], stats["failed"]) == (1, 1, 0)
+
+
+def test_failed_warm_up_backs_off(monkeypatch):
+    monkeypatch.setattr(pool, "POOL_BACKOFF", 10)
+    monkeypatch.setattr(pool, "POOL_BACKOFF_MAX", 15)
+
+    async def main():
+        conns = ConnectionPool(free_port(), size=2)
+        assert conns.acquire(HOST) is None
+        await settle(conns)
+        failures, until = conns.backoff[HOST]
+        assert until > time.monotonic() + 5
+
+        # A team that is down is not dialed again on the next task
+        assert conns.acquire(HOST) is None
+        assert not conns.tasks
+        assert conns.skipped == 1
+
+        # Once the backoff has passed, the next failure doubles it up to the maximum
+        conns.backoff[HOST] = (failures, 0.0)
+        conns.refill(HOST)
+        await settle(conns)
+        again, until = conns.backoff[HOST]
+        assert 10 < until - time.monotonic() <= 15
+        return failures, again, conns
+
+    failures, again, conns = asyncio.run(main())
+    # Both warm-ups of a refill fail, and each counts
+    assert (failures, again) == (2, 4)
+    assert conns.failed == 4
+    assert conns.stats()["backing_off"] == 1
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+from enochecker_core import CheckerMethod
+
+import checker
+import profiling
+from bench import MemoryCollection, make_task, run_task
+from profiling import CONTROL, Profiler
+from standin import StandinService
+
+HOST = "127.0.0.1"
+
+
+def test_setting_reaches_other_workers(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    config = profiler.configure({"enabled": True, "threshold": 0.5, "methods": ["exploit0"]})
+    assert (config["enabled"], config["threshold"], config["methods"]) == (True, 0.5, ["exploit0"])
+
+    other = Profiler(str(tmp_path))
+    other.refresh()
+    assert other.config == config
+
+    with pytest.raises(ValueError):
+        profiler.configure({"threshold": -1})
+    with pytest.raises(ValueError):
+        profiler.configure({"sampling": True})
+    assert profiler.config == config
+
+
+def test_only_valid_profile_names_are_read(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    profiler.configure({"enabled": True})
+    with pytest.raises(KeyError):
+        profiler.read(CONTROL)
+    with pytest.raises(KeyError):
+        profiler.read("../secrets.json")
+    assert profiler.listing()["profiles"] == []
+
+
+def test_slow_task_keeps_its_profile(monkeypatch, tmp_path):
+    profiler = Profiler(str(tmp_path))
+    profiler.configure({"enabled": True, "threshold": 0.0, "interval": 0.005, "methods": ["havoc2"]})
+    monkeypatch.setattr(profiling, "PROFILER", profiler)
+
+    async def main():
+        checker.checker._chain_collection = MemoryCollection()
+        async with StandinService(HOST, checker.SERVICE_PORT, latency=0.05):
+            for variant in (1, 2):
+                task = make_task(CheckerMethod.HAVOC, variant, "havoc_profiled", HOST)
+                assert (await run_task(task))[0] == "OK"
+
+    asyncio.run(main())
+    profiler.configure({"enabled": False})
+    profiler.thread.join(1)
+    assert not profiler.thread.is_alive()
+
+    # havoc1 is not in the methods profiled
+    [name] = profiler.listing()["profiles"]
+    report = profiler.read(name)
+    assert report["label"] == "havoc2" and report["outcome"] == "OK"
+    assert report["samples"] > 0
+    # Most of a session against a slow service is spent waiting for its answers
+    assert max(report["breakdown"], key=report["breakdown"].get) == "wait:read"
+    assert report["steps"]
+    assert profiling.collapsed(report).count("\n") == len(report["stacks"])
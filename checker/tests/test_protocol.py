@@ -0,0 +1,120 @@
+import pytest
+from enochecker3 import MumbleException
+
+from protocol import ProtocolParser, NoteList, Menu, NoteEntry, SavedEntry, EndOfNotes, BANNER
+
+LISTING = (
+    b"\n\n===== [bob's Notes] =====\n"
+    b"Currently Loaded:\n"
+    b"    0 | Well, it's a note\n"
+    b"    3 | a | with bars\n"
+    b"Saved Notes:\n"
+    b" | .\n"
+    b" | ..\n"
+    b" | passwd\n"
+    b"===== [End of Notes] =====\n"
+)
+
+
+def parse(parser, data, step=None):
+    events = []
+    for i in range(0, len(data), step or len(data)):
+        parser.feed(data[i:i + (step or len(data))])
+        events += parser.events()
+    return events
+
+
+def test_take_until_and_exactly():
+    parser = ProtocolParser()
+    parser.feed(BANNER[:5])
+    assert parser.take_until(BANNER) is None
+    parser.feed(BANNER[5:] + b"> x")
+    assert parser.take_until(BANNER) == BANNER
+    assert parser.take_exactly(4) is None
+    assert parser.take_exactly(2) == b"> "
+    assert parser.pending() == b"x"
+
+
+def test_menu():
+    parser = ProtocolParser()
+    parser.expect_menu(None)
+    events = parse(parser, b"junk\n===== [Unauthenticated] =====\n   1. Register\n   2. Login\n> ", step=7)
+    assert events == [Menu(b"Unauthenticated")]
+    assert parser.idle
+    assert parser.pending() == b"> "
+
+
+def test_menu_wrong_item():
+    parser = ProtocolParser()
+    parser.expect_menu("bob")
+    parser.feed(b"===== [bob] =====\n   1. Create\n   2. Delete\n")
+    with pytest.raises(MumbleException):
+        list(parser.events())
+    assert parser.idle
+
+
+@pytest.mark.parametrize("step", [None, 1, 13])
+def test_listing(step):
+    parser = ProtocolParser()
+    parser.expect_listing("bob")
+    events = parse(parser, LISTING, step)
+    assert events == [
+        NoteEntry(0, b"Well, it's a note"),
+        NoteEntry(3, b"a | with bars"),
+        SavedEntry(b"."),
+        SavedEntry(b".."),
+        SavedEntry(b"passwd"),
+        EndOfNotes(),
+    ]
+    assert parser.idle
+
+
+def test_listing_skips_lines_before_first_section():
+    parser = ProtocolParser()
+    parser.expect_listing("bob")
+    data = LISTING.replace(b"Currently Loaded:\n", b"something else\nCurrently Loaded:\n")
+    assert NoteEntry(3, b"a | with bars") in parse(parser, data)
+    assert parser.idle
+
+
+@pytest.mark.parametrize("section", [b"Currently Loaded:\n", b"Saved Notes:\n"])
+def test_listing_unknown_line_in_section(section):
+    parser = ProtocolParser()
+    parser.expect_listing("bob")
+    parser.feed(b"\n\n===== [bob's Notes] =====\n" + section + b"something else\n")
+    with pytest.raises(MumbleException):
+        list(parser.events())
+
+
+def test_listing_malformed_note():
+    parser = ProtocolParser()
+    parser.expect_listing("bob")
+    parser.feed(b"\n\n===== [bob's Notes] =====\nCurrently Loaded:\n    x | note\n")
+    with pytest.raises(MumbleException):
+        list(parser.events())
+
+
+def test_notelist_slots():
+    notes = NoteList([b"a"])
+    notes[2] = b"two"
+    assert 2 in notes and 3 not in notes
+    assert notes[3] is None
+    assert notes.get(3, b"-") == b"-"
+    del notes[2]
+    assert 2 not in notes
+
+
+def test_notelist_missing():
+    expected = NoteList([b".", b"saved"])
+    expected[0] = b"default"
+    expected[4] = b"four"
+
+    actual = NoteList([b".", b"..", b"other"])
+    actual[0] = b"default"
+    actual[4] = b"changed"
+    actual[5] = b"extra"
+
+    assert expected.missing(actual) == ([4], {b"saved"})
+    actual[4] = b"four"
+    actual.saved.add(b"saved")
+    assert expected.missing(actual) == ([], set())
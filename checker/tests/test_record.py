@@ -0,0 +1,59 @@
+import asyncio
+
+from enochecker_core import CheckerMethod
+
+import checker
+import record
+from bench import MemoryCollection, gen_flag, make_task, run_task
+from record import Recorder
+from replay import Recording, Replay, read_log
+from standin import StandinService
+
+HOST = "127.0.0.1"
+
+
+def test_bytes_survive_a_round_trip():
+    line = record.dumps({"state": ["chain", "key", [b"\x00user", "text", 3]]})
+    assert record.loads(line) == {"state": ["chain", "key", [b"\x00user", "text", 3]]}
+
+
+def test_truncated_log_is_read_up_to_the_damage(tmp_path):
+    recorder = Recorder(str(tmp_path))
+    recorder.write({"done": 1})
+    recorder.write({"done": 2})
+    recorder.file.close()
+    [path] = tmp_path.iterdir()
+    data = path.read_bytes()
+    # A worker that was killed mid-write leaves a gzip stream without its end
+    path.write_bytes(data[:-8])
+    records = read_log([str(tmp_path)])
+    assert [r["done"] for r in records] == [1, 2]
+
+
+def test_recorded_tasks_replay(monkeypatch, tmp_path):
+    recorder = Recorder(str(tmp_path))
+    monkeypatch.setattr(record, "RECORDER", recorder)
+
+    async def main():
+        async with StandinService(HOST, checker.SERVICE_PORT):
+            checker.checker._chain_collection = MemoryCollection()
+            flag = gen_flag()
+            for method in (CheckerMethod.PUTFLAG, CheckerMethod.GETFLAG):
+                task = make_task(method, 0, "flag_recorded", HOST, flag=flag)
+                assert (await run_task(task))[0] == "OK"
+            recorder.file.close()
+            monkeypatch.setattr(recorder, "directory", "")
+
+            recording = Recording(read_log([str(tmp_path)]))
+            checker.checker._chain_collection = MemoryCollection()
+            replay = Replay(recording, {HOST: HOST}, speed=100, concurrency=0)
+            await replay.seed()
+            return recording, await replay.run()
+
+    recording, summary = asyncio.run(main())
+    assert [r["task"]["method"] for r in recording.tasks] == ["putflag", "getflag"]
+    assert [done["result"] for done in recording.done.values()] == ["OK", "OK"]
+    # The get follows the put in the log, so nothing needs seeding
+    assert summary["seeded"] == 0
+    assert {name: m["results"] for name, m in summary["methods"].items()} == {
+        "putflag0": {"OK": 1}, "getflag0": {"OK": 1}}
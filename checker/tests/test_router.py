@@ -0,0 +1,62 @@
+import pytest
+
+from router import HashRing, Router, read_timeout
+
+NODES = [f"http://checker-{i}:8000" for i in range(4)]
+TEAMS = [f"10.1.{i}.1" for i in range(1000)]
+
+
+def test_lookup_is_stable():
+    ring = HashRing(NODES)
+    again = HashRing(reversed(NODES))
+    assert all(ring.lookup(team) == again.lookup(team) for team in TEAMS)
+    assert HashRing().lookup("10.1.1.1") is None
+
+
+def test_shares_are_even():
+    shares = HashRing(NODES).shares()
+    assert sum(shares.values()) == pytest.approx(1.0)
+    assert all(0.15 < share < 0.35 for share in shares.values())
+
+
+def test_adding_a_node_moves_only_its_teams():
+    ring = HashRing(NODES[:3])
+    before = {team: ring.lookup(team) for team in TEAMS}
+    ring.add(NODES[3])
+    moved = [team for team in TEAMS if ring.lookup(team) != before[team]]
+    assert all(ring.lookup(team) == NODES[3] for team in moved)
+    assert 0.1 * len(TEAMS) < len(moved) < 0.4 * len(TEAMS)
+
+    ring.remove(NODES[3])
+    assert {team: ring.lookup(team) for team in TEAMS} == before
+
+
+def test_skip_goes_to_next_node():
+    ring = HashRing(NODES)
+    owner = ring.lookup(TEAMS[0])
+    other = ring.lookup(TEAMS[0], {owner})
+    assert other not in (owner, None)
+    assert ring.lookup(TEAMS[0], set(NODES)) is None
+
+
+def test_route_falls_back_to_owner_when_all_down():
+    router = Router(NODES[:2], allowed=NODES[:2])
+    owner = router.route(TEAMS[0])
+    router.failed(owner)
+    assert router.route(TEAMS[0]) not in (owner, None)
+    router.failed(router.route(TEAMS[0]))
+    assert router.route(TEAMS[0]) == owner
+
+
+def test_set_nodes_only_allows_known_nodes():
+    router = Router(NODES[:2], allowed=NODES)
+    router.set_nodes([NODES[1], NODES[2] + "/"])
+    assert router.ring.nodes == [NODES[1], NODES[2]]
+    with pytest.raises(ValueError):
+        router.set_nodes([NODES[0], "http://attacker:8000"])
+    assert router.ring.nodes == [NODES[1], NODES[2]]
+
+
+def test_read_timeout_follows_tasks():
+    assert read_timeout([{"timeout": 10000}, {"timeout": 20000}]).read == pytest.approx(20 + 5)
+    assert read_timeout([{"timeout": "soon"}]).read == read_timeout([]).read
@@ -0,0 +1,35 @@
+import transcript
+from transcript import RECEIVED, SENT, Transcript, traced
+
+
+def test_render_lists_chunks_in_order():
+    t = Transcript()
+    t.record(RECEIVED, b"> ")
+    t.record(SENT, b"1\n")
+    lines = t.render().splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith("+") and lines[0].endswith(">>> b'> '")
+    assert lines[1].endswith("<<< b'1\\n'")
+
+
+def test_oldest_chunks_are_dropped(monkeypatch):
+    monkeypatch.setattr(transcript, "TRANSCRIPT_ENTRIES", 3)
+    monkeypatch.setattr(transcript, "TRANSCRIPT_BYTES", 10)
+    t = Transcript()
+    for i in range(5):
+        t.record(SENT, b"%d\n" % i)
+    assert [data for _, _, data in t.entries] == [b"2\n", b"3\n", b"4\n"]
+
+    # A chunk over the byte limit pushes out everything before it, but is kept itself
+    t.record(RECEIVED, b"x" * 20)
+    assert len(t.entries) == 1 and t.size == 20
+    assert t.dropped == 5
+    assert t.render().startswith("... 5 earlier chunks dropped\n")
+
+
+def test_traced_addresses(monkeypatch):
+    monkeypatch.setattr(transcript, "TRACED", {"10.1.1.1"})
+    assert traced("10.1.1.1")
+    assert not traced("10.1.2.1")
+    monkeypatch.setattr(transcript, "TRACED", {"*"})
+    assert traced("10.1.2.1")
@@ -0,0 +1,317 @@
+"""Delete files and empty directories under the data dir once they are older than max-age.
+
+Replaces a periodic `find -mmin +30 -delete` over the whole tree. Every
+file and directory sits in a min-heap keyed by the time it expires; inotify
+keeps the heap current as the service writes, and only entries that are
+actually due get stat'ed and deleted. A reconcile scan every few minutes
+picks up anything inotify missed (queue overflows, watch limits). An entry
+that cannot be read or deleted is logged and skipped until then, like
+`find` did, rather than stopping the daemon.
+
+    python3 expiry.py /service/data --user author --max-age 1800
+"""
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import heapq
+import os
+import pwd
+import select
+import stat
+import struct
+import time
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+# Events that add or remove a directory entry, which also bumps the directory's own mtime
+DIR_CHANGES = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+
+EVENT = struct.Struct("iIII")
+
+
+def log(*args):
+    print(time.strftime("%Y-%m-%d %H:%M:%S"), *args, flush=True)
+
+
+class Inotify():
+    def __init__(self) -> None:
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        return wd
+
+    def read(self):
+        """Yield (wd, mask, name) for everything queued, without blocking."""
+        while True:
+            try:
+                buf = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _, length = EVENT.unpack_from(buf, offset)
+                offset += EVENT.size
+                name = buf[offset:offset + length].rstrip(b"\0")
+                offset += length
+                yield wd, mask, os.fsdecode(name)
+
+
+class Expiry():
+    def __init__(self, root: str, max_age: float, uid: int, batch: int) -> None:
+        self.root = os.path.abspath(root)
+        self.max_age = max_age
+        self.uid = uid
+        self.batch = batch
+        self.inotify = Inotify()
+        # path -> mtime the heap entry for it was pushed with, older entries are stale
+        self.mtimes: dict[str, float] = {}
+        self.heap: list[tuple[float, str]] = []
+        self.watches: dict[int, str] = {}
+        self.watched: dict[str, int] = {}
+        self.unwatched = 0
+        self.reset_counters()
+
+    def reset_counters(self) -> None:
+        self.events = 0
+        self.stats = 0
+        self.deleted = 0
+        self.errors = 0
+        self.sweeps = 0
+        self.sweep_seconds = 0.0
+        self.backlog = 0
+
+    def skip(self, path: str, e: OSError) -> None:
+        self.errors += 1
+        log(f"skipping {path}: {e.strerror or e}")
+
+    def watch(self, path: str) -> None:
+        if path in self.watched:
+            return
+        try:
+            wd = self.inotify.add_watch(path, WATCH_MASK)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                # Out of inotify watches, the reconcile scan still covers this directory
+                self.unwatched += 1
+                return
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                self.skip(path, e)
+            return
+        self.watches[wd] = path
+        self.watched[path] = wd
+
+    def unwatch(self, wd: int) -> None:
+        path = self.watches.pop(wd, None)
+        if path is not None and self.watched.get(path) == wd:
+            del self.watched[path]
+
+    def track(self, path: str, st: os.stat_result) -> None:
+        if st.st_uid != self.uid:
+            return
+        if self.mtimes.get(path) != st.st_mtime:
+            self.mtimes[path] = st.st_mtime
+            heapq.heappush(self.heap, (st.st_mtime + self.max_age, path))
+
+    def refresh(self, path: str) -> None:
+        self.stats += 1
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            self.mtimes.pop(path, None)
+            return
+        except OSError as e:
+            self.skip(path, e)
+            return
+        if stat.S_ISDIR(st.st_mode):
+            is_new = path not in self.watched
+            self.watch(path)
+            if is_new:
+                # Entries created before the watch was in place
+                self.scan(path)
+        self.track(path, st)
+
+    def scan(self, top: str) -> set[str]:
+        seen = set()
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            try:
+                entries = list(os.scandir(path))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            except OSError as e:
+                self.skip(path, e)
+                continue
+            for entry in entries:
+                self.stats += 1
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    self.skip(entry.path, e)
+                    continue
+                seen.add(entry.path)
+                if stat.S_ISDIR(st.st_mode):
+                    self.watch(entry.path)
+                    stack.append(entry.path)
+                self.track(entry.path, st)
+        return seen
+
+    def reconcile(self) -> None:
+        start = time.perf_counter()
+        self.watch(self.root)
+        seen = self.scan(self.root)
+        gone = [path for path in self.mtimes if path not in seen]
+        for path in gone:
+            del self.mtimes[path]
+        log(f"reconcile: {len(seen)} entries, {len(self.mtimes)} tracked, {len(gone)} vanished,"
+            f" {len(self.watched)} watches ({self.unwatched} over the limit)"
+            f" in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    def handle_events(self) -> bool:
+        """Apply queued inotify events, returns False if the queue overflowed."""
+        changed = set()
+        overflow = False
+        for wd, mask, name in self.inotify.read():
+            self.events += 1
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & IN_IGNORED:
+                self.unwatch(wd)
+                continue
+            parent = self.watches.get(wd)
+            if parent is None or mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                continue
+            if name:
+                changed.add(os.path.join(parent, name))
+            if mask & DIR_CHANGES and parent != self.root:
+                changed.add(parent)
+
+        for path in changed:
+            self.refresh(path)
+        return not overflow
+
+    def sweep(self) -> None:
+        start = time.perf_counter()
+        now = time.time()
+        deleted = 0
+        while self.heap and self.heap[0][0] <= now and deleted < self.batch:
+            expires, path = heapq.heappop(self.heap)
+            mtime = expires - self.max_age
+            if self.mtimes.get(path) != mtime:
+                continue
+
+            self.stats += 1
+            try:
+                st = os.lstat(path)
+            except FileNotFoundError:
+                del self.mtimes[path]
+                continue
+            except OSError as e:
+                # Untracked until the next reconcile finds it again
+                del self.mtimes[path]
+                self.skip(path, e)
+                continue
+            if st.st_mtime != mtime:
+                # Missed the event that touched it
+                del self.mtimes[path]
+                self.track(path, st)
+                continue
+
+            try:
+                if stat.S_ISDIR(st.st_mode):
+                    os.rmdir(path)
+                else:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                if e.errno == errno.ENOTEMPTY:
+                    # Deleting its entries bumps its mtime again, which puts it back in the heap
+                    continue
+                del self.mtimes[path]
+                self.skip(path, e)
+                continue
+            del self.mtimes[path]
+            deleted += 1
+
+        self.backlog = sum(1 for expires, _ in self.heap if expires <= now) if deleted >= self.batch else 0
+        self.deleted += deleted
+        self.sweeps += 1
+        self.sweep_seconds += time.perf_counter() - start
+
+    def report(self, interval: float) -> None:
+        next_due = max(0.0, self.heap[0][0] - time.time()) if self.heap else None
+        log(f"tracked {len(self.mtimes)}, heap {len(self.heap)}, backlog {self.backlog},"
+            f" deleted {self.deleted} ({self.errors} errors) in {self.sweeps} sweeps ({self.sweep_seconds * 1000:.1f}ms),"
+            f" {self.events} events, {self.stats} stats over {interval:.0f}s,"
+            f" next expiry in {'-' if next_due is None else f'{next_due:.0f}s'}")
+        self.reset_counters()
+
+    def run(self, reconcile_interval: float, report_interval: float) -> None:
+        poll = select.poll()
+        poll.register(self.inotify.fd, select.POLLIN)
+        self.reconcile()
+        next_reconcile = time.monotonic() + reconcile_interval
+        next_report = time.monotonic() + report_interval
+
+        while True:
+            wait = min(next_reconcile, next_report) - time.monotonic()
+            if self.heap:
+                wait = min(wait, self.heap[0][0] - time.time())
+            if self.backlog:
+                wait = 0
+            poll.poll(max(0, wait) * 1000)
+
+            if not self.handle_events():
+                log("inotify queue overflowed, reconciling")
+                next_reconcile = 0
+            self.sweep()
+
+            if time.monotonic() >= next_reconcile:
+                self.reconcile()
+                next_reconcile = time.monotonic() + reconcile_interval
+            if time.monotonic() >= next_report:
+                self.report(report_interval)
+                next_report = time.monotonic() + report_interval
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Expire old files under the bambi-notes data dir")
+    parser.add_argument("root")
+    parser.add_argument("--user", default="author", help="only delete entries owned by this user")
+    parser.add_argument("--max-age", type=float, default=30 * 60, help="seconds since last modification")
+    parser.add_argument("--reconcile", type=float, default=10 * 60, help="seconds between full scans")
+    parser.add_argument("--report", type=float, default=60, help="seconds between stat lines")
+    parser.add_argument("--batch", type=int, default=1000, help="max deletions before handling events again")
+    args = parser.parse_args()
+
+    expiry = Expiry(args.root, args.max_age, pwd.getpwnam(args.user).pw_uid, args.batch)
+    expiry.run(args.reconcile, args.report)
+
+
+if __name__ == "__main__":
+    main()